@@ -1,6 +1,6 @@
 import React, { useEffect, useRef } from 'react';
 
-export default function Map({ points }) {
+export default function Map({ points, clusters }) {
   const mapRef = useRef(null);
   const mapInstance = useRef(null);
 
@@ -44,6 +44,33 @@ export default function Map({ points }) {
         });
       };
 
+      const createClusterIcon = (count) => {
+        const size = Math.min(28 + Math.log2(count) * 6, 64);
+        return L.divIcon({
+          html: `
+            <div style="width:${size}px;height:${size}px;line-height:${size}px;border-radius:50%;background:rgba(51,136,255,0.8);border:2px solid white;color:white;font-weight:bold;text-align:center;">${count}</div>
+          `,
+          className: 'cluster-marker',
+          iconSize: [size, size],
+          iconAnchor: [size / 2, size / 2],
+        });
+      };
+
+      // markers returned by the map_viewport tool
+      if (clusters && Array.isArray(clusters)) {
+        clusters.forEach(cluster => {
+          const types = Object.entries(cluster.type_counts || {})
+            .map(([type, count]) => `${type}: ${count}`)
+            .join('<br/>');
+
+          L.marker([cluster.lat, cluster.lon], {
+            icon: cluster.count > 1 ? createClusterIcon(cluster.count) : createCustomIcon(cluster.color || '#3388ff')
+          })
+            .addTo(map)
+            .bindPopup(cluster.count > 1 ? types : (cluster.label || cluster.dominant_type || 'Location'));
+        });
+      }
+
       if (points && Array.isArray(points)) {
         points.forEach(point => {
           L.marker([point.lat, point.lng], {
@@ -63,7 +90,7 @@ export default function Map({ points }) {
         mapInstance.current = null;
       }
     };
-  }, [points]);
+  }, [points, clusters]);
 
   return <div ref={mapRef} className="w-full h-full"></div>;
 }
@@ -1,4 +1,4 @@
-from modules import AB, GF, Depot, POI, GeoTools, Oblast, InspectionTools, Metadata
+from modules import AB, GF, Depot, POI, GeoTools, Oblast, InspectionTools, Metadata, ResultCache, Executors, Scheduler, Manifest
 from fastmcp import FastMCP
 from mcp.types import Icon
 from typing import Optional
@@ -41,9 +41,11 @@ def react_map(name: str):
 # ------- auxiliary - tools -------------
 
 @mcp.tool 
-def near_assets(origin: str, radius: float = 150, mode: str = "ground") -> dict:
+@Executors.offload("network")
+@ResultCache.cached
+def near_assets(origin: str, radius: float = 150, mode: str | list[str] = "ground") -> dict | list:
     """
-    Find assets (airfield, ground forces or airfields) near an origin place.
+    Find assets (airfield, ground forces, depots or points of interest) near an origin place.
 
     Args:
         origin: Place name (city, address, landmark)
@@ -52,13 +54,147 @@ def near_assets(origin: str, radius: float = 150, mode: str = "ground") -> dict:
             airfield
             ground
             depot
+            poi
+            all (every database at once)
+            or a list of the above, e.g. ["airfield", "depot"]
         
     Returns:
-        List of bases in the area with their types
+        For a single mode, the bases in the area grouped by table.
+        For "all" or a list, one list of bases sorted by distance, each
+        tagged with its database, source table and distance in km
     """
     return GeoTools.near_bases(origin, radius, mode)
 
 @mcp.tool
+@Executors.offload("network")
+@ResultCache.cached
+def nearest_assets(origin: str, k: int = 10, modes: Optional[list[str]] = None) -> list | dict:
+    """
+    Find the k assets closest to an origin place, across asset classes.
+
+    Args:
+        origin: Place name (city, address, landmark)
+        k: Number of assets to return (default 10)
+        modes: Databases to search, any of:
+            airfield
+            ground
+            depot
+            poi
+            (default: airfield, ground and depot)
+
+    Returns:
+        The k nearest assets sorted by distance, each tagged with its
+        database, source table, asset id and distance in km
+    """
+    return GeoTools.nearest_bases(origin, k, modes)
+
+@mcp.tool
+@Executors.offload("network")
+@ResultCache.cached
+def assets_along_route(
+    waypoints: list[str],
+    buffer_km: float = 20,
+    modes: Optional[list[str]] = None
+) -> list | dict:
+    """
+    Find assets within a corridor around a route (rail line, road, front line).
+
+    Args:
+        waypoints: Ordered places along the route, at least two. Each one
+            is a place name or a "lat, lon" string
+        buffer_km: Width in km of the corridor on each side of the route (default 20)
+        modes: Databases to search, any of:
+            airfield
+            ground
+            depot
+            poi
+            (default: airfield, ground and depot)
+
+    Returns:
+        Assets inside the corridor ordered by their position along the
+        route; "route_km" is the distance from the first waypoint and
+        "distance_km" the distance to the route
+    """
+    return GeoTools.assets_along(waypoints, buffer_km, modes)
+
+@mcp.tool
+@Executors.offload("database")
+@ResultCache.cached
+def density_grid(
+    modes: Optional[list[str]] = None,
+    precision: int = 4,
+    bbox: Optional[list[float]] = None
+) -> list | dict:
+    """
+    Count assets per geohash cell, for heatmaps and national-scale views
+    where plotting every point would be too much.
+
+    Args:
+        modes: Databases to count, any of:
+            airfield
+            ground
+            depot
+            poi
+            (default: airfield, ground and depot)
+        precision: Geohash length, 2 (~1250 km cells) to 6 (~1.2 km cells), default 4 (~40 km)
+        bbox: Optional viewport as [south, west, north, east] in degrees
+
+    Returns:
+        One entry per non-empty cell with its geohash, centre, bounds,
+        total and counts per asset type (source table)
+    """
+    return GeoTools.density_grid(modes, precision, bbox)
+
+@mcp.tool
+@Executors.offload("database")
+@ResultCache.cached
+def map_viewport(bbox: list[float], zoom: int, modes: Optional[list[str]] = None) -> list | dict:
+    """
+    Get clustered markers for a map viewport, to render with the
+    "clusters" property of the react_map template instead of raw points.
+
+    Args:
+        bbox: Viewport as [south, west, north, east] in degrees
+        zoom: Web map zoom level, 0 (world) to 16 (street)
+        modes: Databases to show, any of:
+            airfield
+            ground
+            depot
+            poi
+            (default: airfield, ground and depot)
+
+    Returns:
+        Markers with their count, centroid (lat, lon), dominant type and
+        counts per type. Markers holding a single asset also carry its
+        database, asset id and label
+    """
+    return GeoTools.map_viewport(bbox, zoom, modes)
+
+@mcp.tool
+@Executors.offload("database")
+@ResultCache.cached
+def related_assets(asset_id: int, database: str) -> dict:
+    """
+    Find the installations that support a ground forces site: its nearest
+    airfields, depots and other ground forces sites, from a graph
+    precomputed at every database update.
+
+    Args:
+        asset_id: The "asset_id" of a ground forces site, as returned by
+            near_assets (mode "all" or a list), nearest_assets or
+            assets_along_route
+        database: The "database" returned with that asset_id. Asset ids
+            are only unique within one database and only "ground" sites
+            have related assets
+
+    Returns:
+        The site itself under "asset" and its nearest "airfield", "depot"
+        and "ground" assets, each sorted by distance
+    """
+    return GeoTools.related(asset_id, database)
+
+@mcp.tool
+@Executors.offload("network")
 def inspect_detailed(link: str) -> str:
 
     """
@@ -75,6 +211,8 @@ def inspect_detailed(link: str) -> str:
     return InspectionTools.inspect(link)
 
 @mcp.tool
+@Executors.offload("database")
+@ResultCache.cached
 def query_metadata(database: str) -> dict | str:
     """
         This tool can find metadata related size of information 
@@ -106,6 +244,8 @@ def query_metadata(database: str) -> dict | str:
 # ------- ground forces - tools -------------
 
 @mcp.tool
+@Executors.offload("database")
+@ResultCache.cached
 def query_ground_forces(
     table: str = "all",
     country: Optional[str] = None,
@@ -120,7 +260,8 @@ def query_ground_forces(
     rail: Optional[str] = None,
     kml: Optional[str] = None,
     poi: Optional[str] = None,
-    limit: Optional[int] = None
+    limit: Optional[int] = None,
+    order_by: Optional[str] = None
 ) -> list | dict:
     """
     Query any table in the ground forces database.
@@ -149,10 +290,12 @@ def query_ground_forces(
         rail: Rail information (partial match)
         kml: KML data (partial match)
         poi: POI information (partial match)
-        limit: Maximum number of results to return
+        limit: Maximum number of results to return (in total for "all")
+        order_by: Column to sort "all" results by, e.g. "oblast" or "-state" for descending
     
     Returns:
-        JSON string of matching facilities
+        JSON string of matching facilities. With "all", one list where
+        each facility carries its source_table
     """
     oblast = Oblast.get_fuzzy_oblast(oblast)
     kwargs = {
@@ -192,13 +335,15 @@ def query_ground_forces(
     elif table == "special facilities":
         return ground_forces.query_special_facilities(**kwargs)
     elif table == "all":
-        return ground_forces.search_all_tables(**kwargs)
+        return ground_forces.search_all_tables(order_by=order_by, **kwargs)
     else:
         return {"error": f"Unknown table: {table}. Use 'tanks', 'motorized', 'artillery', 'airborne', 'headquarters', 'other barracks', 'other military bases', 'other facilities', 'special facilities', or 'all'"}
 
 # ------- air force - airfield - tools -------------
 
 @mcp.tool
+@Executors.offload("database")
+@ResultCache.cached
 def query_airfields(
     table: str = "all",
     country: Optional[str] = None,
@@ -211,7 +356,8 @@ def query_airfields(
     revetm: Optional[str] = None,
     aircraft: Optional[str] = None,
     state: Optional[str] = None,
-    limit: Optional[int] = None
+    limit: Optional[int] = None,
+    order_by: Optional[str] = None
 ) -> list | dict:
     """
     Query any table in the airfields database.
@@ -234,10 +380,12 @@ def query_airfields(
         revetm: Revetment information
         aircraft: Aircraft type (partial match)
         state: State/status (partial match)
-        limit: Maximum number of results to return
+        limit: Maximum number of results to return (in total for "all")
+        order_by: Column to sort "all" results by, e.g. "air_base" or "-state" for descending
     
     Returns:
-        List of the information found in the databases
+        List of the information found in the databases. With "all", each
+        record carries its source_table
     """
 
     oblast = Oblast.get_fuzzy_oblast(oblast)
@@ -268,13 +416,15 @@ def query_airfields(
     elif table in ["former", "former military airfields"]:
         return airbases.query_former_military_airfields(**kwargs)
     elif table == "all":
-        return airbases.search_all_tables(**kwargs)
+        return airbases.search_all_tables(order_by=order_by, **kwargs)
     else:
         return {"error": f"Unknown table: {table}. Use 'helicopter', 'civil', 'military', 'reserve', 'former', or 'all'"}
 
 # ------- depots - tools -------------
 
 @mcp.tool
+@Executors.offload("database")
+@ResultCache.cached
 def query_depots(
     table: str = "all",
     country: Optional[str] = None,
@@ -283,7 +433,8 @@ def query_depots(
     oblast: Optional[str] = None,
     specifications: Optional[str] = None,
     state: Optional[str] = None,
-    limit: Optional[int] = 50
+    limit: Optional[int] = 50,
+    order_by: Optional[str] = None
 ):
     """
     Query any logistics table in the depots database (ru-depots.sqlite).
@@ -305,13 +456,13 @@ def query_depots(
         oblast: Oblast/region name (partial match)
         specifications: Technical specs or main user info (partial match)
         state: Status of the facility (partial match)
-        limit: Max results per table (default 50)
+        limit: Max results in total (default 50)
+        order_by: Column to sort results by, e.g. "oblast" or "-state" for descending
     
     Returns:
         List of findings across the specified logistics categories.
     """
     explorer = Depot.Depot_Explorer()
-    results = []
 
     # Map friendly tool names to the actual database tables
     table_mapping = {
@@ -341,29 +492,24 @@ def query_depots(
 
     oblast = Oblast.get_fuzzy_oblast(oblast)
 
-    # Execute queries using the explorer logic
-    for t_name in target_tables:
-        table_results = explorer.query_template(
-            table_name=t_name,
-            country=country,
-            locations=locations,
-            service=service,
-            oblast=oblast,
-            specifications=specifications,
-            state=state,
-            limit=limit
-        )
-        
-        # Add metadata to identify the source table in combined results
-        for row in table_results:
-            row["source_table"] = t_name
-            results.append(row)
-
-    return results 
+    # One UNION ALL statement over every target table; rows carry their source_table
+    return explorer.search_all_tables(
+        tables=target_tables,
+        country=country,
+        locations=locations,
+        service=service,
+        oblast=oblast,
+        specifications=specifications,
+        state=state,
+        limit=limit,
+        order_by=order_by
+    )
 
 # ------- poi - tools -------------
 
 @mcp.tool
+@Executors.offload("database")
+@ResultCache.cached
 def query_poi(
     locations: Optional[str] = None,
     user: Optional[str] = None,
@@ -421,24 +567,44 @@ def get_oblasts():
 
 # ------- database update -------------
 
+@mcp.tool
+def refresh_status() -> dict:
+    """
+        Reports the background database refresh: whether one is running,
+        when the next one is due, and how the last one went
+
+        Returns:
+            A dict with the refresh schedule, the start, end and duration
+            of the last run and its error, if any
+    """
+    return refresh.status()
+
 def update_database():
 
-    p0 = AB.AB_Parser()
-    p0.run()
+    checked = Manifest.check_all({
+        "AB": AB.AB_downloader,
+        "GF": GF.GF_downloader,
+        "LOG": Depot.Depot_downloader,
+        "POI": POI.POI_downloader
+    })
 
+    p0 = AB.AB_Parser()
     p1 = GF.GF_Parser()
-    p1.run()
-
     p2 = Depot.Depot_Parser()
-    p2.run()
-
     p3 = POI.POI_Parser()
-    p3.run()
+
+    rebuilt = Manifest.refresh_all([p0.job(), p1.job(), p2.job(), p3.job()], checked)
+
+    # the ground forces ingest updates its own links, new airfields and depots move their targets
+    if rebuilt["AB"] or rebuilt["LOG"]:
+        GeoTools.build_proximity_graph()
 
     return 
 
+refresh = Scheduler.from_settings(update_database)
+
 if __name__ == "__main__":
-    update_database()
+    refresh.start()
     mode = sys.argv[1]
     if len(mode) >= 2:
         if mode == "stdio":
@@ -0,0 +1,146 @@
+import sqlite3
+import json
+import queue
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+import logging
+import os
+import sys
+
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+logging.basicConfig(
+    level=logging.INFO,
+    stream=sys.stdout,
+    format="%(asctime)s — %(levelname)s — %(name)s — %(message)s",
+)
+
+logger = logging.getLogger(__name__)
+
+def load_settings() -> dict:
+
+    with open("../config/settings.json","r",encoding="utf-8") as settings_file:
+        settings = json.loads(settings_file.read())
+        settings_file.close()
+
+    return settings["pool"]
+
+class ReadOnlyPool:
+    """
+        Pool of read-only connections to one SQLite database.
+
+        Connections are opened lazily with a "mode=ro" URI (plus
+        "immutable=1" when enabled), tuned once with mmap_size and
+        cache_size, and reused across queries and threads. At most size
+        connections exist; a caller blocks until one is returned.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        size: int = 4,
+        immutable: bool = False,
+        mmap_size: int = 0,
+        cache_size: int = -2000
+    ):
+        self.db_path = str(Path(db_path).resolve())
+        self.uri = Path(self.db_path).as_uri() + "?mode=ro" + ("&immutable=1" if immutable else "")
+        self.mmap_size = int(mmap_size)
+        self.cache_size = int(cache_size)
+
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(size)
+        self.closed = False
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.uri, uri=True, check_same_thread=False)
+        conn.execute(f"PRAGMA mmap_size = {self.mmap_size}")
+        conn.execute(f"PRAGMA cache_size = {self.cache_size}")
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        """Borrows a connection, opening a new one if none is idle."""
+        self.slots.acquire()
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        try:
+            return self._open()
+        except sqlite3.Error:
+            self.slots.release()
+            raise
+
+    def release(self, conn: sqlite3.Connection):
+        """Gives a borrowed connection back to the pool."""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            if self.closed:
+                conn.close()
+            else:
+                self.idle.put(conn)
+        finally:
+            self.slots.release()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        """Closes the idle connections; borrowed ones close on release."""
+        self.closed = True
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+_settings = None
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get(db_path: str) -> ReadOnlyPool:
+    """Returns the shared pool of a database, creating it on first use."""
+    global _settings
+
+    key = str(Path(db_path).resolve())
+
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            if _settings is None:
+                _settings = load_settings()
+            pool = _pools[key] = ReadOnlyPool(
+                key,
+                size=_settings["size"],
+                immutable=_settings["immutable"],
+                mmap_size=_settings["mmap_size"],
+                cache_size=_settings["cache_size"]
+            )
+
+    return pool
+
+def connection(db_path: str):
+    """Context manager borrowing a read-only connection to db_path."""
+    return get(db_path).connection()
+
+def invalidate(db_path: str):
+    """
+        Drops the pool of a database after it has been rewritten, so that
+        immutable connections never serve the old file.
+    """
+    with _pools_lock:
+        pool = _pools.pop(str(Path(db_path).resolve()), None)
+
+    if pool is not None:
+        pool.close()
+        logger.info(f"Connection pool reset for {db_path}")
+
+# eof
@@ -1,16 +1,13 @@
 import os
-from bs4 import BeautifulSoup
 import sqlite3
-import pandas as pd 
 import json 
 from typing import Optional
-from datetime import datetime, timedelta 
-import requests
-import re 
 import logging 
 from pathlib import Path
 import sys 
 
+from modules import GeoTools, ConnectionPool, QueryEngine, Oblast, ResultCache, Manifest, Downloader, RowParser, Ingest
+
 os.chdir(os.path.dirname(os.path.abspath(__file__)))
 
 logging.basicConfig(
@@ -30,6 +27,18 @@ class Depot_Explorer:
     VALID_COUNTRIES = ['RUS', 'BLR', "UKR", "GEO", "MDA", "ARM"]
     VALID_SERVICES = ['A', 'N', 'UI', 'NF', None]  
     
+    FILTERS = [
+        QueryEngine.Filter("country", "enum", values=VALID_COUNTRIES, upper=True, key_column="country_code",
+            message=f"Invalid country '{{value}}'. Must be: {', '.join(VALID_COUNTRIES)}"),
+        QueryEngine.Filter("service", "enum", values=[s for s in VALID_SERVICES if s is not None], upper=True,
+            key_column="service_code",
+            message="Invalid service '{value}'. Must be: A, N, UI, NF"),
+        QueryEngine.Filter("oblast", key_column="oblast_id", key=Oblast.oblast_id),
+        *[QueryEngine.Filter(field) for field in [
+            'locations', 'specifications', 'state', 'image', 'topo', 'street', 'rail', 'kml', 'poi'
+        ]]
+    ]
+    
     def __init__(self, db_path: str = "../sqlite-database/ru-depots.sqlite"):
         self.db_path = db_path
 
@@ -58,61 +67,20 @@ class Depot_Explorer:
             "Street", "Rail", "KML", "POI"
         ]
 
-    def _validate_country(self, country: Optional[str]) -> bool:
-        if country and country.upper() not in self.VALID_COUNTRIES:
-            raise ValueError(f"Invalid country '{country}'. Must be: {', '.join(self.VALID_COUNTRIES)}")
-        return True
-
-    def _validate_service(self, service: Optional[str]) -> bool:
-        if service and service.upper() not in [s for s in self.VALID_SERVICES if s is not None]:
-            raise ValueError(f"Invalid service '{service}'. Must be: A, N, UI, NF")
-        return True
+        self.engine = QueryEngine.QueryEngine(self.db_path, self.tables, self.FILTERS)
 
     def query_template(self, table_name: str, **kwargs) -> list:
         """Base query engine for all depot tables."""
-        country = kwargs.get('country')
-        service = kwargs.get('service')
-        limit = kwargs.get('limit')
-        
-        self._validate_country(country)
-        self._validate_service(service)
-        
-        conn = sqlite3.connect(self.db_path)
-        try:
-            conditions = []
-            params = []
-            
-            # Direct filters (Exact)
-            if country:
-                conditions.append("UPPER(country) = ?")
-                params.append(country.upper())
-            if service:
-                conditions.append("UPPER(service) = ?")
-                params.append(service.upper())
-            
-            # String filters (Partial match)
-            for field in ['locations', 'oblast', 'specifications', 'state', 'image', 'topo', 'street', 'rail', 'kml', 'poi']:
-                val = kwargs.get(field)
-                if val:
-                    conditions.append(f"{field} LIKE ?")
-                    params.append(f"%{val}%")
-            
-            query = f"SELECT * FROM {table_name}"
-            if conditions:
-                query += " WHERE " + " AND ".join(conditions)
-            if limit:
-                query += f" LIMIT {int(limit)}"
-            
-            cursor = conn.cursor()
-            cursor.execute(query, params)
-            columns = [desc[0] for desc in cursor.description]
-            return [dict(zip(columns, row)) for row in cursor.fetchall()]
-            
-        except Exception as e:
-            logger.error(f"Error in {table_name}: {e}")
-            return []
-        finally:
-            conn.close()
+        return self.engine.query(table_name, **kwargs)
+
+    def search_all_tables(self, tables: Optional[list] = None, **kwargs) -> list:
+        """
+        Search several depot tables (all by default) in one UNION ALL
+        statement. limit caps the total number of rows and order_by
+        sorts them by a column ("-column" for descending).
+        Each row carries its source_table.
+        """
+        return self.engine.search(tables, **kwargs)
 
     # --- Central Facilities Queries ---
     def query_index_table(self, **kwargs): 
@@ -166,7 +134,8 @@ class Depot_Explorer:
     def get_statistics(self) -> dict:
         """Returns row counts for all depot tables."""
         stats = {}
-        conn = sqlite3.connect(self.db_path)
+        pool = ConnectionPool.get(self.db_path)
+        conn = pool.acquire()
         try:
             cursor = conn.cursor()
             for table in self.tables:
@@ -174,226 +143,31 @@ class Depot_Explorer:
                 stats[table] = cursor.fetchone()[0]
             return stats
         finally:
-            conn.close()
-
-class Depot_downloader:
-
-    def __init__(self):
-
-        with open("../config/url.json","r",encoding="utf-8") as url_links_source:
-            url_links_source_text = json.loads(url_links_source.read())
-            url_links_source.close()
-
-        self.url = url_links_source_text["LOG"]
-        self.source = ""
-        self.tables = []  
-        
-        self.names = [
-            "teste0", # ignored 
-            "index_table",
-            "central_nuclear_arsenals",
-            "central_ammunition_depots",
-            "central_pol_depots",
-            "central_surface_to_air_missile_depots",
-            "central_weapon_depots",
-            "central_artillery_depots",
-            "central_vehicle_depots",
-            "central_depots_unknown_function",
-            "central_aircraft_repair_plants",
-            "regional_nuclear_support_base",
-            "regional_ammunition_depots",
-            "regional_pol_depots",
-            "regional_supply_depots",
-            "regional_transport_bases",
-            "regional_open_air_depots"
-        ]
-
-
-    def download_source(self) -> bool:
-        try:
-            r = requests.get(self.url)
-            self.source = r.text
-
-            print(self.source)
-
-            with open("../sources/Depot.html","w",encoding="utf-8") as file:
-                file.write(self.source)
-                file.close()
-
-            return True 
-        except Exception as e :
-
-            print(e)
-
-            return False
-        
-    def find_table_sections(self):
-        """
-        Find table sections in HTML, even when malformed.
-        Uses the opening <table> tags with border="3" as markers.
-        
-        Returns:
-            list: List of tuples (start_pos, table_tag)
-        """
-        # Find all table opening tags with border="3"
-        pattern = r'<table[^>]*border="3"[^>]*>'
-        
-        matches = []
-        for match in re.finditer(pattern, self.source, re.IGNORECASE):
-            start_pos = match.start()
-            table_tag = match.group()
-            matches.append((start_pos, table_tag))
-        
-        return matches
-
-    def extract_table_until_next(self, start_pos, next_start_pos=None):
-        """
-        Extract table content from start position until the next table or end.
-        Stops before any embedded title tables (border="0").
-        
-        Args:
-            start_pos: Starting position of this table
-            next_start_pos: Starting position of next table (or None for last table)
-            
-        Returns:
-            str: Extracted table HTML
-        """
-
-        if next_start_pos is None:
-            search_end = len(self.source)
-        else:
-            search_end = next_start_pos
-        
-        search_area = self.source[start_pos:search_end]
-        
-        title_table_pattern = r'(</td>|</tr>|</tbody>)<table[^>]*border="0"[^>]*>'
-        
-        title_match = re.search(title_table_pattern, search_area, re.IGNORECASE)
-        
-        if title_match:
-        
-            end_pos = start_pos + title_match.start() + len(title_match.group(1))
-        else:
-        
-            if next_start_pos is None:
-                end_pos = search_end
-            else:
-        
-                last_td = search_area.rfind('</td>')
-                if last_td > 0:
-                    end_pos = start_pos + last_td + 5  
-                else:
-                    end_pos = next_start_pos
-        
-        table_html = self.source[start_pos:end_pos]
-        
-        table_html = table_html.rstrip()
-        
-        if not table_html.endswith('</table>'):
-            if not table_html.endswith('</tbody>'):
-                table_html += '\n  </tbody>'
-            table_html += '\n</table>'
-        
-        return table_html
-
-    def extract_tables(self):
-        """
-        Extract all data tables from the source HTML.
-        
-        Returns:
-            list: List of table HTML strings
-        """
-        if not self.source:
-            return []
-        
-        table_positions = self.find_table_sections()
-        
-        extracted_tables = []
-        
-        for idx, (start_pos, table_tag) in enumerate(table_positions):
-            if idx < len(table_positions) - 1:
-                next_start = table_positions[idx + 1][0]
-            else:
-                next_start = None
-            
-            # Extract the table
-            table_html = self.extract_table_until_next(start_pos, next_start)
-            extracted_tables.append(table_html)
-        
-        self.tables = extracted_tables
-        print(self.tables)
-        return extracted_tables
-
-    def save_tables_to_files(self, output_dir="../tables/LOG", prefix="table"):
-        """
-        Save each extracted table as a separate HTML file.
-        
-        Args:
-            output_dir: Directory to save the tables
-            prefix: Prefix for output filenames
-            
-        Returns:
-            list: List of output filenames
-        """
-        
-        output_files = []
-        for idx, table_html in enumerate(self.tables, 1):
-            # Create complete HTML document
-            html_doc = f"""<!DOCTYPE html>
-<html>
-<head>
-    <meta charset="UTF-8">
-    <title>Table {idx}</title>
-    <style>
-        body {{
-            font-family: Arial, sans-serif;
-            margin: 20px;
-        }}
-        table {{
-            border-collapse: collapse;
-        }}
-        td, th {{
-            padding: 8px;
-        }}
-    </style>
-</head>
-<body>
-{table_html}
-</body>
-</html>"""
-            
-            # Save to file
-            output_filename = os.path.join(output_dir, f"{self.names[idx]}.html")
-            with open(output_filename, 'w', encoding='utf-8') as f:
-                f.write(html_doc)
-                f.close()
-            
-            output_files.append(output_filename)
-        
-        return output_files
-
-    def get_table(self, index):
-        """
-        Get a specific table by index (1-based).
-        
-        Args:
-            index: Table index (1 for first table, 2 for second, etc.)
-            
-        Returns:
-            str: Table HTML or None if index is out of range
-        """
-        if 0 < index <= len(self.tables):
-            return self.tables[index - 1]
-        return None
-
-    def get_table_count(self):
-        """
-        Get the number of extracted tables.
-        
-        Returns:
-            int: Number of tables
-        """
-        return len(self.tables)
+            pool.release(conn)
+
+class Depot_downloader(Downloader.Downloader):
+
+    SOURCE = "LOG"
+    SOURCE_FILE = "../sources/Depot.html"
+    OUTPUT_DIR = "../tables/LOG"
+    NAMES = [
+        "index_table",
+        "central_nuclear_arsenals",
+        "central_ammunition_depots",
+        "central_pol_depots",
+        "central_surface_to_air_missile_depots",
+        "central_weapon_depots",
+        "central_artillery_depots",
+        "central_vehicle_depots",
+        "central_depots_unknown_function",
+        "central_aircraft_repair_plants",
+        "regional_nuclear_support_base",
+        "regional_ammunition_depots",
+        "regional_pol_depots",
+        "regional_supply_depots",
+        "regional_transport_bases",
+        "regional_open_air_depots"
+    ]
 
 class Depot_Parser:
     """
@@ -401,7 +175,8 @@ class Depot_Parser:
         with all specialized logistics tables.
     """
 
-    def __init__(self):
+    def __init__(self, backend: Optional[str] = None):
+        self.backend = backend or RowParser.backend_for("LOG")
         self.headers = [
             "Country", "Locations", "Oblast", "Service",
             "Specifications", "State", "Image", "Topo",            
@@ -429,44 +204,41 @@ class Depot_Parser:
         ]
         
         self.contents = {name: self.get_source(name) for name in self.files}
+        self.parsed = {}
+        self.changes = {}
 
     def get_source(self, file: str) -> str:
         with open(f"../tables/LOG/{file}.html", "r", encoding="utf-8") as f:
             content = f.read()
         return content
 
-    def extract_link_from_td(self, td):
-        anchor = td.find('a')
-        if anchor and anchor.get('href'):
-            return anchor.get('href')
-        return None
-
     def format_json(self, cells: list) -> dict:
         return {
-            'country': cells[0].get_text(strip=True),
-            'locations': cells[1].get_text(strip=True),
-            'oblast': cells[2].get_text(strip=True),
-            'service': cells[3].get_text(strip=True),
-            'specifications': cells[4].get_text(strip=True),
-            'state': cells[5].get_text(strip=True),
+            'country': cells[0].text,
+            'locations': cells[1].text,
+            'oblast': cells[2].text,
+            'service': cells[3].text,
+            'specifications': cells[4].text,
+            'state': cells[5].text,
             
             # Link extractions
-            'image': self.extract_link_from_td(cells[6]),
-            'topo': self.extract_link_from_td(cells[7]),
-            'street': self.extract_link_from_td(cells[8]),
-            'rail': self.extract_link_from_td(cells[9]),
-            'kml': self.extract_link_from_td(cells[10]),
-            'poi': self.extract_link_from_td(cells[11])
+            'image': cells[6].href,
+            'topo': cells[7].href,
+            'street': cells[8].href,
+            'rail': cells[9].href,
+            'kml': cells[10].href,
+            'poi': cells[11].href
         }
 
     def parse_table(self, table_name: str) -> list:
+        if table_name in self.parsed:
+            return self.parsed.pop(table_name)
+
         container = []
-        soup = BeautifulSoup(self.contents[table_name], 'html.parser')
-        rows = soup.find_all('tr')
-        for row in rows:
-            cells = row.find_all('td')
+        for cells in RowParser.rows(self.contents[table_name], self.backend):
             if cells:
                 row_data = self.format_json(cells)
+                row_data.update(GeoTools.extract_coordinates(row_data))
                 container.append(row_data)
         return container
 
@@ -537,114 +309,94 @@ class Depot_Parser:
         
         db_path = "../sqlite-database/ru-depots.sqlite"
         conn = sqlite3.connect(db_path)
+        changed = False
         
         try:
+            changes = Ingest.begin(conn)
+
             if central_nuclear:
-                df_nuclear = pd.DataFrame(central_nuclear[1:] if len(central_nuclear) > 1 else central_nuclear)
-                df_nuclear.to_sql('central_nuclear_arsenals', conn, if_exists='replace', index=False)
+                Ingest.upsert(conn, 'central_nuclear_arsenals', central_nuclear[1:] if len(central_nuclear) > 1 else central_nuclear, changes)
             
             if central_ammunition:
-                df_ammo = pd.DataFrame(central_ammunition[1:] if len(central_ammunition) > 1 else central_ammunition)
-                df_ammo.to_sql('central_ammunition_depots', conn, if_exists='replace', index=False)
+                Ingest.upsert(conn, 'central_ammunition_depots', central_ammunition[1:] if len(central_ammunition) > 1 else central_ammunition, changes)
             
             if central_pol:
-                df_pol = pd.DataFrame(central_pol[1:] if len(central_pol) > 1 else central_pol)
-                df_pol.to_sql('central_pol_depots', conn, if_exists='replace', index=False)
+                Ingest.upsert(conn, 'central_pol_depots', central_pol[1:] if len(central_pol) > 1 else central_pol, changes)
             
             if central_sam:
-                df_sam = pd.DataFrame(central_sam[1:] if len(central_sam) > 1 else central_sam)
-                df_sam.to_sql('central_sam_depots', conn, if_exists='replace', index=False)
+                Ingest.upsert(conn, 'central_sam_depots', central_sam[1:] if len(central_sam) > 1 else central_sam, changes)
             
             if central_weapon:
-                df_weapon = pd.DataFrame(central_weapon[1:] if len(central_weapon) > 1 else central_weapon)
-                df_weapon.to_sql('central_weapon_depots', conn, if_exists='replace', index=False)
+                Ingest.upsert(conn, 'central_weapon_depots', central_weapon[1:] if len(central_weapon) > 1 else central_weapon, changes)
             
             if central_artillery:
-                df_cartillery = pd.DataFrame(central_artillery[1:] if len(central_artillery) > 1 else central_artillery)
-                df_cartillery.to_sql('central_artillery_depots', conn, if_exists='replace', index=False)
+                Ingest.upsert(conn, 'central_artillery_depots', central_artillery[1:] if len(central_artillery) > 1 else central_artillery, changes)
             
             if central_vehicle:
-                df_vehicle = pd.DataFrame(central_vehicle[1:] if len(central_vehicle) > 1 else central_vehicle)
-                df_vehicle.to_sql('central_vehicle_depots', conn, if_exists='replace', index=False)
+                Ingest.upsert(conn, 'central_vehicle_depots', central_vehicle[1:] if len(central_vehicle) > 1 else central_vehicle, changes)
             
             if central_unknown:
-                df_unknown = pd.DataFrame(central_unknown[1:] if len(central_unknown) > 1 else central_unknown)
-                df_unknown.to_sql('central_unknown_depots', conn, if_exists='replace', index=False)
+                Ingest.upsert(conn, 'central_unknown_depots', central_unknown[1:] if len(central_unknown) > 1 else central_unknown, changes)
             
             if central_aircraft:
-                df_aircraft = pd.DataFrame(central_aircraft[1:] if len(central_aircraft) > 1 else central_aircraft)
-                df_aircraft.to_sql('central_aircraft_repair', conn, if_exists='replace', index=False)
+                Ingest.upsert(conn, 'central_aircraft_repair', central_aircraft[1:] if len(central_aircraft) > 1 else central_aircraft, changes)
             
             if regional_nuclear:
-                df_r_nuclear = pd.DataFrame(regional_nuclear[1:] if len(regional_nuclear) > 1 else regional_nuclear)
-                df_r_nuclear.to_sql('regional_nuclear_support', conn, if_exists='replace', index=False)
+                Ingest.upsert(conn, 'regional_nuclear_support', regional_nuclear[1:] if len(regional_nuclear) > 1 else regional_nuclear, changes)
             
             if regional_ammunition:
-                df_r_ammo = pd.DataFrame(regional_ammunition[1:] if len(regional_ammunition) > 1 else regional_ammunition)
-                df_r_ammo.to_sql('regional_ammunition', conn, if_exists='replace', index=False)
+                Ingest.upsert(conn, 'regional_ammunition', regional_ammunition[1:] if len(regional_ammunition) > 1 else regional_ammunition, changes)
             
             if regional_pol:
-                df_r_pol = pd.DataFrame(regional_pol[1:] if len(regional_pol) > 1 else regional_pol)
-                df_r_pol.to_sql('regional_pol', conn, if_exists='replace', index=False)
+                Ingest.upsert(conn, 'regional_pol', regional_pol[1:] if len(regional_pol) > 1 else regional_pol, changes)
             
             if regional_supply:
-                df_supply = pd.DataFrame(regional_supply[1:] if len(regional_supply) > 1 else regional_supply)
-                df_supply.to_sql('regional_supply', conn, if_exists='replace', index=False)
+                Ingest.upsert(conn, 'regional_supply', regional_supply[1:] if len(regional_supply) > 1 else regional_supply, changes)
             
             if regional_transport:
-                df_transport = pd.DataFrame(regional_transport[1:] if len(regional_transport) > 1 else regional_transport)
-                df_transport.to_sql('regional_transport', conn, if_exists='replace', index=False)
+                Ingest.upsert(conn, 'regional_transport', regional_transport[1:] if len(regional_transport) > 1 else regional_transport, changes)
             
             if regional_open_air:
-                df_open_air = pd.DataFrame(regional_open_air[1:] if len(regional_open_air) > 1 else regional_open_air)
-                df_open_air.to_sql('regional_open_air', conn, if_exists='replace', index=False)
+                Ingest.upsert(conn, 'regional_open_air', regional_open_air[1:] if len(regional_open_air) > 1 else regional_open_air, changes)
             
+            if changes:
+                moves = GeoTools.update_spatial_index(conn, changes)
+                GeoTools.update_density_grid(conn, moves)
+                GeoTools.update_cluster_index(conn, moves)
+                QueryEngine.build_filter_columns(conn, changes)
+                QueryEngine.update_fulltext_index(conn, changes)
+                changes.record(conn)
             conn.commit()
+            changed = bool(changes)
+            self.changes = changes.summary()
             logger.info("Database updated successfully!")
+
+            # the gazetteer is a separate database, only updated once the rows are committed
+            if changed:
+                try:
+                    GeoTools.update_gazetteer("LOG", conn, changes)
+                except Exception as e:
+                    logger.info(f"Error updating gazetteer: {e}")
             
         except Exception as e:
             logger.info(f"Error updating database: {e}")
             conn.rollback()
+            return False
             
         finally:
             conn.close()
+            if changed:
+                ConnectionPool.invalidate(db_path)
+                ResultCache.bump()
         
-        return
+        return True
 
-    def check_login_and_update(self):
-        file_path = "../logs/last-update.txt"
-        current_time = datetime.now()
-        
-        if os.path.exists(file_path):
-            with open(file_path, "r") as f:
-                stored_time_str = f.read().strip()
-                
-            try:
-                last_login = datetime.strptime(stored_time_str, "%Y-%m-%d %H:%M:%S")
-                
-                delta = current_time - last_login
-                
-                if delta > timedelta(hours=24):
-                    d = Depot_downloader()
-                    d.download_source()
-                    d.extract_tables()
-                    d.save_tables_to_files()
-                    logger.info("Updating database...")
-                    self.push_to_database()
-                    logger.info("Finished updating database !")
-                    
-            except ValueError:
-                logger.info("Stored format was invalid. Updating timestamp.")
-                self.push_to_database()
-        else:
-            logger.info("First login detected. Creating storage file.")
-            self.push_to_database()
-
-        with open(file_path, "w") as f:
-            f.write(current_time.strftime("%Y-%m-%d %H:%M:%S"))
-
-    def run(self):
-        self.check_login_and_update()
+    def job(self) -> tuple:
+        """Source key, downloader and database of this parser, as Manifest.refresh() takes them."""
+        return ("LOG", self, Depot_downloader, "../sqlite-database/ru-depots.sqlite")
+
+    def run(self, checked: Optional[dict] = None) -> bool:
 
+        return Manifest.refresh(*self.job(), checked=checked)
 
 # eof 
\ No newline at end of file
@@ -0,0 +1,212 @@
+import re
+import json
+from typing import Iterator, Optional
+import logging
+import os
+import sys
+
+import requests
+
+from modules import Fetch
+
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+logging.basicConfig(
+    level=logging.INFO,
+    stream=sys.stdout,
+    format="%(asctime)s — %(levelname)s — %(name)s — %(message)s",
+)
+
+logger = logging.getLogger(__name__)
+
+DOCUMENT_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="UTF-8">
+    <title>Table {idx}</title>
+    <style>
+        body {{
+            font-family: Arial, sans-serif;
+            margin: 20px;
+        }}
+        table {{
+            border-collapse: collapse;
+        }}
+        td, th {{
+            padding: 8px;
+        }}
+    </style>
+</head>
+<body>
+{table_html}
+</body>
+</html>"""
+
+def boundary_pattern(table_border: str, title_border: str) -> re.Pattern:
+    """
+        One pattern for every marker the splitter needs, so the source is
+        scanned once:
+            start - opening tag of a data table (border=table_border)
+            title - a title table (border=title_border) glued to a closing
+                    </td>, </tr> or </tbody>; it belongs to the next section
+            td    - any other </td> (case-sensitive)
+    """
+    return re.compile(
+        rf'(?P<start><table[^>]*border="{table_border}"[^>]*>)'
+        rf'|(?P<title>(?P<close></td>|</tr>|</tbody>)<table[^>]*border="{title_border}"[^>]*>)'
+        r'|(?P<td>(?-i:</td>))',
+        re.IGNORECASE
+    )
+
+def table_spans(source: str, pattern: re.Pattern) -> Iterator[tuple]:
+    """
+        Yields the (start, end) span of every data table in one linear
+        pass over source, without copying it.
+
+        A table starts at its opening tag and ends right after the
+        closing tag before the first title table of its section; without
+        one, after the last </td> before the next table, or at the end of
+        the source for the last table.
+    """
+    start = None
+    title_end = None
+    last_td = None
+
+    for match in pattern.finditer(source):
+        kind = match.lastgroup
+
+        if kind == "start":
+            if start is not None:
+                yield start, title_end or last_td or match.start()
+            start, title_end, last_td = match.start(), None, None
+
+        elif start is None:
+            continue
+
+        elif kind == "title":
+            if title_end is None:
+                title_end = match.end("close")
+
+        elif kind == "td":
+            last_td = match.end()
+
+    if start is not None:
+        yield start, title_end or len(source)
+
+def table_html(source: str, span: tuple) -> str:
+    """Cuts one span out of source, closing its tbody/table tags when missing."""
+    html = source[span[0]:span[1]].rstrip()
+
+    if not html.endswith('</table>'):
+        if not html.endswith('</tbody>'):
+            html += '\n  </tbody>'
+        html += '\n</table>'
+
+    return html
+
+class Downloader:
+    """
+        Fetches one page of config/url.json and splits it into one HTML
+        file per data table.
+
+        A source is described by its class attributes: SOURCE (key in
+        url.json), SOURCE_FILE (local copy of the page), OUTPUT_DIR and
+        NAMES, the file name of each data table in page order (None to
+        skip one). TABLE_BORDER and TITLE_BORDER are the border values
+        that mark data tables and title tables.
+    """
+
+    SOURCE = None
+    SOURCE_FILE = None
+    OUTPUT_DIR = None
+    NAMES = []
+    TABLE_BORDER = "3"
+    TITLE_BORDER = "0"
+
+    def __init__(self):
+
+        with open("../config/url.json","r",encoding="utf-8") as url_links_source:
+            url_links_source_text = json.loads(url_links_source.read())
+            url_links_source.close()
+
+        self.url = url_links_source_text[self.SOURCE]
+        self.source = ""
+        self.tables = []
+        self.names = list(self.NAMES)
+        self.pattern = boundary_pattern(self.TABLE_BORDER, self.TITLE_BORDER)
+
+    def download_source(self, etag: Optional[str] = None, last_modified: Optional[str] = None) -> bool:
+        """
+            Fetches the page into SOURCE_FILE, conditionally on the
+            validators of the last fetch. On 304 not_modified is set and
+            the local copy is kept.
+        """
+        try:
+            result = Fetch.fetch(self.url, self.SOURCE_FILE, etag, last_modified)
+        except requests.RequestException as e:
+            logger.info(f"Could not fetch {self.url}: {e}")
+            return False
+
+        self.etag, self.last_modified = result.etag, result.last_modified
+        self.not_modified = result.not_modified
+        if not self.not_modified:
+            self.source = result.text()
+            self.source_hash = result.sha256
+
+        return True
+
+    def spans(self) -> Iterator[tuple]:
+        return table_spans(self.source, self.pattern)
+
+    def extract_tables(self) -> list:
+        """
+        Extract all data tables from the source HTML.
+
+        Returns:
+            list: List of table HTML strings
+        """
+        self.tables = [table_html(self.source, span) for span in self.spans()]
+        return self.tables
+
+    def save_tables_to_files(self, output_dir: Optional[str] = None) -> list:
+        """
+        Save each extracted table as a separate HTML file, named after
+        NAMES. Tables beyond NAMES are left out.
+
+        Returns:
+            list: List of output filenames
+        """
+        output_dir = output_dir or self.OUTPUT_DIR
+        output_files = []
+
+        for idx, html in enumerate(self.tables, 1):
+            name = self.names[idx - 1] if idx <= len(self.names) else None
+            if name is None:
+                if idx > len(self.names):
+                    logger.info(f"{self.SOURCE}: table {idx} has no name, skipped")
+                continue
+
+            output_filename = os.path.join(output_dir, f"{name}.html")
+            with open(output_filename, 'w', encoding='utf-8') as f:
+                f.write(DOCUMENT_TEMPLATE.format(idx=idx, table_html=html))
+                f.close()
+
+            output_files.append(output_filename)
+
+        return output_files
+
+    def get_table(self, index):
+        """
+        Get a specific table by index (1-based).
+
+        Returns:
+            str: Table HTML or None if index is out of range
+        """
+        if 0 < index <= len(self.tables):
+            return self.tables[index - 1]
+        return None
+
+    def get_table_count(self):
+        return len(self.tables)
+
+# eof
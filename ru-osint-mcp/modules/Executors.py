@@ -0,0 +1,89 @@
+import json
+import asyncio
+import functools
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+import sys
+
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+logging.basicConfig(
+    level=logging.INFO,
+    stream=sys.stdout,
+    format="%(asctime)s — %(levelname)s — %(name)s — %(message)s",
+)
+
+logger = logging.getLogger(__name__)
+
+def load_settings() -> dict:
+
+    with open("../config/settings.json","r",encoding="utf-8") as settings_file:
+        settings = json.loads(settings_file.read())
+        settings_file.close()
+
+    return settings["executors"]
+
+_settings = None
+_executors = {}
+_executors_lock = threading.Lock()
+
+def settings() -> dict:
+    global _settings
+
+    with _executors_lock:
+        if _settings is None:
+            _settings = load_settings()
+
+    return _settings
+
+def executor(kind: str) -> ThreadPoolExecutor:
+    """
+        Returns the bounded thread pool of a kind of blocking work
+        ("database" or "network"), created on first use. Keeping the
+        kinds apart means slow remote calls can never take every worker
+        that local SQLite queries need.
+    """
+    workers = settings()["pools"][kind]
+
+    with _executors_lock:
+        pool = _executors.get(kind)
+        if pool is None:
+            pool = _executors[kind] = ThreadPoolExecutor(
+                max_workers=workers,
+                thread_name_prefix=f"rusmil-{kind}"
+            )
+
+    return pool
+
+def limit(name: str) -> int:
+    """Maximum number of concurrent calls of a tool."""
+    config = settings()
+    return config["limits"].get(name, config["default_limit"])
+
+def offload(kind: str):
+    """
+        Turns a blocking tool into an async one that runs on the kind
+        executor, with at most limit(tool name) calls in flight; extra
+        calls wait on the event loop without holding a worker.
+    """
+    def decorator(func):
+        semaphore = asyncio.Semaphore(limit(func.__name__))
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            async with semaphore:
+                loop = asyncio.get_running_loop()
+                context = contextvars.copy_context()
+                return await loop.run_in_executor(
+                    executor(kind),
+                    functools.partial(context.run, func, *args, **kwargs)
+                )
+
+        return wrapper
+
+    return decorator
+
+# eof
@@ -0,0 +1,184 @@
+import json
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+import logging
+import os
+import sys
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+logging.basicConfig(
+    level=logging.INFO,
+    stream=sys.stdout,
+    format="%(asctime)s — %(levelname)s — %(name)s — %(message)s",
+)
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+def load_settings() -> dict:
+
+    with open("../config/settings.json","r",encoding="utf-8") as settings_file:
+        settings = json.loads(settings_file.read())
+        settings_file.close()
+
+    return settings["fetch"]
+
+@dataclass
+class FetchResult:
+    url: str
+    status: int
+    path: Optional[str] = None
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    encoding: str = "utf-8"
+    sha256: Optional[str] = None
+
+    @property
+    def not_modified(self) -> bool:
+        return self.status == 304
+
+    def text(self) -> str:
+        """Decoded body of a 200 response, read back from disk."""
+        with open(self.path,"r",encoding=self.encoding,errors="replace",newline="") as body:
+            return body.read()
+
+_settings = None
+_session = None
+_executor = None
+_lock = threading.Lock()
+
+def settings() -> dict:
+    global _settings
+
+    with _lock:
+        if _settings is None:
+            _settings = load_settings()
+
+    return _settings
+
+def session() -> requests.Session:
+    """
+        Returns the process-wide session: keep-alive connections reused
+        across fetches, and bounded exponential backoff on connection
+        errors, 429 and 5xx responses (honouring Retry-After).
+    """
+    global _session
+
+    config = settings()
+
+    with _lock:
+        if _session is None:
+            retry = Retry(
+                total=config["retries"],
+                backoff_factor=config["backoff_factor"],
+                backoff_max=config["backoff_max"],
+                status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=frozenset(["GET", "HEAD"]),
+                respect_retry_after_header=True,
+                raise_on_status=False
+            )
+            adapter = HTTPAdapter(max_retries=retry, pool_maxsize=config["workers"])
+
+            _session = requests.Session()
+            _session.headers["User-Agent"] = config["user_agent"]
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+
+    return _session
+
+def fetch(url: str, path: str, etag: Optional[str] = None, last_modified: Optional[str] = None) -> FetchResult:
+    """
+        GETs url conditionally on the validators of the previous fetch.
+        A 200 body is streamed to path through a temporary file, hashed
+        on the way, and only replaces path once complete; a 304 leaves
+        path untouched.
+
+        Raises:
+            requests.RequestException when the server cannot be reached
+            or answers with an error once the retries are spent
+    """
+    config = settings()
+
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+
+    with session().get(
+        url,
+        headers=headers,
+        stream=True,
+        timeout=(config["connect_timeout"], config["read_timeout"])
+    ) as r:
+
+        if r.status_code == 304:
+            return FetchResult(url, 304, etag=etag, last_modified=last_modified)
+        r.raise_for_status()
+
+        target = Path(path)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        temporary = target.with_name(target.name + ".part")
+        digest = hashlib.sha256()
+
+        try:
+            with open(temporary,"wb") as body:
+                for chunk in r.iter_content(CHUNK_SIZE):
+                    digest.update(chunk)
+                    body.write(chunk)
+            os.replace(temporary, target)
+        finally:
+            if temporary.exists():
+                temporary.unlink()
+
+        charset = "charset" in r.headers.get("Content-Type", "").lower()
+
+        return FetchResult(
+            url,
+            r.status_code,
+            path=str(target),
+            etag=r.headers.get("ETag"),
+            last_modified=r.headers.get("Last-Modified"),
+            encoding=r.encoding if charset and r.encoding else "utf-8",
+            sha256=digest.hexdigest()
+        )
+
+def executor() -> ThreadPoolExecutor:
+    global _executor
+
+    config = settings()
+
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=config["workers"], thread_name_prefix="rusmil-fetch")
+
+    return _executor
+
+def run_all(jobs: dict) -> dict:
+    """
+        Runs several fetch jobs (name -> callable) at once on the fetch
+        workers. Returns name -> result; a job that raised maps to its
+        exception.
+    """
+    futures = {name: executor().submit(job) for name, job in jobs.items()}
+
+    results = {}
+    for name, future in futures.items():
+        try:
+            results[name] = future.result()
+        except Exception as e:
+            results[name] = e
+
+    return results
+
+# eof
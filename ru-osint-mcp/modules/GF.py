@@ -1,16 +1,13 @@
 import os
-from bs4 import BeautifulSoup
 import sqlite3
-import pandas as pd 
 import json 
 from typing import Optional
-from datetime import datetime, timedelta 
-import requests
-import re 
 import logging 
 from pathlib import Path
 import sys 
 
+from modules import GeoTools, ConnectionPool, QueryEngine, Oblast, ResultCache, Manifest, Downloader, RowParser, Ingest
+
 os.chdir(os.path.dirname(os.path.abspath(__file__)))
 
 logging.basicConfig(
@@ -30,11 +27,29 @@ class GF_Explorer:
     VALID_COUNTRIES = ['RUS', 'BLR',"UKR","GEO","MDA","ARM"]
     VALID_SERVICES = ['A', 'N', 'UI', 'NF', None]  # Adjust based on actual ground forces services
     
+    FILTERS = [
+        QueryEngine.Filter("country", "enum", values=VALID_COUNTRIES, upper=True, key_column="country_code",
+            message=f"Invalid country '{{value}}'. Must be one of: {', '.join(VALID_COUNTRIES)}"),
+        QueryEngine.Filter("location"),
+        QueryEngine.Filter("oblast", key_column="oblast_id", key=Oblast.oblast_id),
+        QueryEngine.Filter("service", "enum", values=[s for s in VALID_SERVICES if s is not None], upper=True,
+            key_column="service_code",
+            message="Invalid service '{value}'. Must be one of: A, N, UI, NF, or None"),
+        QueryEngine.Filter("main_user"),
+        QueryEngine.Filter("state"),
+        QueryEngine.Filter("image"),
+        QueryEngine.Filter("topo"),
+        QueryEngine.Filter("street"),
+        QueryEngine.Filter("rail"),
+        QueryEngine.Filter("kml"),
+        QueryEngine.Filter("poi")
+    ]
+    
     def __init__(self, db_path: str = "../sqlite-database/ru-ground-forces.sqlite"):
         self.db_path = db_path
 
         self.tables = [
-            "barracks_tanks_forces",
+            "barracks_tank_forces",
             "barracks_motorized_rifle_forces",
             "barracks_artillery_forces",
             "barracks_airborne_forces",
@@ -60,21 +75,7 @@ class GF_Explorer:
             "POI"
         ]
 
-    def _validate_country(self, country: Optional[str]) -> bool:
-        """Validate country parameter"""
-        if country is None:
-            return True
-        if country.upper() not in self.VALID_COUNTRIES:
-            raise ValueError(f"Invalid country '{country}'. Must be one of: {', '.join(self.VALID_COUNTRIES)}")
-        return True
-
-    def _validate_service(self, service: Optional[str]) -> bool:
-        """Validate service parameter"""
-        if service is None:
-            return True
-        if service.upper() not in [s for s in self.VALID_SERVICES if s is not None]:
-            raise ValueError(f"Invalid service '{service}'. Must be one of: A, N, UI, NF, or None")
-        return True
+        self.engine = QueryEngine.QueryEngine(self.db_path, self.tables, self.FILTERS)
 
     def query_template(
         self,
@@ -106,104 +107,26 @@ class GF_Explorer:
             List with rows found in the specified table 
         """
         
-        # Validate inputs
-        self._validate_country(country)
-        self._validate_service(service)
-        
-        conn = sqlite3.connect(self.db_path)
-        
-        try:
-            # Build the WHERE clause dynamically
-            conditions = []
-            params = []
-            
-            # Country uses exact match (case-insensitive)
-            if country is not None:
-                conditions.append("UPPER(country) = ?")
-                params.append(country.upper())
-            
-            if location is not None:
-                conditions.append("location LIKE ?")
-                params.append(f"%{location}%")
-            
-            if oblast is not None:
-                conditions.append("oblast LIKE ?")
-                params.append(f"%{oblast}%")
-            
-            # Service uses exact match (case-insensitive) or NULL check
-            if service is not None:
-                conditions.append("UPPER(service) = ?")
-                params.append(service.upper())
-            
-            if main_user is not None:
-                conditions.append("main_user LIKE ?")
-                params.append(f"%{main_user}%")
-            
-            if state is not None:
-                conditions.append("state LIKE ?")
-                params.append(f"%{state}%")
-            
-            if image is not None:
-                conditions.append("image LIKE ?")
-                params.append(f"%{image}%")
-            
-            if topo is not None:
-                conditions.append("topo LIKE ?")
-                params.append(f"%{topo}%")
-            
-            if street is not None:
-                conditions.append("street LIKE ?")
-                params.append(f"%{street}%")
-            
-            if rail is not None:
-                conditions.append("rail LIKE ?")
-                params.append(f"%{rail}%")
-            
-            if kml is not None:
-                conditions.append("kml LIKE ?")
-                params.append(f"%{kml}%")
-            
-            if poi is not None:
-                conditions.append("poi LIKE ?")
-                params.append(f"%{poi}%")
-            
-            # Build the SQL query
-            query = f"SELECT * FROM {table_name}"
-            
-            if conditions:
-                query += " WHERE " + " AND ".join(conditions)
-            
-            if limit is not None:
-                query += f" LIMIT {limit}"
-            
-            # Execute query
-            cursor = conn.cursor()
-            cursor.execute(query, params)
-            
-            # Get column names
-            columns = [description[0] for description in cursor.description]
-            
-            logging.info("Query: "+query)
-            logging.info("Params: "+",".join(params))
-
-            # Fetch all rows
-            rows = cursor.fetchall()
-            
-            # Convert to dictionary format
-            result = [dict(zip(columns, row)) for row in rows]
-            
-            return result
-            
-        except Exception as e:
-            logger.info(f"Error querying database: {e}")
-            return []
-            
-        finally:
-            conn.close()
+        return self.engine.query(
+            table_name,
+            country=country,
+            location=location,
+            oblast=oblast,
+            service=service,
+            main_user=main_user,
+            state=state,
+            image=image,
+            topo=topo,
+            street=street,
+            rail=rail,
+            kml=kml,
+            poi=poi,
+            limit=limit
+        )
     
     def query_barracks_tanks_forces(self, **kwargs) -> dict:
         """Query barracks tanks forces table"""
-        return self.query_template(table_name='barracks_tanks_forces', **kwargs)
+        return self.query_template(table_name='barracks_tank_forces', **kwargs)
     
     def query_barracks_motorized_rifle_forces(self, **kwargs) -> dict:
         """Query barracks motorized rifle forces table"""
@@ -241,17 +164,19 @@ class GF_Explorer:
         """Get all records from a specific table"""
         return self.query_template(table_name=table_name)
     
-    def search_all_tables(self, **kwargs) -> dict:
-        """Search across all tables with the same criteria"""
-        results = {}
-        for table_name in self.tables:
-            d = self.query_template(table_name=table_name, **kwargs)
-            results[table_name] = d
-        return results
+    def search_all_tables(self, **kwargs) -> list:
+        """
+        Search across all tables with the same criteria in one UNION ALL
+        statement. limit caps the total number of rows and order_by
+        sorts them by a column ("-column" for descending).
+        Each row carries its source_table.
+        """
+        return self.engine.search(**kwargs)
     
     def get_statistics(self) -> dict:
         """Get statistics for all tables in the database"""
-        conn = sqlite3.connect(self.db_path)
+        pool = ConnectionPool.get(self.db_path)
+        conn = pool.acquire()
         stats = {}
         
         try:
@@ -269,216 +194,25 @@ class GF_Explorer:
             return stats
             
         finally:
-            conn.close()
-
-class GF_downloader:
-
-    def __init__(self):
-
-        with open("../config/url.json","r",encoding="utf-8") as url_links_source:
-            url_links_source_text = json.loads(url_links_source.read())
-            url_links_source.close()
-
-        self.url = url_links_source_text["GF"]
-        self.source = ""
-        self.tables = []  
-        
-        self.names = [
-            "teste0", # ignored 
-            "index_table",
-            "barracks_tanks_forces",
-            "barracks_motorized_rifle_forces",
-            "barracks_artillery_forces",
-            "barracks_airborne_forces",
-            "barracks_headquarters_forces",
-            "other_barracks",
-            "other_military_bases",
-            "other_facilities",
-            "special_facilities"
-        ]
-
-
-    def download_source(self) -> bool:
-        try:
-            r = requests.get(self.url)
-            self.source = r.text
-
-            with open("../sources/GF.html","w",encoding="utf-8") as file:
-                file.write(self.source)
-                file.close()
-
-            return True 
-        except Exception as e :
-            return False
-        
-    def find_table_sections(self):
-        """
-        Find table sections in HTML, even when malformed.
-        Uses the opening <table> tags with border="3" as markers.
-        
-        Returns:
-            list: List of tuples (start_pos, table_tag)
-        """
-
-        pattern = r'<table[^>]*border="3"[^>]*>'
-        
-        matches = []
-        for match in re.finditer(pattern, self.source, re.IGNORECASE):
-            start_pos = match.start()
-            table_tag = match.group()
-            matches.append((start_pos, table_tag))
-        
-        return matches
-
-    def extract_table_until_next(self, start_pos, next_start_pos=None):
-        """
-        Extract table content from start position until the next table or end.
-        Stops before any embedded title tables (border="0").
-        
-        Args:
-            start_pos: Starting position of this table
-            next_start_pos: Starting position of next table (or None for last table)
-            
-        Returns:
-            str: Extracted table HTML
-        """
-
-        if next_start_pos is None:
-            search_end = len(self.source)
-        else:
-            search_end = next_start_pos
-        
-        search_area = self.source[start_pos:search_end]
-        
-        title_table_pattern = r'(</td>|</tr>|</tbody>)<table[^>]*border="0"[^>]*>'
-        
-        title_match = re.search(title_table_pattern, search_area, re.IGNORECASE)
-        
-        if title_match:
-            end_pos = start_pos + title_match.start() + len(title_match.group(1))
-        else:
-
-            if next_start_pos is None:
-                # This is the last table
-                end_pos = search_end
-            else:
-                last_td = search_area.rfind('</td>')
-                if last_td > 0:
-                    end_pos = start_pos + last_td + 5  
-                else:
-                    end_pos = next_start_pos
-        
-        table_html = self.source[start_pos:end_pos]
-        
-        table_html = table_html.rstrip()
-        
-        if not table_html.endswith('</table>'):
-            if not table_html.endswith('</tbody>'):
-                table_html += '\n  </tbody>'
-            table_html += '\n</table>'
-        
-        return table_html
-
-    def extract_tables(self):
-        """
-        Extract all data tables from the source HTML.
-        
-        Returns:
-            list: List of table HTML strings
-        """
-        if not self.source:
-            return []
-        
-        # Find all data tables (border="3")
-        table_positions = self.find_table_sections()
-        
-        extracted_tables = []
-        
-        for idx, (start_pos, table_tag) in enumerate(table_positions):
-            # Determine where this table ends (before next table starts)
-            if idx < len(table_positions) - 1:
-                next_start = table_positions[idx + 1][0]
-            else:
-                next_start = None
-            
-            # Extract the table
-            table_html = self.extract_table_until_next(start_pos, next_start)
-            extracted_tables.append(table_html)
-        
-        self.tables = extracted_tables
-        return extracted_tables
-
-    def save_tables_to_files(self, output_dir="../tables/GF", prefix="table"):
-        """
-        Save each extracted table as a separate HTML file.
-        
-        Args:
-            output_dir: Directory to save the tables
-            prefix: Prefix for output filenames
-            
-        Returns:
-            list: List of output filenames
-        """
-        
-        output_files = []
-        
-        for idx, table_html in enumerate(self.tables, 1):
-            # Create complete HTML document
-            html_doc = f"""<!DOCTYPE html>
-<html>
-<head>
-    <meta charset="UTF-8">
-    <title>Table {idx}</title>
-    <style>
-        body {{
-            font-family: Arial, sans-serif;
-            margin: 20px;
-        }}
-        table {{
-            border-collapse: collapse;
-        }}
-        td, th {{
-            padding: 8px;
-        }}
-    </style>
-</head>
-<body>
-{table_html}
-</body>
-</html>"""
-            
-            # Save to file
-            output_filename = os.path.join(output_dir, f"{self.names[idx]}.html")
-            with open(output_filename, 'w', encoding='utf-8') as f:
-                f.write(html_doc)
-                f.close()
-            
-            output_files.append(output_filename)
-        
-        return output_files
-
-    def get_table(self, index):
-        """
-        Get a specific table by index (1-based).
-        
-        Args:
-            index: Table index (1 for first table, 2 for second, etc.)
-            
-        Returns:
-            str: Table HTML or None if index is out of range
-        """
-        if 0 < index <= len(self.tables):
-            return self.tables[index - 1]
-        return None
-
-    def get_table_count(self):
-        """
-        Get the number of extracted tables.
-        
-        Returns:
-            int: Number of tables
-        """
-        return len(self.tables)
+            pool.release(conn)
+
+class GF_downloader(Downloader.Downloader):
+
+    SOURCE = "GF"
+    SOURCE_FILE = "../sources/GF.html"
+    OUTPUT_DIR = "../tables/GF"
+    NAMES = [
+        "index_table",
+        "barracks_tanks_forces",
+        "barracks_motorized_rifle_forces",
+        "barracks_artillery_forces",
+        "barracks_airborne_forces",
+        "barracks_headquarters_forces",
+        "other_barracks",
+        "other_military_bases",
+        "other_facilities",
+        "special_facilities"
+    ]
 
 class GF_Parser:
 
@@ -498,7 +232,9 @@ class GF_Parser:
 
     """
 
-    def __init__(self):
+    def __init__(self, backend: Optional[str] = None):
+
+        self.backend = backend or RowParser.backend_for("GF")
 
         self.headers = [
             "Country",
@@ -531,6 +267,8 @@ class GF_Parser:
         self.contents = {}
 
         self.contents = {name:self.get_source(name) for name in self.files}
+        self.parsed = {}
+        self.changes = {}
 
     def get_source(self, file: str) -> str:
 
@@ -540,42 +278,35 @@ class GF_Parser:
 
         return content
 
-    def extract_link_from_td(self, td):
-        anchor = td.find('a')
-        if anchor and anchor.get('href'):
-            return anchor.get('href')
-        return None
-
     def format_json(self, cells: list) -> dict:
          return {
-            'country': cells[0].get_text(strip=True),
-            'location': cells[1].get_text(strip=True),
-            'oblast': cells[2].get_text(strip=True),
-            'service': cells[3].get_text(strip=True),
-            'main_user': cells[4].get_text(strip=True),
-            'state': cells[5].get_text(strip=True),
+            'country': cells[0].text,
+            'location': cells[1].text,
+            'oblast': cells[2].text,
+            'service': cells[3].text,
+            'main_user': cells[4].text,
+            'state': cells[5].text,
             
             # Link extractions
-            'image': self.extract_link_from_td(cells[6]),
-            'topo': self.extract_link_from_td(cells[7]),
-            'street': self.extract_link_from_td(cells[8]),
-            'rail': self.extract_link_from_td(cells[9]),
-            'kml': self.extract_link_from_td(cells[10]),
-            'poi': self.extract_link_from_td(cells[11])
+            'image': cells[6].href,
+            'topo': cells[7].href,
+            'street': cells[8].href,
+            'rail': cells[9].href,
+            'kml': cells[10].href,
+            'poi': cells[11].href
         }
 
     def parse_table(self, table_name:str) -> list:
 
+        if table_name in self.parsed:
+            return self.parsed.pop(table_name)
+
         container = []
 
-        soup = BeautifulSoup(self.contents[table_name], 'html.parser')
-        
-        rows = soup.find_all('tr')
-        
-        for row in rows:
-            cells = row.find_all('td')
+        for cells in RowParser.rows(self.contents[table_name], self.backend):
             
             row_data = self.format_json(cells)
+            row_data.update(GeoTools.extract_coordinates(row_data))
             
             container.append(row_data)
         
@@ -631,92 +362,77 @@ class GF_Parser:
         
         db_path = "../sqlite-database/ru-ground-forces.sqlite"
         conn = sqlite3.connect(db_path)
+        changed = False
         
         try:
+            changes = Ingest.begin(conn)
+
             if barracks_tanks:
-                df_tanks = pd.DataFrame(barracks_tanks[1:] if len(barracks_tanks) > 1 else barracks_tanks)
-                df_tanks.to_sql('barracks_tank_forces', conn, if_exists='replace', index=False)
+                Ingest.upsert(conn, 'barracks_tank_forces', barracks_tanks[1:] if len(barracks_tanks) > 1 else barracks_tanks, changes)
             
             if barracks_motorized:
-                df_motorized = pd.DataFrame(barracks_motorized[1:] if len(barracks_motorized) > 1 else barracks_motorized)
-                df_motorized.to_sql('barracks_motorized_rifle_forces', conn, if_exists='replace', index=False)
+                Ingest.upsert(conn, 'barracks_motorized_rifle_forces', barracks_motorized[1:] if len(barracks_motorized) > 1 else barracks_motorized, changes)
             
             if barracks_artillery:
-                df_artillery = pd.DataFrame(barracks_artillery[1:] if len(barracks_artillery) > 1 else barracks_artillery)
-                df_artillery.to_sql('barracks_artillery_forces', conn, if_exists='replace', index=False)
+                Ingest.upsert(conn, 'barracks_artillery_forces', barracks_artillery[1:] if len(barracks_artillery) > 1 else barracks_artillery, changes)
             
             if barracks_airborne:
-                df_airborne = pd.DataFrame(barracks_airborne[1:] if len(barracks_airborne) > 1 else barracks_airborne)
-                df_airborne.to_sql('barracks_airborne_forces', conn, if_exists='replace', index=False)
+                Ingest.upsert(conn, 'barracks_airborne_forces', barracks_airborne[1:] if len(barracks_airborne) > 1 else barracks_airborne, changes)
             
             if barracks_headquarters:
-                df_headquarters = pd.DataFrame(barracks_headquarters[1:] if len(barracks_headquarters) > 1 else barracks_headquarters)
-                df_headquarters.to_sql('barracks_headquarters_forces', conn, if_exists='replace', index=False)
+                Ingest.upsert(conn, 'barracks_headquarters_forces', barracks_headquarters[1:] if len(barracks_headquarters) > 1 else barracks_headquarters, changes)
             
             if other_barracks:
-                df_other_barracks = pd.DataFrame(other_barracks[1:] if len(other_barracks) > 1 else other_barracks)
-                df_other_barracks.to_sql('other_barracks', conn, if_exists='replace', index=False)
+                Ingest.upsert(conn, 'other_barracks', other_barracks[1:] if len(other_barracks) > 1 else other_barracks, changes)
             
             if other_military_bases:
-                df_other_bases = pd.DataFrame(other_military_bases[1:] if len(other_military_bases) > 1 else other_military_bases)
-                df_other_bases.to_sql('other_military_bases', conn, if_exists='replace', index=False)
+                Ingest.upsert(conn, 'other_military_bases', other_military_bases[1:] if len(other_military_bases) > 1 else other_military_bases, changes)
             
             if other_facilities:
-                df_other_facilities = pd.DataFrame(other_facilities[1:] if len(other_facilities) > 1 else other_facilities)
-                df_other_facilities.to_sql('other_facilities', conn, if_exists='replace', index=False)
+                Ingest.upsert(conn, 'other_facilities', other_facilities[1:] if len(other_facilities) > 1 else other_facilities, changes)
             
             if special_facilities:
-                df_special = pd.DataFrame(special_facilities[1:] if len(special_facilities) > 1 else special_facilities)
-                df_special.to_sql('special_facilities', conn, if_exists='replace', index=False)
-            
+                Ingest.upsert(conn, 'special_facilities', special_facilities[1:] if len(special_facilities) > 1 else special_facilities, changes)
+            
+            if changes:
+                moves = GeoTools.update_spatial_index(conn, changes)
+                GeoTools.build_proximity_graph(conn=conn)
+                GeoTools.update_density_grid(conn, moves)
+                GeoTools.update_cluster_index(conn, moves)
+                QueryEngine.build_filter_columns(conn, changes)
+                QueryEngine.update_fulltext_index(conn, changes)
+                changes.record(conn)
             conn.commit()
+            changed = bool(changes)
+            self.changes = changes.summary()
             logger.info("Database updated successfully!")
+
+            # the gazetteer is a separate database, only updated once the rows are committed
+            if changed:
+                try:
+                    GeoTools.update_gazetteer("GF", conn, changes)
+                except Exception as e:
+                    logger.info(f"Error updating gazetteer: {e}")
             
         except Exception as e:
             logger.info(f"Error updating database: {e}")
             conn.rollback()
+            return False
             
         finally:
             conn.close()
+            if changed:
+                ConnectionPool.invalidate(db_path)
+                ResultCache.bump()
         
-        return
+        return True
 
-    def check_login_and_update(self):
-        file_path = "../logs/last-update.txt"
-        current_time = datetime.now()
-        
-        if os.path.exists(file_path):
-            with open(file_path, "r") as f:
-                stored_time_str = f.read().strip()
-                
-            try:
-                last_login = datetime.strptime(stored_time_str, "%Y-%m-%d %H:%M:%S")
-                
-                delta = current_time - last_login
-                
-                if delta > timedelta(hours=24):
-                    d = GF_downloader()
-                    d.download_source()
-                    d.extract_tables()
-                    d.save_tables_to_files()
-                    logger.info("Updating database...")
-                    self.push_to_database()
-                    logger.info("Finished updating database !")
-                    
-            except ValueError:
-                logger.info("Stored format was invalid. Updating timestamp.")
-                self.push_to_database()
-        else:
-            logger.info("First login detected. Creating storage file.")
-            self.push_to_database()
-
-        with open(file_path, "w") as f:
-            f.write(current_time.strftime("%Y-%m-%d %H:%M:%S"))
-
-    def run(self):
-
-        self.check_login_and_update()
-
-        return 
+    def job(self) -> tuple:
+        """Source key, downloader and database of this parser, as Manifest.refresh() takes them."""
+        return ("GF", self, GF_downloader, "../sqlite-database/ru-ground-forces.sqlite")
+
+    def run(self, checked: Optional[dict] = None) -> bool:
+
+        return Manifest.refresh(*self.job(), checked=checked)
 
 # eof 
\ No newline at end of file
@@ -1,14 +1,20 @@
 import sqlite3
 import re
 import math
-from geopy.geocoders import Nominatim
-from geopy.exc import GeocoderTimedOut
+import json
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from scipy.spatial import cKDTree
 from mcp.types import Icon
 import logging
 import os 
 import sys 
 from pathlib import Path
 
+from modules import Geocoder, Oblast, ConnectionPool, ResultCache
+
 os.chdir(os.path.dirname(os.path.abspath(__file__)))
 
 logging.basicConfig(
@@ -19,91 +25,1533 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
-def extract_maps(origin: tuple, radius_km: float, mode: str = "ground") -> dict:
+DATABASES = {
+    "ground": "../sqlite-database/ru-ground-forces.sqlite",
+    "airfield": "../sqlite-database/ru-airfields.sqlite",
+    "depot": "../sqlite-database/ru-depots.sqlite",
+    "poi": "../sqlite-database/ru-poi.sqlite"
+}
+
+EARTH_RADIUS_KM = 6371.0
+
+def data_tables(cursor: sqlite3.Cursor) -> list:
     """
-        Returns a dictionary where:
-            Key: Table Name
-            Value: List of rows (including distance) found within that table
+        Lists the asset tables of a database, skipping SQLite internals
+        and the "_"-prefixed tables built by the ingest pipeline.
     """
+    cursor.execute(
+        "SELECT name FROM sqlite_master WHERE type='table' "
+        "AND name NOT LIKE 'sqlite_%' AND name NOT LIKE '\\_%' ESCAPE '\\';"
+    )
+    return [t[0] for t in cursor.fetchall()]
 
-    if mode == "ground":
-        db_name = "ru-ground-forces.sqlite"
-    elif mode == "airfield":
-        db_name = "ru-airfields.sqlite"
-    elif mode == "depot":
-        db_name = "ru-depots.sqlite"
-    
-    try:
-        conn = sqlite3.connect("../sqlite-database/"+db_name)
-        cursor = conn.cursor()
-    except sqlite3.OperationalError:
-        print(f"Error: Could not find database {db_name}")
-        return {}
+def has_table(cursor: sqlite3.Cursor, name: str) -> bool:
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name = ?", (name,))
+    return bool(cursor.fetchall())
 
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-    tables = [t[0] for t in cursor.fetchall()]
-    
-    categorized_results = {}
+# normalized filter columns written at ingest (see QueryEngine.build_filter_columns),
+# only there to be indexed and never returned to the user
+HIDDEN_COLUMNS = ("country_code", "service_code", "oblast_id")
+
+def visible_columns(cursor: sqlite3.Cursor, table: str) -> list:
+    """
+        Lists the columns of a table that are returned to the user, as
+        quoted identifiers ready for a SELECT.
+    """
+    cursor.execute(f"PRAGMA table_info(`{table}`)")
+    return [f"`{col[1]}`" for col in cursor.fetchall() if col[1] not in HIDDEN_COLUMNS]
+
+NAME_COLUMNS = ("location", "locations", "air_base")
+
+def asset_identity(row: dict) -> list:
+    """
+        What identifies an asset row across edits of its other columns:
+        the Osint_NNNN source id of its "kml" link, its "loc_id" for a
+        point of interest, or else its name and oblast. Coordinates are
+        left out on purpose, so that a moved site keeps its identity.
+    """
+    match = re.search(r"(Osint_\w+)\.kml", row.get("kml") or "")
+    if match:
+        return ["kml", match.group(1)]
+    if row.get("loc_id"):
+        return ["loc_id", row["loc_id"]]
+    return ["name", *[row.get(c) for c in NAME_COLUMNS if c in row], row.get("oblast")]
+
+def row_keys(rows: list) -> list:
+    """
+        Stable key of every row: the JSON list of its asset_identity(),
+        followed by the rank of the row among the rows sharing it, in
+        order, so that duplicates keep distinct keys.
+    """
+    seen = Counter()
+    keys = []
+
+    for row in rows:
+        identity = tuple(asset_identity(row))
+        keys.append(json.dumps([*identity, seen[identity]], ensure_ascii=False, default=str))
+        seen[identity] += 1
+
+    return keys
+
+def asset_keys(cursor: sqlite3.Cursor, table: str) -> dict:
+    """
+        rowid -> stable key (see row_keys()) of the rows of an asset
+        table: the one the ingest keeps in "_row_state", or for a
+        database written without row states, the key of the row among
+        the rows of the table in rowid order.
+    """
+    if has_table(cursor, "_row_state"):
+        cursor.execute("SELECT asset_rowid, row_key FROM _row_state WHERE table_name = ?", (table,))
+        keys = dict(cursor.fetchall())
+        if keys:
+            return keys
+
+    cursor.execute(f"SELECT rowid, * FROM `{table}` ORDER BY rowid")
+    columns = [col[0] for col in cursor.description][1:]
+    stored = cursor.fetchall()
+    return dict(zip(
+        [values[0] for values in stored],
+        row_keys([dict(zip(columns, values[1:])) for values in stored])
+    ))
+
+def create_spatial_index(cursor: sqlite3.Cursor) -> bool:
+    """
+        Creates "_asset_index" and "_asset_rtree" when missing. An index
+        from before asset keys were stored is migrated, keeping its ids.
+
+        Returns:
+            True when the index was created or migrated
+    """
+    cursor.execute("PRAGMA table_info(_asset_index)")
+    columns = [col[1] for col in cursor.fetchall()]
+    if "asset_key" in columns:
+        return False
+
+    cursor.execute("DROP TABLE IF EXISTS _asset_rtree")
+    cursor.execute(
+        "CREATE TABLE _asset_index_new ("
+        "id INTEGER PRIMARY KEY AUTOINCREMENT, table_name TEXT NOT NULL, asset_key TEXT NOT NULL, "
+        "asset_rowid INTEGER NOT NULL, lat REAL NOT NULL, lon REAL NOT NULL)"
+    )
+
+    if columns:
+        cursor.execute("SELECT id, table_name, asset_rowid, lat, lon FROM _asset_index")
+        indexed = cursor.fetchall()
+        keys = {
+            table: asset_keys(cursor, table) if has_table(cursor, table) else {}
+            for table in {row[1] for row in indexed}
+        }
+        cursor.executemany(
+            "INSERT INTO _asset_index_new VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (asset_id, table, keys[table].get(rowid, f"#{rowid}"), rowid, lat, lon)
+                for asset_id, table, rowid, lat, lon in indexed
+            ]
+        )
+
+    cursor.execute("DROP TABLE IF EXISTS _asset_index")
+    cursor.execute("ALTER TABLE _asset_index_new RENAME TO _asset_index")
+    cursor.execute("CREATE UNIQUE INDEX _asset_index_key ON _asset_index (table_name, asset_key)")
+    cursor.execute("CREATE INDEX _asset_index_source ON _asset_index (table_name, asset_rowid)")
+    cursor.execute("CREATE VIRTUAL TABLE _asset_rtree USING rtree(id, min_lat, max_lat, min_lon, max_lon)")
+    cursor.execute("INSERT INTO _asset_rtree SELECT id, lat, lat, lon, lon FROM _asset_index")
+    return True
+
+def index_assets(cursor: sqlite3.Cursor, table: str, keys: dict = None) -> list:
+    """
+        Brings the "_asset_index" and "_asset_rtree" entries of one asset
+        table in line with its rows: all of them, or only the rows under
+        keys (row key -> rowid, None for a deleted row).
+
+        Returns:
+            The points that left or entered the index as (table, lat, lon,
+            -1 or 1) tuples; an asset that is still indexed is in both
+    """
+    cursor.execute(f"PRAGMA table_info(`{table}`)")
+    columns = [col[1] for col in cursor.fetchall()]
+
+    if keys is None:
+        cursor.execute("SELECT asset_key, id, asset_rowid, lat, lon FROM _asset_index WHERE table_name = ?", (table,))
+    else:
+        cursor.execute(
+            "SELECT asset_key, id, asset_rowid, lat, lon FROM _asset_index "
+            "WHERE table_name = ? AND asset_key IN (SELECT value FROM json_each(?))",
+            (table, json.dumps(list(keys)))
+        )
+    indexed = {key: values for key, *values in cursor.fetchall()}
+    current = {}
+
+    if 'lat' in columns:
+        query = f"SELECT rowid, lat, lon FROM `{table}` WHERE lat IS NOT NULL AND lon IS NOT NULL"
+        if keys is None:
+            rowid_keys = asset_keys(cursor, table)
+            cursor.execute(f"{query} ORDER BY rowid")
+        else:
+            rowid_keys = {rowid: key for key, rowid in keys.items() if rowid is not None}
+            cursor.execute(f"{query} AND rowid IN (SELECT value FROM json_each(?)) ORDER BY rowid", (json.dumps(list(rowid_keys)),))
+        for rowid, lat, lon in cursor.fetchall():
+            current[rowid_keys.get(rowid, f"#{rowid}")] = (rowid, lat, lon)
+
+    moves = []
+    for key, (asset_id, rowid, lat, lon) in indexed.items():
+        if key not in current:
+            cursor.execute("DELETE FROM _asset_index WHERE id = ?", (asset_id,))
+            cursor.execute("DELETE FROM _asset_rtree WHERE id = ?", (asset_id,))
+        elif current[key] != (rowid, lat, lon):
+            cursor.execute("UPDATE _asset_index SET asset_rowid = ?, lat = ?, lon = ? WHERE id = ?", (*current[key], asset_id))
+            cursor.execute(
+                "UPDATE _asset_rtree SET min_lat = ?, max_lat = ?, min_lon = ?, max_lon = ? WHERE id = ?",
+                (current[key][1], current[key][1], current[key][2], current[key][2], asset_id)
+            )
+        moves.append((table, lat, lon, -1))
+
+    for key, (rowid, lat, lon) in current.items():
+        if key not in indexed:
+            cursor.execute(
+                "INSERT INTO _asset_index (table_name, asset_key, asset_rowid, lat, lon) VALUES (?, ?, ?, ?, ?)",
+                (table, key, rowid, lat, lon)
+            )
+            cursor.execute("INSERT INTO _asset_rtree VALUES (?, ?, ?, ?, ?)", (cursor.lastrowid, lat, lat, lon, lon))
+        moves.append((table, lat, lon, 1))
+
+    return moves
 
+def build_spatial_index(conn: sqlite3.Connection) -> int:
+    """
+        Brings the spatial index of a database up to date with the lat/lon
+        columns written by the parsers. "_asset_index" maps an asset id to
+        its table and rowid, "_asset_rtree" is the R*Tree over the same ids.
+
+        Asset ids are stable: a row keeps its id for as long as its key
+        (see asset_keys()) exists, and ids of removed rows are never
+        handed out again, so asset ids kept by clients and the edges of
+        "_asset_links" stay valid across ingests.
+
+        Returns:
+            Number of indexed assets
+    """
+    cursor = conn.cursor()
+    create_spatial_index(cursor)
+
+    tables = data_tables(cursor)
     for table in tables:
+        index_assets(cursor, table)
+
+    cursor.execute("SELECT DISTINCT table_name FROM _asset_index")
+    for (table,) in cursor.fetchall():
+        if table not in tables:
+            index_assets(cursor, table)
+
+    cursor.execute("SELECT COUNT(*) FROM _asset_index")
+    count = cursor.fetchone()[0]
+
+    logger.info(f"Spatial index rebuilt with {count} assets")
+    return count
+
+def update_spatial_index(conn: sqlite3.Connection, changes) -> list | None:
+    """
+        Updates the spatial index for the rows of an Ingest.ChangeSet only;
+        tables that were recreated are reconciled as a whole.
+
+        Returns:
+            The points that left or entered the index (see index_assets()),
+            or None when the whole index had to be built
+    """
+    cursor = conn.cursor()
+    if create_spatial_index(cursor):
+        build_spatial_index(conn)
+        return None
+
+    moves = []
+    for table in changes.tables():
+        moves.extend(index_assets(cursor, table, None if table in changes.reloaded else changes.keys(table)))
+
+    logger.info(f"Spatial index updated for {len(changes.changes)} changed rows")
+    return moves
+
+def build_gazetteer(source: str, conn: sqlite3.Connection) -> int:
+    """
+        Refreshes the offline gazetteer entries of one source from the
+        place names of its database and their parsed coordinates. Every
+        canonical oblast also gets the centroid of the assets inside it.
+
+        Returns:
+            Number of gazetteer rows written
+    """
+    cursor = conn.cursor()
+    rows = place_rows(cursor) + region_rows(cursor)
+
+    Geocoder.gazetteer().replace_source(source, rows)
+    Geocoder.refresh_geonames()
+    return len(rows)
+
+def place_rows(cursor: sqlite3.Cursor, names: list = None) -> list:
+    """
+        Gazetteer rows (name, oblast, group, lat, lon, weight, kind) of the
+        place names of a database, one per table, name and oblast, at the
+        centroid of the assets sharing them. With names, only the rows of
+        those names.
+    """
+    rows = []
+
+    for table in data_tables(cursor):
         cursor.execute(f"PRAGMA table_info(`{table}`)")
         columns = [col[1] for col in cursor.fetchall()]
-        
-        if 'image' not in columns:
+
+        if 'lat' not in columns:
             continue
-            
-        img_index = columns.index('image')
-        cursor.execute(f"SELECT * FROM `{table}`")
+
+        oblast = "oblast" if "oblast" in columns else "NULL"
+
+        for column in [c for c in NAME_COLUMNS if c in columns]:
+            query = (
+                f"SELECT `{column}`, {oblast}, AVG(lat), AVG(lon), COUNT(*) FROM `{table}` "
+                f"WHERE lat IS NOT NULL AND `{column}` != ''"
+            )
+            if names is None:
+                cursor.execute(f"{query} GROUP BY `{column}`, {oblast}")
+            else:
+                cursor.execute(
+                    f"{query} AND `{column}` IN (SELECT value FROM json_each(?)) GROUP BY `{column}`, {oblast}",
+                    (json.dumps(names),)
+                )
+            rows.extend(
+                (name, obl, obl, lat, lon, count, "place")
+                for name, obl, lat, lon, count in cursor.fetchall()
+            )
+
+    return rows
+
+def region_rows(cursor: sqlite3.Cursor, regions: set = None) -> list:
+    """
+        Gazetteer rows of every canonical oblast (or only of regions) with
+        assets, under its name with and without its type, at the centroid
+        of the assets inside it.
+    """
+    types = {element["region"]: element["type"] for element in Oblast.all_oblasts()}
+    region_sums = {}
+
+    for table in data_tables(cursor):
+        cursor.execute(f"PRAGMA table_info(`{table}`)")
+        columns = [col[1] for col in cursor.fetchall()]
+
+        if 'lat' not in columns or 'oblast' not in columns:
+            continue
+
+        cursor.execute(
+            f"SELECT oblast, SUM(lat), SUM(lon), COUNT(*) FROM `{table}` "
+            f"WHERE lat IS NOT NULL GROUP BY oblast"
+        )
+        for obl, sum_lat, sum_lon, count in cursor.fetchall():
+            region = Oblast.get_fuzzy_oblast(obl)
+            if region not in types or (regions is not None and region not in regions):
+                continue
+            sums = region_sums.setdefault(region, [0.0, 0.0, 0])
+            sums[0] += sum_lat
+            sums[1] += sum_lon
+            sums[2] += count
+
+    return [
+        (name, region, region, sum_lat / count, sum_lon / count, count, "region")
+        for region, (sum_lat, sum_lon, count) in region_sums.items()
+        for name in (region, f"{region} {types[region]}")
+    ]
+
+def update_gazetteer(source: str, conn: sqlite3.Connection, changes) -> int:
+    """
+        Refreshes the gazetteer entries of one source for the rows of an
+        Ingest.ChangeSet only: the places a changed row was or is named
+        after and the oblasts it was or is in. Falls back to
+        build_gazetteer() when a table was recreated or the source has no
+        entries yet.
+
+        Returns:
+            Number of gazetteer rows written
+    """
+    gazetteer = Geocoder.gazetteer()
+    if changes.reloaded or not gazetteer.has_source(source):
+        return build_gazetteer(source, conn)
+
+    cursor = conn.cursor()
+    places, oblasts = set(), set()
+
+    for table in changes.tables():
+        cursor.execute(
+            f"SELECT * FROM `{table}` WHERE rowid IN (SELECT value FROM json_each(?))",
+            (json.dumps(changes.rowids(table, "inserted", "updated")),)
+        )
+        fields = [col[0] for col in cursor.description]
+        rows = [dict(zip(fields, values)) for values in cursor.fetchall()]
+
+        for row in rows + list(changes.old_rows.get(table, {}).values()):
+            oblasts.add(row.get("oblast"))
+            places.update((row[c], row.get("oblast")) for c in NAME_COLUMNS if row.get(c))
+
+    types = {element["region"]: element["type"] for element in Oblast.all_oblasts()}
+    regions = {Oblast.get_fuzzy_oblast(obl) for obl in oblasts} & set(types)
+
+    rows = [
+        row for row in place_rows(cursor, sorted({name for name, _ in places}))
+        if (row[0], row[1]) in places
+    ] + region_rows(cursor, regions)
+    stale = [(name, obl, "place") for name, obl in places] + [
+        (name, region, "region") for region in regions for name in (region, f"{region} {types[region]}")
+    ]
+
+    gazetteer.update_source(source, stale, rows)
+    Geocoder.refresh_geonames()
+    return len(rows)
+
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+DENSITY_PRECISIONS = (2, 3, 4, 5, 6)
+
+def geohash(lat: float, lon: float, precision: int) -> str:
+    """
+        Encodes a coordinate as a geohash of the given length.
+    """
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    cell, bits, char, even = [], 0, 0, True
+
+    while len(cell) < precision:
+        rng, value = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        char <<= 1
+        if value >= mid:
+            char |= 1
+            rng[0] = mid
+        else:
+            rng[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            cell.append(GEOHASH_ALPHABET[char])
+            bits, char = 0, 0
+
+    return "".join(cell)
+
+def geohash_bounds(cell: str) -> tuple:
+    """
+        Returns the (min_lat, max_lat, min_lon, max_lon) box of a geohash.
+    """
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+
+    for char in cell:
+        value = GEOHASH_ALPHABET.index(char)
+        for shift in range(4, -1, -1):
+            rng = lon_range if even else lat_range
+            mid = (rng[0] + rng[1]) / 2
+            if value >> shift & 1:
+                rng[0] = mid
+            else:
+                rng[1] = mid
+            even = not even
+
+    return lat_range[0], lat_range[1], lon_range[0], lon_range[1]
+
+def build_density_grid(conn: sqlite3.Connection) -> int:
+    """
+        Rebuilds "_asset_density" from the spatial index: the number of
+        assets per geohash cell and table, for every precision in
+        DENSITY_PRECISIONS.
+
+        Returns:
+            Number of cells written
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT table_name, lat, lon, 1 FROM _asset_index")
+    counts = density_counts(cursor.fetchall())
+
+    cursor.execute("DROP TABLE IF EXISTS _asset_density")
+    cursor.execute(
+        "CREATE TABLE _asset_density ("
+        "precision INTEGER NOT NULL, cell TEXT NOT NULL, table_name TEXT NOT NULL, count INTEGER NOT NULL, "
+        "min_lat REAL NOT NULL, max_lat REAL NOT NULL, min_lon REAL NOT NULL, max_lon REAL NOT NULL, "
+        "PRIMARY KEY (precision, cell, table_name)) WITHOUT ROWID"
+    )
+    cursor.executemany(
+        "INSERT INTO _asset_density VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        [(precision, cell, table, count, *geohash_bounds(cell)) for (precision, cell, table), count in counts.items()]
+    )
+
+    logger.info(f"Density grid rebuilt with {len(counts)} cells")
+    return len(counts)
+
+def density_counts(points) -> dict:
+    """
+        Sums (table, lat, lon, count) points per (precision, cell, table).
+        Each point is hashed once at the finest precision, the coarser
+        cells are its prefixes.
+    """
+    counts = {}
+    finest = max(DENSITY_PRECISIONS)
+    for table, lat, lon, count in points:
+        cell = geohash(lat, lon, finest)
+        for precision in DENSITY_PRECISIONS:
+            key = (precision, cell[:precision], table)
+            counts[key] = counts.get(key, 0) + count
+    return counts
+
+def update_density_grid(conn: sqlite3.Connection, moves: list | None) -> int:
+    """
+        Applies the points that left or entered the spatial index (see
+        update_spatial_index()) to the counts of "_asset_density". The
+        grid is built from scratch when moves is None or it is missing.
+
+        Returns:
+            Number of cells changed
+    """
+    cursor = conn.cursor()
+    if moves is None or not has_table(cursor, "_asset_density"):
+        return build_density_grid(conn)
+
+    counts = {key: count for key, count in density_counts(moves).items() if count}
+    cursor.executemany(
+        "INSERT INTO _asset_density VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT (precision, cell, table_name) DO UPDATE SET count = count + excluded.count",
+        [(precision, cell, table, count, *geohash_bounds(cell)) for (precision, cell, table), count in counts.items()]
+    )
+    cursor.executemany(
+        "DELETE FROM _asset_density WHERE precision = ? AND cell = ? AND table_name = ? AND count <= 0",
+        list(counts)
+    )
+
+    logger.info(f"Density grid updated in {len(counts)} cells")
+    return len(counts)
+
+CLUSTER_MAX_ZOOM = 16
+# cluster cells are 64 px wide on a 256 px web map tile
+CLUSTER_CELLS_PER_TILE = 4
+MERCATOR_MAX_LAT = 85.05112878
+
+def mercator(lat: float, lon: float) -> tuple:
+    """
+        Projects a coordinate to web mercator, both axes in [0, 1).
+    """
+    lat = max(-MERCATOR_MAX_LAT, min(MERCATOR_MAX_LAT, lat))
+    x = (lon + 180.0) / 360.0
+    y = 0.5 - math.log(math.tan(math.pi / 4 + math.radians(lat) / 2)) / (2 * math.pi)
+    return min(max(x, 0.0), 1 - 1e-12), min(max(y, 0.0), 1 - 1e-12)
+
+def cluster_cells(zoom: int) -> int:
+    return (1 << zoom) * CLUSTER_CELLS_PER_TILE
+
+def asset_labels(cursor: sqlite3.Cursor) -> dict:
+    """
+        Maps every indexed asset id to its place name, for the markers of
+        single-asset clusters.
+    """
+    labels = {}
+    for table in data_tables(cursor):
+        cursor.execute(f"PRAGMA table_info(`{table}`)")
+        columns = [col[1] for col in cursor.fetchall()]
+        names = [f"`{c}`" for c in NAME_COLUMNS if c in columns]
+        if 'lat' not in columns or not names:
+            continue
+
+        cursor.execute(
+            f"SELECT i.id, COALESCE({', '.join(names + ['NULL'])}) FROM _asset_index i "
+            f"JOIN `{table}` t ON t.rowid = i.asset_rowid WHERE i.table_name = ?",
+            (table,)
+        )
+        labels.update(cursor.fetchall())
+    return labels
+
+def build_cluster_index(conn: sqlite3.Connection) -> int:
+    """
+        Rebuilds "_asset_clusters", a grid cluster hierarchy over web
+        mercator for zoom levels 0 to CLUSTER_MAX_ZOOM. Assets are binned
+        once at the deepest zoom; every coarser level merges the four child
+        cells of the level below, keeping count, centroid and counts per
+        asset type (source table).
+
+        Returns:
+            Number of clusters written
+    """
+    cursor = conn.cursor()
+    labels = asset_labels(cursor)
+    cursor.execute("SELECT id, table_name, lat, lon FROM _asset_index")
+    level = deepest_clusters(cursor.fetchall())
+
+    rows = []
+    for zoom in range(CLUSTER_MAX_ZOOM, -1, -1):
+        parents = {}
+        for (cx, cy), cluster in level.items():
+            count, sum_lat, sum_lon, types, asset_id = cluster
+            rows.append(cluster_row(zoom, (cx, cy), cluster, labels.get(asset_id)))
+
+            parent = parents.setdefault((cx >> 1, cy >> 1), [0, 0.0, 0.0, {}, asset_id])
+            parent[0] += count
+            parent[1] += sum_lat
+            parent[2] += sum_lon
+            for table, n in types.items():
+                parent[3][table] = parent[3].get(table, 0) + n
+        level = parents
+
+    cursor.execute("DROP TABLE IF EXISTS _asset_clusters")
+    cursor.execute(
+        "CREATE TABLE _asset_clusters ("
+        "zoom INTEGER NOT NULL, cell_x INTEGER NOT NULL, cell_y INTEGER NOT NULL, count INTEGER NOT NULL, "
+        "lat REAL NOT NULL, lon REAL NOT NULL, dominant_type TEXT NOT NULL, type_counts TEXT NOT NULL, "
+        "asset_id INTEGER, label TEXT, "
+        "PRIMARY KEY (zoom, cell_x, cell_y)) WITHOUT ROWID"
+    )
+    cursor.executemany("INSERT INTO _asset_clusters VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    logger.info(f"Cluster index rebuilt with {len(rows)} clusters")
+    return len(rows)
+
+def deepest_clusters(assets) -> dict:
+    """
+        Bins (id, table, lat, lon) assets into the cells of CLUSTER_MAX_ZOOM,
+        (cell_x, cell_y) -> [count, sum of lat, sum of lon, count per
+        table, first asset id].
+    """
+    cells = cluster_cells(CLUSTER_MAX_ZOOM)
+    level = {}
+    for asset_id, table, lat, lon in assets:
+        x, y = mercator(lat, lon)
+        key = (int(x * cells), int(y * cells))
+        cluster = level.setdefault(key, [0, 0.0, 0.0, {}, asset_id])
+        cluster[0] += 1
+        cluster[1] += lat
+        cluster[2] += lon
+        cluster[3][table] = cluster[3].get(table, 0) + 1
+    return level
+
+def cluster_row(zoom: int, cell: tuple, cluster: list, label) -> tuple:
+    """The "_asset_clusters" row of a cluster; single-asset clusters carry its id and label."""
+    count, sum_lat, sum_lon, types, asset_id = cluster
+    dominant = max(sorted(types), key=types.get)
+    return (
+        zoom, *cell, count, sum_lat / count, sum_lon / count, dominant, json.dumps(types),
+        asset_id if count == 1 else None, label if count == 1 else None
+    )
+
+def cell_bounds(zoom: int, cell: tuple) -> tuple:
+    """
+        Returns the (min_lat, max_lat, min_lon, max_lon) box of a cluster
+        cell, padded slightly and stretched to the poles and the
+        antimeridian on the edge rows and columns that mercator() clamps
+        to.
+    """
+    cells = cluster_cells(zoom)
+    cx, cy = cell
+
+    def latitude(y):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / cells))))
+
+    min_lat = -90.0 if cy == cells - 1 else latitude(cy + 1) - 1e-7
+    max_lat = 90.0 if cy == 0 else latitude(cy) + 1e-7
+    min_lon = cx / cells * 360.0 - 180.0 - 1e-7
+    max_lon = 180.0 if cx == cells - 1 else (cx + 1) / cells * 360.0 - 180.0 + 1e-7
+    return min_lat, max_lat, min_lon, max_lon
+
+def asset_label(cursor: sqlite3.Cursor, asset_id: int):
+    """Place name of one indexed asset, as asset_labels() gives it."""
+    cursor.execute("SELECT table_name, asset_rowid FROM _asset_index WHERE id = ?", (asset_id,))
+    table, rowid = cursor.fetchone()
+
+    cursor.execute(f"PRAGMA table_info(`{table}`)")
+    columns = [col[1] for col in cursor.fetchall()]
+    names = [f"`{c}`" for c in NAME_COLUMNS if c in columns]
+    if not names:
+        return None
+
+    cursor.execute(f"SELECT COALESCE({', '.join(names + ['NULL'])}) FROM `{table}` WHERE rowid = ?", (rowid,))
+    return cursor.fetchone()[0]
+
+def update_cluster_index(conn: sqlite3.Connection, moves: list | None) -> int:
+    """
+        Rewrites the clusters of "_asset_clusters" that contain a point
+        that left or entered the spatial index (see update_spatial_index()).
+        The cells of CLUSTER_MAX_ZOOM are recomputed from the assets inside
+        them, every coarser one from its four children. The hierarchy is
+        built from scratch when moves is None or it is missing.
+
+        Returns:
+            Number of clusters rewritten
+    """
+    cursor = conn.cursor()
+    if moves is None or not has_table(cursor, "_asset_clusters"):
+        return build_cluster_index(conn)
+
+    cells = cluster_cells(CLUSTER_MAX_ZOOM)
+    touched = set()
+    for _, lat, lon, _ in moves:
+        x, y = mercator(lat, lon)
+        touched.add((int(x * cells), int(y * cells)))
+
+    written = 0
+    for zoom in range(CLUSTER_MAX_ZOOM, -1, -1):
+        clusters = {}
+        for cell in sorted(touched):
+            if zoom == CLUSTER_MAX_ZOOM:
+                min_lat, max_lat, min_lon, max_lon = cell_bounds(zoom, cell)
+                cursor.execute(
+                    "SELECT i.id, i.table_name, i.lat, i.lon FROM _asset_rtree r JOIN _asset_index i ON i.id = r.id "
+                    "WHERE r.max_lat >= ? AND r.min_lat <= ? AND r.max_lon >= ? AND r.min_lon <= ? ORDER BY i.id",
+                    (min_lat, max_lat, min_lon, max_lon)
+                )
+                cluster = deepest_clusters(cursor.fetchall()).get(cell)
+                label = asset_label(cursor, cluster[4]) if cluster and cluster[0] == 1 else None
+            else:
+                cx, cy = cell
+                cursor.execute(
+                    "SELECT count, lat, lon, type_counts, asset_id, label FROM _asset_clusters "
+                    "WHERE zoom = ? AND cell_x BETWEEN ? AND ? AND cell_y BETWEEN ? AND ? ORDER BY cell_x, cell_y",
+                    (zoom + 1, cx * 2, cx * 2 + 1, cy * 2, cy * 2 + 1)
+                )
+                cluster, label = None, None
+                for count, lat, lon, type_counts, asset_id, child_label in cursor.fetchall():
+                    if cluster is None:
+                        cluster, label = [0, 0.0, 0.0, {}, asset_id], child_label
+                    cluster[0] += count
+                    cluster[1] += lat * count
+                    cluster[2] += lon * count
+                    for table, n in json.loads(type_counts).items():
+                        cluster[3][table] = cluster[3].get(table, 0) + n
+            clusters[cell] = (cluster, label)
+
+        cursor.executemany(
+            "DELETE FROM _asset_clusters WHERE zoom = ? AND cell_x = ? AND cell_y = ?",
+            [(zoom, *cell) for cell, (cluster, _) in clusters.items() if cluster is None]
+        )
+        cursor.executemany(
+            "INSERT OR REPLACE INTO _asset_clusters VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [cluster_row(zoom, cell, cluster, label) for cell, (cluster, label) in clusters.items() if cluster]
+        )
+        written += len(clusters)
+        touched = {(cx >> 1, cy >> 1) for cx, cy in touched}
+
+    logger.info(f"Cluster index updated in {written} clusters")
+    return written
+
+def bounding_boxes(origin: tuple, radius_km: float) -> list:
+    """
+        Returns the (min_lat, max_lat, min_lon, max_lon) boxes that contain
+        every point within radius_km of origin. The box is split in two when
+        it crosses the antimeridian.
+    """
+    lat, lon = origin
+    angular = radius_km / EARTH_RADIUS_KM
+    dlat = math.degrees(angular)
+    min_lat, max_lat = lat - dlat, lat + dlat
+
+    if min_lat <= -90 or max_lat >= 90 or angular >= math.pi / 2:
+        return [(max(min_lat, -90.0), min(max_lat, 90.0), -180.0, 180.0)]
+
+    ratio = math.sin(angular) / math.cos(math.radians(lat))
+    if ratio >= 1:
+        return [(min_lat, max_lat, -180.0, 180.0)]
+
+    dlon = math.degrees(math.asin(ratio))
+    min_lon, max_lon = lon - dlon, lon + dlon
+
+    if min_lon < -180:
+        return [(min_lat, max_lat, min_lon + 360, 180.0), (min_lat, max_lat, -180.0, max_lon)]
+    if max_lon > 180:
+        return [(min_lat, max_lat, min_lon, 180.0), (min_lat, max_lat, -180.0, max_lon - 360)]
+    return [(min_lat, max_lat, min_lon, max_lon)]
+
+class AssetArrays:
+    """
+        Contiguous coordinate arrays for every asset of one database,
+        aligned with the ids of its "_asset_index" table.
+    """
+
+    def __init__(self, ids: np.ndarray, tables: np.ndarray, rowids: np.ndarray, lats: np.ndarray, lons: np.ndarray):
+        self.ids = ids
+        self.tables = tables
+        self.rowids = rowids
+        self.lats = lats
+        self.lons = lons
+        self._tree = None
+        self._tree_lock = threading.Lock()
+
+    @classmethod
+    def load(cls, conn: sqlite3.Connection) -> "AssetArrays":
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, table_name, asset_rowid, lat, lon FROM _asset_index ORDER BY id")
         rows = cursor.fetchall()
+        ids, tables, rowids, lats, lons = zip(*rows) if rows else ((), (), (), (), ())
+        return cls(
+            np.array(ids, dtype=np.int64),
+            np.array(tables, dtype=object),
+            np.array(rowids, dtype=np.int64),
+            np.ascontiguousarray(lats, dtype=np.float64),
+            np.ascontiguousarray(lons, dtype=np.float64)
+        )
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def positions(self, ids) -> np.ndarray:
+        """Maps asset ids to their positions in the arrays."""
+        return np.searchsorted(self.ids, np.asarray(ids, dtype=np.int64))
+
+    def tree(self) -> cKDTree:
+        """
+            KD-tree over the assets as 3D unit vectors. The chord length
+            between unit vectors grows with the great-circle distance, so
+            its nearest neighbours are the nearest assets on the sphere.
+            Built on first use and kept for the lifetime of the arrays.
+        """
+        with self._tree_lock:
+            if self._tree is None:
+                self._tree = cKDTree(unit_vectors(self.lats, self.lons))
+        return self._tree
+
+def unit_vectors(lats, lons) -> np.ndarray:
+    phi, lam = np.radians(lats), np.radians(lons)
+    return np.column_stack((np.cos(phi) * np.cos(lam), np.cos(phi) * np.sin(lam), np.sin(phi)))
+
+_arrays_cache = {}
+_arrays_lock = threading.Lock()
+
+def database_path(conn: sqlite3.Connection) -> str:
+    cursor = conn.execute("PRAGMA database_list")
+    return cursor.fetchone()[2]
+
+def asset_arrays(conn: sqlite3.Connection) -> AssetArrays:
+    """
+        Returns the coordinate arrays of the database behind conn. They are
+        cached per database file and only reloaded when the file changes.
+    """
+    path = database_path(conn)
+    if not path:
+        return AssetArrays.load(conn)
+
+    stat = os.stat(path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+
+    with _arrays_lock:
+        cached = _arrays_cache.get(path)
+        if cached and cached[0] == signature:
+            return cached[1]
+
+    arrays = AssetArrays.load(conn)
+    with _arrays_lock:
+        _arrays_cache[path] = (signature, arrays)
+    return arrays
+
+def distances(origin: tuple, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """
+        Haversine distance in km from origin to every (lats[i], lons[i])
+        pair, computed in one vectorized pass.
+    """
+    phi1 = math.radians(origin[0])
+    phi2 = np.radians(lats)
+    dphi = phi2 - phi1
+    dlambda = np.radians(lons) - math.radians(origin[1])
+    a = np.sin(dphi / 2) ** 2 + math.cos(phi1) * np.cos(phi2) * np.sin(dlambda / 2) ** 2
+    return EARTH_RADIUS_KM * 2 * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+def radius_hits(conn: sqlite3.Connection, origin: tuple, radius_km: float) -> list:
+    """
+        Runs a radius search against one database: the R*Tree returns the
+        candidates inside the bounding box and only those are checked with
+        the exact haversine distance.
+
+        Returns:
+            (table, rowid, asset_id, distance) tuples sorted by distance
+    """
+    cursor = conn.cursor()
+    arrays = asset_arrays(conn)
+
+    candidates = []
+    for box in bounding_boxes(origin, radius_km):
+        cursor.execute(
+            "SELECT id FROM _asset_rtree "
+            "WHERE max_lat >= ? AND min_lat <= ? AND max_lon >= ? AND min_lon <= ?",
+            box
+        )
+        candidates.extend(row[0] for row in cursor.fetchall())
+
+    if not candidates:
+        return []
+
+    positions = arrays.positions(candidates)
+    dist_vals = distances(origin, arrays.lats[positions], arrays.lons[positions])
+    inside = dist_vals <= radius_km
+    positions, dist_vals = positions[inside], dist_vals[inside]
+    order = np.argsort(dist_vals, kind="stable")
+
+    return [
+        (table, int(rowid), int(asset_id), float(dist_val))
+        for table, rowid, asset_id, dist_val in zip(
+            arrays.tables[positions[order]], arrays.rowids[positions[order]],
+            arrays.ids[positions[order]], dist_vals[order]
+        )
+    ]
+
+def query_radius(conn: sqlite3.Connection, origin: tuple, radius_km: float) -> dict:
+    """
+        Returns:
+            Key: Table Name
+            Value: List of rows (including distance) sorted by distance
+    """
+    cursor = conn.cursor()
+    matches = {}
+    for table, rowid, asset_id, dist_val in radius_hits(conn, origin, radius_km):
+        matches.setdefault(table, {})[rowid] = dist_val
+
+    categorized_results = {}
+
+    for table, table_distances in matches.items():
+        rowids = list(table_distances)
+        placeholders = ",".join("?" * len(rowids))
+        columns = ", ".join(visible_columns(cursor, table))
+        cursor.execute(f"SELECT rowid, {columns} FROM `{table}` WHERE rowid IN ({placeholders})", rowids)
 
         table_matches = []
+        for row in cursor.fetchall():
+            row_list = list(row[1:])
+            row_list.append(round(table_distances[row[0]], 2))
+            table_matches.append(row_list)
+
+        # Sort matches within this table by distance
+        table_matches.sort(key=lambda x: x[-1])
+        categorized_results[table] = table_matches
 
-        for row in rows:
-            coords = parse_map(row[img_index])
-            if coords:
-                dist_val = distance(origin, coords)
-                if dist_val <= radius_km:
-                    row_list = list(row)
-                    row_list.append(round(dist_val, 2))
-                    table_matches.append(row_list)
-
-        # Only add the table to the dictionary if we found matches
-        if table_matches:
-            # Sort matches within this table by distance
-            table_matches.sort(key=lambda x: x[-1])
-            categorized_results[table] = table_matches
-
-    conn.close()
     return categorized_results
 
+def query_nearest(conn: sqlite3.Connection, origin: tuple, k: int) -> list:
+    """
+        Returns the k assets of one database nearest to origin as
+        (table, rowid, asset_id, distance) tuples sorted by distance.
+    """
+    arrays = asset_arrays(conn)
+    k = min(k, len(arrays))
+    if k <= 0:
+        return []
+
+    _, positions = arrays.tree().query(unit_vectors([origin[0]], [origin[1]])[0], k=k)
+    positions = np.atleast_1d(positions)
+    dist_vals = distances(origin, arrays.lats[positions], arrays.lons[positions])
+
+    return [
+        (table, int(rowid), int(asset_id), float(dist_val))
+        for table, rowid, asset_id, dist_val in zip(
+            arrays.tables[positions], arrays.rowids[positions], arrays.ids[positions], dist_vals
+        )
+    ]
+
+def fetch_assets(conn: sqlite3.Connection, mode: str, hits: list) -> list:
+    """
+        Loads the rows behind (table, rowid, asset_id, distance) hits as
+        dictionaries tagged with their database, source table, asset id
+        and distance, keeping the order of hits. A hit may carry a fifth
+        element, a dict of extra fields merged into its row.
+    """
+    cursor = conn.cursor()
+    by_table = {}
+    for table, rowid, *_ in hits:
+        by_table.setdefault(table, []).append(rowid)
+
+    rows = {}
+    for table, rowids in by_table.items():
+        placeholders = ",".join("?" * len(rowids))
+        visible = ", ".join(visible_columns(cursor, table))
+        cursor.execute(f"SELECT rowid, {visible} FROM `{table}` WHERE rowid IN ({placeholders})", rowids)
+        columns = [description[0] for description in cursor.description][1:]
+        for row in cursor.fetchall():
+            rows[(table, row[0])] = dict(zip(columns, row[1:]))
+
+    results = []
+    for table, rowid, asset_id, dist_val, *extra in hits:
+        row = rows.get((table, rowid))
+        if row is None:
+            continue
+        results.append({
+            "database": mode,
+            "source_table": table,
+            "asset_id": asset_id,
+            **row,
+            "distance_km": round(dist_val, 2),
+            **(extra[0] if extra else {})
+        })
+    return results
+
+_executor = ThreadPoolExecutor(max_workers=len(DATABASES), thread_name_prefix="geotools")
+
+def map_databases(modes: list, work, missing: str) -> list | dict:
+    """
+        Runs work(conn, mode) on every database in modes concurrently,
+        each worker on its own connection, and returns the results in
+        the order of modes. A database error is logged and returned as
+        {"error": ...} naming the index that is missing, so the failure
+        is not cached as an empty answer.
+    """
+    def run(mode: str):
+        try:
+            with ConnectionPool.connection(DATABASES[mode]) as conn:
+                return work(conn, mode)
+        except sqlite3.Error as e:
+            logger.info(f"{missing} for {mode}, run the parsers to rebuild it: {e}")
+            return {"error": f"{missing} for {mode}, run the parsers to rebuild it: {e}"}
+
+    results = list(_executor.map(run, modes))
+    for result in results:
+        if ResultCache.is_error(result):
+            return result
+    return results
+
+def search_databases(modes: list, search, sort_key: str = "distance_km") -> list | dict:
+    """
+        Runs search(conn) on every database in modes concurrently and
+        returns the rows behind the returned hits merged and sorted by
+        sort_key.
+    """
+    found = map_databases(modes, lambda conn, mode: fetch_assets(conn, mode, search(conn)), "Spatial index unavailable")
+    if ResultCache.is_error(found):
+        return found
+
+    results = []
+    for rows in found:
+        results.extend(rows)
+
+    results.sort(key=lambda r: r[sort_key])
+    return results
+
+def nearest(origin: tuple, k: int = 10, modes: list = None) -> list | dict:
+    """
+        Returns the k nearest assets to origin across the databases in
+        modes, merged and sorted by distance.
+    """
+    modes = modes or ["airfield", "ground", "depot"]
+    results = search_databases(modes, lambda conn: query_nearest(conn, origin, k))
+    return results if ResultCache.is_error(results) else results[:k]
+
+def extract_all_maps(origin: tuple, radius_km: float, modes: list) -> list | dict:
+    """
+        Radius search over several databases at once, merged by distance.
+    """
+    return search_databases(modes, lambda conn: radius_hits(conn, origin, radius_km))
+
+def route_boxes(route: np.ndarray, buffer_km: float) -> list:
+    """
+        Bounding boxes covering the corridor of width buffer_km around a
+        route. Each segment is sampled along its great circle every
+        step_km and every sample gets a box of radius buffer_km + step_km / 2,
+        which covers the part of the segment between samples.
+    """
+    step_km = max(buffer_km, 10.0)
+    boxes = []
+
+    for (lat1, lon1), (lat2, lon2) in zip(route[:-1], route[1:]):
+        a, b = unit_vectors([lat1], [lon1])[0], unit_vectors([lat2], [lon2])[0]
+        angle = math.atan2(np.linalg.norm(np.cross(a, b)), np.dot(a, b))
+        steps = max(1, int(math.ceil(angle * EARTH_RADIUS_KM / step_km)))
+
+        if angle > 1e-12:
+            t = np.linspace(0.0, 1.0, steps + 1)[:, None]
+            samples = (np.sin((1 - t) * angle) * a + np.sin(t * angle) * b) / math.sin(angle)
+        else:
+            samples = a[None, :]
+
+        lats = np.degrees(np.arcsin(np.clip(samples[:, 2], -1.0, 1.0)))
+        lons = np.degrees(np.arctan2(samples[:, 1], samples[:, 0]))
+
+        for lat, lon in zip(lats, lons):
+            boxes.extend(bounding_boxes((float(lat), float(lon)), buffer_km + step_km / 2))
+
+    return boxes
+
+def route_hits(conn: sqlite3.Connection, route: np.ndarray, buffer_km: float) -> list:
+    """
+        Finds the assets of one database within buffer_km of a route given
+        as an (M, 2) array of lat/lon waypoints. The R*Tree prefilters the
+        candidates around each segment, then the distance from every
+        candidate to every segment is computed in one vectorized pass.
+
+        Returns:
+            (table, rowid, asset_id, distance, {"route_km": ...}) tuples,
+            route_km being the position along the route of the closest point
+    """
+    cursor = conn.cursor()
+    arrays = asset_arrays(conn)
+
+    candidates = set()
+    for box in route_boxes(route, buffer_km):
+        cursor.execute(
+            "SELECT id FROM _asset_rtree "
+            "WHERE max_lat >= ? AND min_lat <= ? AND max_lon >= ? AND min_lon <= ?",
+            box
+        )
+        candidates.update(row[0] for row in cursor.fetchall())
+
+    if not candidates:
+        return []
+
+    positions = arrays.positions(sorted(candidates))
+    points = unit_vectors(arrays.lats[positions], arrays.lons[positions])    # (N, 3)
+    starts = unit_vectors(route[:-1, 0], route[:-1, 1])                     # (M, 3)
+    ends = unit_vectors(route[1:, 0], route[1:, 1])                         # (M, 3)
+
+    def angle(u, v):
+        return np.arctan2(np.linalg.norm(np.cross(u, v), axis=-1), np.sum(u * v, axis=-1))
+
+    seg_length = angle(starts, ends)                                        # (M,)
+    normals = np.cross(starts, ends)
+    norms = np.linalg.norm(normals, axis=1)
+    degenerate = norms < 1e-12
+    normals = normals / np.where(degenerate, 1.0, norms)[:, None]
+
+    # projection of every point on every segment's great circle
+    sin_cross = points @ normals.T                                          # (N, M)
+    foot = points[:, None, :] - sin_cross[..., None] * normals[None, :, :]
+    foot /= np.maximum(np.linalg.norm(foot, axis=-1), 1e-15)[..., None]
+    along = angle(starts[None, :, :], foot)
+    ahead = np.sum(np.cross(starts[None, :, :], foot) * normals[None, :, :], axis=-1) >= 0
+    behind = np.sum(np.cross(foot, ends[None, :, :]) * normals[None, :, :], axis=-1) >= 0
+    on_segment = ahead & behind & ~degenerate[None, :]
+
+    to_start = angle(points[:, None, :], starts[None, :, :])
+    to_end = angle(points[:, None, :], ends[None, :, :])
+    offset = np.where(on_segment, np.abs(np.arcsin(np.clip(sin_cross, -1.0, 1.0))), np.minimum(to_start, to_end))
+    along = np.where(on_segment, along, np.where(to_start <= to_end, 0.0, seg_length[None, :]))
+
+    segment = np.argmin(offset, axis=1)
+    rows = np.arange(len(positions))
+    dist_vals = offset[rows, segment] * EARTH_RADIUS_KM
+    route_km = (np.concatenate(([0.0], np.cumsum(seg_length)))[segment] + along[rows, segment]) * EARTH_RADIUS_KM
+
+    inside = dist_vals <= buffer_km
+    positions, dist_vals, route_km = positions[inside], dist_vals[inside], route_km[inside]
+
+    return [
+        (table, int(rowid), int(asset_id), float(dist_val), {"route_km": round(float(km), 2)})
+        for table, rowid, asset_id, dist_val, km in zip(
+            arrays.tables[positions], arrays.rowids[positions], arrays.ids[positions], dist_vals, route_km
+        )
+    ]
+
+def along_route(route: list, buffer_km: float, modes: list) -> list | dict:
+    """
+        Corridor search over several databases, ordered by position along
+        the route.
+    """
+    route = np.asarray(route, dtype=np.float64)
+    return search_databases(modes, lambda conn: route_hits(conn, route, buffer_km), sort_key="route_km")
+
+def density_cells(conn: sqlite3.Connection, precision: int, bbox: tuple = None) -> list:
+    """
+        Reads the precomputed density cells of one database that intersect
+        bbox (south, west, north, east). A west edge greater than the east
+        edge is read as a box crossing the antimeridian.
+    """
+    query = "SELECT cell, table_name, count FROM _asset_density WHERE precision = ?"
+    if bbox is None:
+        return conn.execute(query, (precision,)).fetchall()
+
+    south, west, north, east = bbox
+    query += " AND max_lat >= ? AND min_lat <= ? AND max_lon >= ? AND min_lon <= ?"
+    lon_ranges = [(west, east)] if west <= east else [(west, 180.0), (-180.0, east)]
+
+    rows = []
+    for low, high in lon_ranges:
+        rows.extend(conn.execute(query, (precision, south, north, low, high)).fetchall())
+    return rows
+
+def density(modes: list, precision: int, bbox: tuple = None) -> list | dict:
+    """
+        Merges the density cells of the databases in modes into one entry
+        per geohash cell with its centre, bounds, total and per-table counts.
+    """
+    found = map_databases(modes, lambda conn, mode: density_cells(conn, precision, bbox), "Density grid missing")
+    if ResultCache.is_error(found):
+        return found
+
+    cells = {}
+    for rows in found:
+        for cell, table, count in rows:
+            entry = cells.get(cell)
+            if entry is None:
+                min_lat, max_lat, min_lon, max_lon = geohash_bounds(cell)
+                entry = cells[cell] = {
+                    "cell": cell,
+                    "lat": round((min_lat + max_lat) / 2, 5),
+                    "lon": round((min_lon + max_lon) / 2, 5),
+                    "bounds": [min_lat, min_lon, max_lat, max_lon],
+                    "total": 0,
+                    "counts": {}
+                }
+            entry["total"] += count
+            entry["counts"][table] = entry["counts"].get(table, 0) + count
+
+    return [cells[cell] for cell in sorted(cells)]
+
+def viewport_clusters(conn: sqlite3.Connection, zoom: int, bbox: tuple) -> list:
+    """
+        Reads the precomputed clusters of one database whose cells overlap
+        bbox (south, west, north, east) at zoom. A west edge greater than
+        the east edge is read as a box crossing the antimeridian.
+    """
+    south, west, north, east = bbox
+    cells = cluster_cells(zoom)
+    min_y = int(mercator(north, 0.0)[1] * cells)
+    max_y = int(mercator(south, 0.0)[1] * cells)
+    lon_ranges = [(west, east)] if west <= east else [(west, 180.0), (-180.0, east)]
+
+    rows = []
+    for low, high in lon_ranges:
+        rows.extend(conn.execute(
+            "SELECT cell_x, cell_y, count, lat, lon, type_counts, asset_id, label FROM _asset_clusters "
+            "WHERE zoom = ? AND cell_x BETWEEN ? AND ? AND cell_y BETWEEN ? AND ?",
+            (zoom, int(mercator(0.0, low)[0] * cells), int(mercator(0.0, high)[0] * cells), min_y, max_y)
+        ).fetchall())
+    return rows
+
+def viewport(modes: list, zoom: int, bbox: tuple) -> list | dict:
+    """
+        Merges the clusters of the databases in modes that share a cell
+        into one marker with its count, centroid, dominant type and counts
+        per type. Markers of a single asset also carry its database, asset
+        id and label.
+    """
+    found = map_databases(
+        modes, lambda conn, mode: [(mode, *row) for row in viewport_clusters(conn, zoom, bbox)], "Cluster index missing"
+    )
+    if ResultCache.is_error(found):
+        return found
+
+    merged = {}
+    for rows in found:
+        for mode, cx, cy, count, lat, lon, type_counts, asset_id, label in rows:
+            cluster = merged.setdefault((cx, cy), {"count": 0, "sum_lat": 0.0, "sum_lon": 0.0, "types": {}, "assets": []})
+            cluster["count"] += count
+            cluster["sum_lat"] += lat * count
+            cluster["sum_lon"] += lon * count
+            for table, n in json.loads(type_counts).items():
+                cluster["types"][table] = cluster["types"].get(table, 0) + n
+            cluster["assets"].append((mode, asset_id, label))
+
+    markers = []
+    for cluster in merged.values():
+        types = cluster["types"]
+        marker = {
+            "lat": round(cluster["sum_lat"] / cluster["count"], 5),
+            "lon": round(cluster["sum_lon"] / cluster["count"], 5),
+            "count": cluster["count"],
+            "dominant_type": max(sorted(types), key=types.get),
+            "type_counts": types
+        }
+        if cluster["count"] == 1:
+            mode, asset_id, label = cluster["assets"][0]
+            marker.update({"database": mode, "asset_id": asset_id, "label": label})
+        markers.append(marker)
+
+    markers.sort(key=lambda m: -m["count"])
+    return markers
+
+PROXIMITY_TARGETS = ("airfield", "depot", "ground")
+
+def build_proximity_graph(k: int = 5, databases: dict = DATABASES, conn: sqlite3.Connection = None) -> int:
+    """
+        Precomputes, for every ground forces installation, its k nearest
+        airfields, depots and other ground forces sites. The edges are
+        stored in the "_asset_links" table of the ground forces database,
+        indexed by asset id. Uses one batched KD-tree query per target
+        database, so the cost is O(N log M) instead of O(N x M).
+
+        Only the edges that differ from the stored ones are written. When
+        conn (a connection to the ground forces database) is given, the
+        graph is updated within its open transaction, next to the spatial
+        index it reads, and left for the caller to commit.
+
+        Returns:
+            Number of edges in the graph
+    """
+    own = conn is None
+    if own:
+        conn = sqlite3.connect(databases["ground"])
+    changed = False
+
+    try:
+        cursor = conn.cursor()
+        sources = asset_arrays(conn) if own else AssetArrays.load(conn)
+        edges = []
+
+        if len(sources):
+            origins = unit_vectors(sources.lats, sources.lons)
+
+            for target in PROXIMITY_TARGETS:
+                if target == "ground":
+                    targets = sources
+                else:
+                    target_conn = sqlite3.connect(databases[target])
+                    try:
+                        targets = asset_arrays(target_conn)
+                    finally:
+                        target_conn.close()
+
+                # a ground site is its own nearest neighbour, ask for one more
+                extra = 1 if target == "ground" else 0
+                count = min(k + extra, len(targets))
+                if count == 0:
+                    continue
+
+                chords, neighbours = targets.tree().query(origins, k=count)
+                chords = chords.reshape(len(sources), count)
+                neighbours = neighbours.reshape(len(sources), count)
+
+                if extra:
+                    # drop the site itself, keeping the order of the others
+                    keep = targets.ids[neighbours] != sources.ids[:, None]
+                    order = np.argsort(~keep, axis=1, kind="stable")[:, :count - 1]
+                    chords = np.take_along_axis(chords, order, axis=1)
+                    neighbours = np.take_along_axis(neighbours, order, axis=1)
+
+                # chord length on the unit sphere to great-circle distance
+                dist_vals = EARTH_RADIUS_KM * 2 * np.arcsin(np.clip(chords / 2, 0.0, 1.0))
+                ranks = np.broadcast_to(np.arange(1, neighbours.shape[1] + 1), neighbours.shape)
+                positions = neighbours.ravel()
+
+                edges.extend(zip(
+                    np.repeat(sources.ids, neighbours.shape[1]).tolist(),
+                    [target] * len(positions),
+                    targets.tables[positions].tolist(),
+                    targets.rowids[positions].tolist(),
+                    targets.ids[positions].tolist(),
+                    ranks.ravel().tolist(),
+                    np.round(dist_vals.ravel(), 2).tolist()
+                ))
+
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS _asset_links ("
+            "asset_id INTEGER NOT NULL, target_database TEXT NOT NULL, target_table TEXT NOT NULL, "
+            "target_rowid INTEGER NOT NULL, target_asset_id INTEGER NOT NULL, "
+            "rank INTEGER NOT NULL, distance_km REAL NOT NULL, "
+            "PRIMARY KEY (asset_id, target_database, rank)) WITHOUT ROWID"
+        )
+        cursor.execute(
+            "SELECT asset_id, target_database, target_table, target_rowid, target_asset_id, rank, distance_km "
+            "FROM _asset_links"
+        )
+        stored = set(cursor.fetchall())
+        wanted = set(edges)
+
+        # edges whose (asset_id, target_database, rank) slot is still used get replaced below
+        slots = {(edge[0], edge[1], edge[5]) for edge in wanted}
+        cursor.executemany(
+            "DELETE FROM _asset_links WHERE asset_id = ? AND target_database = ? AND rank = ?",
+            [(edge[0], edge[1], edge[5]) for edge in stored - wanted if (edge[0], edge[1], edge[5]) not in slots]
+        )
+        cursor.executemany("INSERT OR REPLACE INTO _asset_links VALUES (?, ?, ?, ?, ?, ?, ?)", wanted - stored)
+        changed = stored != wanted
+        if own:
+            conn.commit()
+
+    finally:
+        if own:
+            conn.close()
+            if changed:
+                ConnectionPool.invalidate(databases["ground"])
+                ResultCache.bump()
+
+    logger.info(f"Proximity graph updated with {len(edges)} edges ({len(wanted - stored)} written)")
+    return len(edges)
+
+def related(asset_id: int, database: str) -> dict:
+    """
+        Answers from the precomputed proximity graph: the ground forces
+        installation behind asset_id and its nearest airfields, depots and
+        ground forces sites. Asset ids are only unique within a database,
+        so database must name the one the id came from; the graph only
+        covers ground forces sites.
+    """
+    if database != "ground":
+        return {"error": f"related_assets only covers ground forces sites, not {database} assets"}
+
+    try:
+        with ConnectionPool.connection(DATABASES["ground"]) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT table_name, asset_rowid FROM _asset_index WHERE id = ?", (asset_id,))
+            source = cursor.fetchone()
+            if source is None:
+                return {"error": f"Unknown ground forces asset id: {asset_id}"}
+
+            found = fetch_assets(conn, "ground", [(source[0], source[1], asset_id, 0.0)])
+            if not found:
+                return {"error": f"Ground forces asset {asset_id} is no longer in the database"}
+            asset = found[0]
+            asset.pop("distance_km")
+
+            cursor.execute(
+                "SELECT target_database, target_table, target_rowid, target_asset_id, distance_km "
+                "FROM _asset_links WHERE asset_id = ? ORDER BY target_database, rank",
+                (asset_id,)
+            )
+            links = {}
+            for target, table, rowid, target_id, dist_val in cursor.fetchall():
+                links.setdefault(target, []).append((table, rowid, target_id, dist_val))
+
+        result = {"asset": asset}
+        for target in PROXIMITY_TARGETS:
+            with ConnectionPool.connection(DATABASES[target]) as target_conn:
+                result[target] = fetch_assets(target_conn, target, links.get(target, []))
+
+    except sqlite3.Error as e:
+        logger.info(f"Proximity graph unavailable, run the parsers to rebuild it: {e}")
+        return {"error": f"Proximity graph unavailable, run the parsers to rebuild it: {e}"}
+
+    return result
+
+def extract_maps(origin: tuple, radius_km: float, mode: str = "ground") -> dict:
+    """
+        Returns a dictionary where:
+            Key: Table Name
+            Value: List of rows (including distance) found within that table
+    """
+
+    db_path = DATABASES.get(mode)
+    if db_path is None:
+        logger.info(f"Unknown mode: {mode}")
+        return {}
+
+    try:
+        with ConnectionPool.connection(db_path) as conn:
+            return query_radius(conn, origin, radius_km)
+    except sqlite3.Error as e:
+        logger.info(f"Spatial index unavailable for {db_path}, run the parsers to rebuild it: {e}")
+        return {"error": f"Spatial index unavailable for {mode}, run the parsers to rebuild it: {e}"}
+
 def parse_map(url: str) -> tuple:
     if not isinstance(url, str): return None
     regex = r"@([-+]?\d+\.\d+),([-+]?\d+\.\d+)"
     match = re.search(regex, url)
     return (float(match.group(1)), float(match.group(2))) if match else None
 
+def parse_osm(url: str) -> tuple:
+    if not isinstance(url, str): return None
+    regex = r"mlat=([-+]?\d+\.\d+)&mlon=([-+]?\d+\.\d+)"
+    match = re.search(regex, url)
+    return (float(match.group(1)), float(match.group(2))) if match else None
+
+def extract_coordinates(row: dict) -> dict:
+    """
+        Resolves the coordinates of a parsed row once, at ingest time.
+        The Google Maps "image" link is preferred and the OpenStreetMap
+        "street" link is used as a fallback; "coord_source" records
+        which column the coordinates came from.
+    """
+    for column, parser in (("image", parse_map), ("street", parse_osm), ("street_link", parse_osm)):
+        coords = parser(row.get(column))
+        if coords:
+            return {"lat": coords[0], "lon": coords[1], "coord_source": column}
+    return {"lat": None, "lon": None, "coord_source": None}
+
 def distance(origin: tuple, final: tuple) -> float:
     lat1, lon1 = origin
     lat2, lon2 = final
-    R = 6371.0 
+    R = EARTH_RADIUS_KM
     phi1, phi2 = math.radians(lat1), math.radians(lat2)
     dphi, dlambda = math.radians(lat2 - lat1), math.radians(lon2 - lon1)
     a = math.sin(dphi/2)**2 + math.cos(phi1)*math.cos(phi2)*math.sin(dlambda/2)**2
     return R * (2 * math.atan2(math.sqrt(a), math.sqrt(1 - a)))
 
-def near_bases(origin: str, radius: float = 150, mode: str = "ground") -> dict:
-    geolocator = Nominatim(user_agent="osint-researcher")
-    
+def resolve_modes(mode) -> list:
+    """
+        Expands "all" and validates a mode or list of modes.
+        Raises ValueError on an unknown mode.
+    """
+    modes = list(DATABASES) if mode == "all" else [mode] if isinstance(mode, str) else list(mode)
+    unknown = [m for m in modes if m not in DATABASES]
+    if not modes:
+        raise ValueError(f"No mode given. Use {', '.join(DATABASES)} or all")
+    if unknown:
+        raise ValueError(f"Unknown mode(s): {', '.join(unknown)}. Use {', '.join(DATABASES)} or all")
+    return modes
+
+def near_bases(origin: str, radius: float = 150, mode: str | list = "ground") -> dict | list:
     try:
-        location = geolocator.geocode(origin)
-        if location:
-            logging.info(f"Found: {location.address}")
-            origin = (location.latitude, location.longitude)
-        else:
-            logging.info(f"Location not found: {origin}")
-            return {}
-    except GeocoderTimedOut:
-        logging.info("Service timed out. Try again.")
+        modes = resolve_modes(mode)
+    except ValueError as e:
+        return {"error": str(e)}
+
+    found, location = Geocoder.geocode(origin)
+
+    if not found:
+        logging.info("Geocoding service unavailable. Try again.")
+        return {"error": f"Could not geocode '{origin}': the geocoding service is unavailable"}
+    if location is None:
+        logging.info(f"Location not found: {origin}")
         return {}
 
-    return extract_maps(origin, radius, mode)
+    logging.info(f"Found: {location[2]}")
+    origin = (location[0], location[1])
+
+    if isinstance(mode, str) and mode != "all":
+        return extract_maps(origin, radius, mode)
+    return extract_all_maps(origin, radius, modes)
+
+def nearest_bases(origin: str, k: int = 10, modes: list = None) -> list | dict:
+    try:
+        modes = resolve_modes(modes or ["airfield", "ground", "depot"])
+    except ValueError as e:
+        return {"error": str(e)}
+    if k < 1:
+        return {"error": "k must be at least 1"}
+
+    found, location = Geocoder.geocode(origin)
+
+    if not found:
+        logging.info("Geocoding service unavailable. Try again.")
+        return {"error": f"Could not geocode '{origin}': the geocoding service is unavailable"}
+    if location is None:
+        logging.info(f"Location not found: {origin}")
+        return []
+
+    logging.info(f"Found: {location[2]}")
+    return nearest((location[0], location[1]), k, modes)
+
+def assets_along(waypoints: list, buffer_km: float = 20, modes: list = None) -> list | dict:
+    try:
+        modes = resolve_modes(modes or ["airfield", "ground", "depot"])
+    except ValueError as e:
+        return {"error": str(e)}
+    if len(waypoints) < 2:
+        return {"error": "A route needs at least two waypoints"}
+    if buffer_km <= 0:
+        return {"error": "buffer_km must be positive"}
+
+    route = []
+    for waypoint in waypoints:
+        found, location = Geocoder.geocode(waypoint)
+        if not found:
+            return {"error": f"Could not geocode '{waypoint}': the geocoding service is unavailable"}
+        if location is None:
+            return {"error": f"Waypoint not found: {waypoint}"}
+        logging.info(f"Waypoint: {location[2]}")
+        route.append((location[0], location[1]))
+
+    return along_route(route, buffer_km, modes)
+
+def density_grid(modes: list = None, precision: int = 4, bbox: list = None) -> list | dict:
+    try:
+        modes = resolve_modes(modes or ["airfield", "ground", "depot"])
+    except ValueError as e:
+        return {"error": str(e)}
+    if precision not in DENSITY_PRECISIONS:
+        return {"error": f"Unsupported precision {precision}. Use one of {', '.join(map(str, DENSITY_PRECISIONS))}"}
+    if bbox is not None:
+        if len(bbox) != 4:
+            return {"error": "bbox must be [south, west, north, east]"}
+        if bbox[0] > bbox[2]:
+            return {"error": "bbox south edge is north of its north edge"}
+
+    return density(modes, precision, tuple(bbox) if bbox is not None else None)
+
+def map_viewport(bbox: list, zoom: int, modes: list = None) -> list | dict:
+    try:
+        modes = resolve_modes(modes or ["airfield", "ground", "depot"])
+    except ValueError as e:
+        return {"error": str(e)}
+    if len(bbox) != 4:
+        return {"error": "bbox must be [south, west, north, east]"}
+    if bbox[0] > bbox[2]:
+        return {"error": "bbox south edge is north of its north edge"}
+
+    zoom = max(0, min(CLUSTER_MAX_ZOOM, int(zoom)))
+    return viewport(modes, zoom, tuple(bbox))
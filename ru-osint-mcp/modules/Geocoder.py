@@ -0,0 +1,365 @@
+import sqlite3
+import json
+import re
+import time
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Optional
+from geopy.geocoders import Nominatim
+from geopy.exc import GeocoderServiceError
+import logging
+import os 
+import sys 
+
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+logging.basicConfig(
+    level=logging.INFO,
+    stream=sys.stdout,
+    format="%(asctime)s — %(levelname)s — %(name)s — %(message)s",
+)
+
+logger = logging.getLogger(__name__)
+
+def load_settings() -> dict:
+
+    with open("../config/settings.json","r",encoding="utf-8") as settings_file:
+        settings = json.loads(settings_file.read())
+        settings_file.close()
+
+    return settings["geocoder"]
+
+COORDINATES = re.compile(r"^\s*([-+]?\d+(?:\.\d+)?)\s*,\s*([-+]?\d+(?:\.\d+)?)\s*$")
+
+def normalize_key(place: str) -> str:
+    """
+        Normalizes a place name into a cache key, so that "Voronezh",
+        " voronezh " and "VORONEZH," all share the same entry.
+    """
+    text = unicodedata.normalize("NFKC", place).casefold()
+    text = re.sub(r"[^\w]+", " ", text)
+    return " ".join(text.split())
+
+class GeocodeCache:
+    """
+        Persistent geocoding cache backed by SQLite.
+
+        Entries expire after a TTL and the least recently used ones are
+        evicted once max_entries is reached. Places that could not be
+        found are cached too (with NULL coordinates and a shorter TTL).
+        A small in-memory LRU sits in front of SQLite so that repeated
+        origins are answered without any I/O.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        ttl: float,
+        negative_ttl: float,
+        max_entries: int = 10000,
+        memory_entries: int = 512
+    ):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS geocode ("
+            "key TEXT PRIMARY KEY, query TEXT, lat REAL, lon REAL, address TEXT, "
+            "expires REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS geocode_last_used ON geocode (last_used)")
+        self.conn.commit()
+
+    def _remember(self, key: str, value: Optional[tuple], expires: float):
+        self.memory[key] = (value, expires)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def get(self, key: str, allow_stale: bool = False) -> tuple:
+        """
+            Returns (found, value) where value is (lat, lon, address) or None
+            for a cached miss. Expired entries are only returned with
+            allow_stale, which is used when the geocoding service is down.
+        """
+        now = time.time()
+
+        with self.lock:
+            cached = self.memory.get(key)
+            if cached and (allow_stale or cached[1] > now):
+                self.memory.move_to_end(key)
+                return True, cached[0]
+
+            row = self.conn.execute(
+                "SELECT lat, lon, address, expires FROM geocode WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row is None or (not allow_stale and row[3] <= now):
+                return False, None
+
+            self.conn.execute("UPDATE geocode SET last_used = ? WHERE key = ?", (now, key))
+            self.conn.commit()
+
+            value = (row[0], row[1], row[2]) if row[0] is not None else None
+            self._remember(key, value, row[3])
+            return True, value
+
+    def put(self, key: str, query: str, value: Optional[tuple]):
+        """Stores a geocoding result (or a miss when value is None)."""
+        now = time.time()
+        expires = now + (self.ttl if value else self.negative_ttl)
+        lat, lon, address = value if value else (None, None, None)
+
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO geocode (key, query, lat, lon, address, expires, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, query, lat, lon, address, expires, now)
+            )
+
+            count = self.conn.execute("SELECT COUNT(*) FROM geocode").fetchone()[0]
+            if count > self.max_entries:
+                self.conn.execute(
+                    "DELETE FROM geocode WHERE key IN "
+                    "(SELECT key FROM geocode ORDER BY last_used LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+
+            self.conn.commit()
+            self._remember(key, value, expires)
+
+class Gazetteer:
+    """
+        Offline place-name index built at ingest from the names and parsed
+        coordinates of our own databases (locations, air bases, oblasts),
+        optionally extended with a local GeoNames dump. Names are stored
+        under their normalized key; rows sharing a key and a group (the
+        oblast for dataset names, the GeoNames id for dump entries) are
+        merged into one weighted centroid on lookup.
+    """
+
+    KIND_PRIORITY = {"place": 0, "geonames": 1, "region": 2}
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS places ("
+            "key TEXT NOT NULL, name TEXT, oblast TEXT, grp TEXT, lat REAL NOT NULL, lon REAL NOT NULL, "
+            "weight REAL NOT NULL, kind TEXT NOT NULL, source TEXT NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS places_key ON places (key)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS places_source ON places (source)")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS sources (source TEXT PRIMARY KEY, signature TEXT, updated REAL)"
+        )
+        self.conn.commit()
+
+    def replace_source(self, source: str, rows: list, signature: Optional[str] = None):
+        """
+            Replaces every entry of a source with rows of
+            (name, oblast, group, lat, lon, weight, kind).
+        """
+        with self.lock:
+            self.conn.execute("DELETE FROM places WHERE source = ?", (source,))
+            self.conn.executemany(
+                "INSERT INTO places (key, name, oblast, grp, lat, lon, weight, kind, source) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (normalize_key(name), name, oblast, grp, lat, lon, weight, kind, source)
+                    for name, oblast, grp, lat, lon, weight, kind in rows
+                    if name and normalize_key(name)
+                ]
+            )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO sources (source, signature, updated) VALUES (?, ?, ?)",
+                (source, signature, time.time())
+            )
+            self.conn.commit()
+
+        logger.info(f"Gazetteer source {source} updated with {len(rows)} names")
+
+    def has_source(self, source: str) -> bool:
+        with self.lock:
+            row = self.conn.execute("SELECT 1 FROM sources WHERE source = ?", (source,)).fetchone()
+        return row is not None
+
+    def update_source(self, source: str, stale: list, rows: list):
+        """
+            Replaces some entries of a source: the entries named by stale,
+            (name, group, kind) tuples, are deleted and rows, as for
+            replace_source(), are added.
+        """
+        with self.lock:
+            self.conn.executemany(
+                "DELETE FROM places WHERE key = ? AND source = ? AND name = ? AND grp IS ? AND kind = ?",
+                [(normalize_key(name), source, name, grp, kind) for name, grp, kind in stale if name]
+            )
+            self.conn.executemany(
+                "INSERT INTO places (key, name, oblast, grp, lat, lon, weight, kind, source) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (normalize_key(name), name, oblast, grp, lat, lon, weight, kind, source)
+                    for name, oblast, grp, lat, lon, weight, kind in rows
+                    if name and normalize_key(name)
+                ]
+            )
+            self.conn.execute("UPDATE sources SET updated = ? WHERE source = ?", (time.time(), source))
+            self.conn.commit()
+
+        logger.info(f"Gazetteer source {source} updated for {len(stale)} names")
+
+    def load_geonames(self, path: str):
+        """
+            Loads a GeoNames-style dump (tab separated: geonameid, name,
+            asciiname, alternatenames, latitude, longitude, ..., population
+            in column 15). Skipped when the file did not change since the
+            last load.
+        """
+        stat = os.stat(path)
+        signature = f"{stat.st_mtime_ns}:{stat.st_size}"
+
+        with self.lock:
+            row = self.conn.execute("SELECT signature FROM sources WHERE source = 'geonames'").fetchone()
+        if row and row[0] == signature:
+            return
+
+        rows = []
+        with open(path, "r", encoding="utf-8") as dump:
+            for line in dump:
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) < 15:
+                    continue
+                try:
+                    lat, lon = float(fields[4]), float(fields[5])
+                except ValueError:
+                    continue
+                weight = float(fields[14] or 0) + 1
+                names = {fields[1], fields[2], *fields[3].split(",")}
+                rows.extend((name, None, fields[0], lat, lon, weight, "geonames") for name in names if name)
+
+        self.replace_source("geonames", rows, signature)
+
+    def lookup(self, place: str) -> Optional[tuple]:
+        """
+            Returns (lat, lon, address) for a known place name or None.
+            Dataset locations win over GeoNames entries, which win over
+            oblast centroids; within a kind the group with the most weight
+            is used.
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT name, oblast, kind, SUM(lat * weight) / SUM(weight), "
+                "SUM(lon * weight) / SUM(weight), SUM(weight) "
+                "FROM places WHERE key = ? GROUP BY kind, grp",
+                (normalize_key(place),)
+            ).fetchall()
+
+        if not rows:
+            return None
+
+        name, oblast, kind, lat, lon, _ = min(rows, key=lambda r: (self.KIND_PRIORITY.get(r[2], 9), -r[5]))
+        address = f"{name}, {oblast}" if oblast and oblast != name else name
+        return lat, lon, f"{address} (offline gazetteer)"
+
+_settings = None
+_cache = None
+_gazetteer = None
+_geolocator = None
+_init_lock = threading.Lock()
+
+def _client() -> tuple:
+    """Creates the shared cache and Nominatim client on first use."""
+    global _settings, _cache, _geolocator
+
+    with _init_lock:
+        if _cache is None:
+            _settings = load_settings()
+            _cache = GeocodeCache(
+                _settings["cache_path"],
+                ttl=_settings["ttl_days"] * 86400,
+                negative_ttl=_settings["negative_ttl_hours"] * 3600,
+                max_entries=_settings["max_entries"],
+                memory_entries=_settings["memory_entries"]
+            )
+            _geolocator = Nominatim(user_agent=_settings["user_agent"], timeout=_settings["timeout"])
+
+    return _settings, _cache, _geolocator
+
+def gazetteer() -> Gazetteer:
+    """Opens the shared offline gazetteer on first use."""
+    global _gazetteer
+
+    with _init_lock:
+        if _gazetteer is None:
+            _gazetteer = Gazetteer(load_settings()["gazetteer_path"])
+
+    return _gazetteer
+
+def refresh_geonames():
+    """Loads the GeoNames dump configured in settings.json, if any."""
+    path = load_settings().get("geonames_path")
+    if not path:
+        return
+
+    try:
+        gazetteer().load_geonames(path)
+    except OSError as e:
+        logger.info(f"Could not load GeoNames dump: {e}")
+
+def geocode(origin: str) -> tuple:
+    """
+        Resolves a place name (or a "lat, lon" string) to coordinates: the
+        offline gazetteer is tried first, then the cache, and Nominatim
+        only on a miss of both.
+
+        Returns:
+            (found, value) where value is (lat, lon, address) or None when
+            the place does not exist. found is False only when the place is
+            not cached and Nominatim could not be reached.
+    """
+    match = COORDINATES.match(origin)
+    if match:
+        lat, lon = float(match.group(1)), float(match.group(2))
+        if -90 <= lat <= 90 and -180 <= lon <= 180:
+            return True, (lat, lon, f"{lat}, {lon}")
+
+    place = gazetteer().lookup(origin)
+    if place:
+        return True, place
+
+    settings, cache, geolocator = _client()
+    key = normalize_key(origin)
+
+    found, value = cache.get(key)
+    if found:
+        return True, value
+
+    for attempt in range(settings["retries"] + 1):
+        try:
+            location = geolocator.geocode(origin)
+            break
+        except GeocoderServiceError as e:
+            logger.info(f"Geocoding attempt {attempt + 1} for '{origin}' failed: {e}")
+            if attempt < settings["retries"]:
+                time.sleep(0.5 * 2 ** attempt)
+    else:
+        # Nominatim is unreachable: an expired answer is better than none
+        return cache.get(key, allow_stale=True)
+
+    value = (location.latitude, location.longitude, location.address) if location else None
+    cache.put(key, origin, value)
+    return True, value
+
+# eof
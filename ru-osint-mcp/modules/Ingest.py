@@ -0,0 +1,242 @@
+import json
+import sqlite3
+import hashlib
+import logging
+import os
+import sys
+
+import pandas as pd
+
+from modules import GeoTools, Manifest
+
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+logging.basicConfig(
+    level=logging.INFO,
+    stream=sys.stdout,
+    format="%(asctime)s — %(levelname)s — %(name)s — %(message)s",
+)
+
+logger = logging.getLogger(__name__)
+
+CHANGES = ("inserted", "updated", "deleted")
+
+def load_settings() -> dict:
+
+    with open("../config/settings.json","r",encoding="utf-8") as settings_file:
+        settings = json.loads(settings_file.read())
+        settings_file.close()
+
+    return settings["ingest"]
+
+def row_hash(row: dict) -> str:
+    """sha256 of the values of a row, independent of the column order."""
+    values = json.dumps([[column, row[column]] for column in sorted(row)], ensure_ascii=False, default=str)
+    return hashlib.sha256(values.encode("utf-8")).hexdigest()
+
+class ChangeSet:
+    """
+        Rows inserted, updated and deleted by one ingest of a database,
+        as (table, row key, change, rowid) tuples. old_rows keeps the
+        updated and deleted rows as they were before the ingest
+        ({table: {rowid: row}}) and reloaded the tables that were
+        recreated, so that the derived indexes can be brought up to date
+        for the changed rows only.
+    """
+
+    def __init__(self):
+        self.changes = []
+        self.old_rows = {}
+        self.reloaded = set()
+
+    def add(self, table: str, key: str, change: str, rowid: int):
+        self.changes.append((table, key, change, rowid))
+
+    def __bool__(self) -> bool:
+        return bool(self.changes)
+
+    def tables(self) -> list:
+        """Tables with at least one change, in the order they were ingested."""
+        return list(dict.fromkeys(table for table, _, _, _ in self.changes))
+
+    def keys(self, table: str) -> dict:
+        """Row key -> rowid of the changed rows of table, None for a deleted row."""
+        return {
+            key: None if change == "deleted" else rowid
+            for name, key, change, rowid in self.changes if name == table
+        }
+
+    def rowids(self, table: str, *changes: str) -> list:
+        """Rowids of the rows of table with one of the given changes."""
+        return [rowid for name, _, change, rowid in self.changes if name == table and change in changes]
+
+    def summary(self) -> dict:
+        """Counts per table, {table: {"inserted": n, "updated": n, "deleted": n}}."""
+        summary = {}
+        for table, _, change, _ in self.changes:
+            counts = summary.setdefault(table, dict.fromkeys(CHANGES, 0))
+            counts[change] += 1
+        return summary
+
+    def record(self, conn: sqlite3.Connection) -> str:
+        """
+            Appends the changes to "_change_log" under the time of this
+            refresh and drops the change sets older than the last
+            keep_change_sets ones. Returns the refresh time.
+        """
+        refreshed_at = Manifest.now()
+        cursor = conn.cursor()
+
+        cursor.executemany(
+            "INSERT INTO _change_log (refreshed_at, table_name, row_key, change) VALUES (?, ?, ?, ?)",
+            [(refreshed_at, table, key, change) for table, key, change, _ in self.changes]
+        )
+        cursor.execute(
+            "DELETE FROM _change_log WHERE refreshed_at NOT IN ("
+            "SELECT DISTINCT refreshed_at FROM _change_log ORDER BY refreshed_at DESC LIMIT ?)",
+            (load_settings()["keep_change_sets"],)
+        )
+
+        return refreshed_at
+
+def begin(conn: sqlite3.Connection) -> ChangeSet:
+    """
+        Opens the write transaction of an ingest, creating the row state
+        and change log tables on first use:
+
+            _row_state  - key, content hash and rowid of every ingested row
+            _change_log - the rows each refresh inserted, updated or deleted
+    """
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS _row_state ("
+        "table_name TEXT NOT NULL, row_key TEXT NOT NULL, row_hash TEXT NOT NULL, "
+        "asset_rowid INTEGER NOT NULL, PRIMARY KEY (table_name, row_key))"
+    )
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS _change_log ("
+        "refreshed_at TEXT NOT NULL, table_name TEXT NOT NULL, row_key TEXT NOT NULL, change TEXT NOT NULL)"
+    )
+    cursor.execute("CREATE INDEX IF NOT EXISTS _change_log_refreshed_at ON _change_log (refreshed_at)")
+
+    return ChangeSet()
+
+def data_columns(cursor: sqlite3.Cursor, table: str) -> list:
+    """Columns of an asset table written by the parsers, without the derived filter columns."""
+    cursor.execute(f"PRAGMA table_info(`{table}`)")
+    return [col[1] for col in cursor.fetchall() if col[1] not in GeoTools.HIDDEN_COLUMNS]
+
+def stored_state(cursor: sqlite3.Cursor, table: str, columns: list) -> dict:
+    """
+        key -> (hash, rowid) of the rows of table. Read from _row_state,
+        or rebuilt from the table itself when the two disagree (a
+        database written before row states were kept).
+    """
+    cursor.execute(f"SELECT COUNT(*) FROM `{table}`")
+    count = cursor.fetchone()[0]
+
+    cursor.execute("SELECT row_key, row_hash, asset_rowid FROM _row_state WHERE table_name = ?", (table,))
+    state = {key: (digest, rowid) for key, digest, rowid in cursor.fetchall()}
+    if len(state) == count:
+        return state
+
+    cursor.execute(f"SELECT rowid, {', '.join(f'`{c}`' for c in columns)} FROM `{table}` ORDER BY rowid")
+    stored = cursor.fetchall()
+    rows = [dict(zip(columns, values[1:])) for values in stored]
+    state = {
+        key: (row_hash(row), values[0])
+        for key, row, values in zip(GeoTools.row_keys(rows), rows, stored)
+    }
+
+    cursor.execute("DELETE FROM _row_state WHERE table_name = ?", (table,))
+    cursor.executemany(
+        "INSERT INTO _row_state VALUES (?, ?, ?, ?)",
+        [(table, key, digest, rowid) for key, (digest, rowid) in state.items()]
+    )
+    return state
+
+def reload(cursor: sqlite3.Cursor, table: str, rows: list, keys: list, changes: ChangeSet):
+    """Recreates a table whose columns changed (or a new one) with the column types to_sql would pick."""
+    cursor.execute(f"DROP TABLE IF EXISTS `{table}`")
+    cursor.execute("DELETE FROM _row_state WHERE table_name = ?", (table,))
+    cursor.execute(pd.io.sql.get_schema(pd.DataFrame(rows), table))
+    changes.reloaded.add(table)
+
+    for key, row in zip(keys, rows):
+        changes.add(table, key, "inserted", insert(cursor, table, key, row))
+
+def insert(cursor: sqlite3.Cursor, table: str, key: str, row: dict) -> int:
+    columns = list(row)
+    cursor.execute(
+        f"INSERT INTO `{table}` ({', '.join(f'`{c}`' for c in columns)}) "
+        f"VALUES ({', '.join('?' for _ in columns)})",
+        [row[c] for c in columns]
+    )
+    rowid = cursor.lastrowid
+    cursor.execute("INSERT INTO _row_state VALUES (?, ?, ?, ?)", (table, key, row_hash(row), rowid))
+    return rowid
+
+def stored_rows(cursor: sqlite3.Cursor, table: str, rowids: list) -> dict:
+    """rowid -> row (every column, as a dict) of the given rows of table."""
+    cursor.execute(
+        f"SELECT rowid AS _rowid, * FROM `{table}` WHERE rowid IN (SELECT value FROM json_each(?))",
+        (json.dumps(rowids),)
+    )
+    columns = [col[0] for col in cursor.description]
+    return {values[0]: dict(zip(columns[1:], values[1:])) for values in cursor.fetchall()}
+
+def upsert(conn: sqlite3.Connection, table: str, rows: list, changes: ChangeSet) -> None:
+    """
+        Brings table to rows by applying only the differences, within
+        the transaction opened by begin(): rows with a new key are
+        inserted, rows whose content hash changed are updated in place
+        (keeping their rowid) and rows whose key is gone are deleted.
+        Every change is added to changes, and the updated and deleted
+        rows are kept in changes.old_rows as they were before.
+
+        When the columns of rows differ from the ones of the table, the
+        table is recreated instead.
+    """
+    cursor = conn.cursor()
+    columns = list(rows[0])
+    keys = GeoTools.row_keys(rows)
+
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name = ?", (table,))
+    if cursor.fetchone() is None or set(data_columns(cursor, table)) != set(columns):
+        reload(cursor, table, rows, keys, changes)
+        return
+
+    state = stored_state(cursor, table, columns)
+    updates = []
+
+    for key, row in zip(keys, rows):
+        stored = state.pop(key, None)
+        if stored is None:
+            changes.add(table, key, "inserted", insert(cursor, table, key, row))
+        elif stored[0] != row_hash(row):
+            updates.append((key, row, stored[1]))
+            changes.add(table, key, "updated", stored[1])
+
+    changes.old_rows[table] = stored_rows(
+        cursor, table, [rowid for _, _, rowid in updates] + [rowid for _, rowid in state.values()]
+    )
+
+    cursor.executemany(
+        f"UPDATE `{table}` SET {', '.join(f'`{c}` = ?' for c in columns)} WHERE rowid = ?",
+        [[row.get(c) for c in columns] + [rowid] for _, row, rowid in updates]
+    )
+    cursor.executemany(
+        "UPDATE _row_state SET row_hash = ? WHERE table_name = ? AND row_key = ?",
+        [(row_hash(row), table, key) for key, row, _ in updates]
+    )
+
+    cursor.executemany(f"DELETE FROM `{table}` WHERE rowid = ?", [(rowid,) for _, rowid in state.values()])
+    cursor.executemany(
+        "DELETE FROM _row_state WHERE table_name = ? AND row_key = ?",
+        [(table, key) for key in state]
+    )
+    for key, (_, rowid) in state.items():
+        changes.add(table, key, "deleted", rowid)
+
+# eof
@@ -0,0 +1,280 @@
+import json
+import sqlite3
+import hashlib
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional
+import logging
+import os
+import sys
+
+from modules import GeoTools, Fetch, RowParser
+
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+logging.basicConfig(
+    level=logging.INFO,
+    stream=sys.stdout,
+    format="%(asctime)s — %(levelname)s — %(name)s — %(message)s",
+)
+
+logger = logging.getLogger(__name__)
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+def load_settings() -> dict:
+
+    with open("../config/settings.json","r",encoding="utf-8") as settings_file:
+        settings = json.loads(settings_file.read())
+        settings_file.close()
+
+    return settings["manifest"]
+
+_lock = threading.Lock()
+
+def load() -> dict:
+    """
+        Reads the freshness manifest: one entry per source (the keys of
+        config/url.json) with its last fetch and check times, the hash
+        of the fetched page and of the table files the parser reads,
+        the ETag/Last-Modified validators and the row counts of the last
+        ingest.
+    """
+    path = Path(load_settings()["path"])
+    if not path.exists():
+        return {}
+
+    try:
+        with open(path,"r",encoding="utf-8") as manifest_file:
+            manifest = json.loads(manifest_file.read())
+            manifest_file.close()
+    except (OSError, ValueError):
+        logger.info(f"Manifest {path} unreadable, starting a new one")
+        return {}
+
+    return manifest
+
+def entry(source: str) -> dict:
+    return dict(load().get(source, {}))
+
+def update(source: str, **fields) -> dict:
+    """Merges fields into the entry of a source and rewrites the manifest atomically."""
+    path = Path(load_settings()["path"])
+
+    with _lock:
+        manifest = load()
+        current = manifest.setdefault(source, {})
+        current.update(fields)
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = path.with_suffix(".tmp")
+        with open(temporary,"w",encoding="utf-8") as manifest_file:
+            manifest_file.write(json.dumps(manifest, indent=4, ensure_ascii=False))
+            manifest_file.close()
+        os.replace(temporary, path)
+
+    return dict(current)
+
+def now() -> str:
+    return datetime.now().strftime(TIME_FORMAT)
+
+def is_stale(current: dict, max_age_hours: float = None) -> bool:
+    """A source is stale when it was never checked or its last check is older than max_age_hours."""
+    if max_age_hours is None:
+        max_age_hours = load_settings()["max_age_hours"]
+
+    try:
+        checked = datetime.strptime(current["checked_at"], TIME_FORMAT)
+    except (KeyError, TypeError, ValueError):
+        return True
+
+    return datetime.now() - checked > timedelta(hours=max_age_hours)
+
+def content_hash(contents) -> str:
+    """sha256 of one text, or of several in the given order."""
+    digest = hashlib.sha256()
+    for text in ([contents] if isinstance(contents, str) else contents):
+        digest.update(text.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+def row_counts(db_path: str) -> dict:
+    conn = sqlite3.connect(db_path)
+    try:
+        cursor = conn.cursor()
+        return {
+            table: cursor.execute(f"SELECT COUNT(*) FROM `{table}`").fetchone()[0]
+            for table in GeoTools.data_tables(cursor)
+        }
+    finally:
+        conn.close()
+
+def validators(downloader) -> dict:
+    """Fetch time and ETag/Last-Modified of the page a downloader holds."""
+    return {
+        "checked_at": downloader.fetched_at,
+        "fetched_at": downloader.fetched_at,
+        "etag": downloader.etag,
+        "last_modified": downloader.last_modified
+    }
+
+def check(source: str, downloader_class):
+    """
+        Fetch stage of one source. When the source is stale its page is
+        fetched, conditionally on its stored ETag/Last-Modified, and the
+        outcome recorded.
+
+        The validators of a changed page are not saved here but by
+        prepare(), together with its source_hash once it was split, so
+        that a failed split is not answered with a 304 on the next
+        refresh.
+
+        Returns:
+            The downloader holding the page when it changed, else None
+    """
+    current = entry(source)
+    if not is_stale(current):
+        return None
+
+    downloader = downloader_class()
+    fetched = downloader.download_source(current.get("etag"), current.get("last_modified"))
+
+    if not fetched:
+        update(source, failed_at=now())
+        logger.info(f"{source} could not be fetched, keeping the local tables until the next refresh")
+        return None
+
+    downloader.fetched_at = now()
+    if downloader.not_modified:
+        update(source, checked_at=downloader.fetched_at)
+        logger.info(f"{source} not modified upstream")
+        return None
+
+    if downloader.source_hash == current.get("source_hash"):
+        update(source, **validators(downloader))
+        logger.info(f"{source} fetched, page unchanged")
+        return None
+    return downloader
+
+def check_all(downloader_classes: dict) -> dict:
+    """
+        Runs check() for several sources (source -> downloader class) in
+        parallel, so a refresh cycle costs one round trip per source.
+        Returns source -> downloader or None.
+    """
+    results = Fetch.run_all({
+        source: (lambda source=source, cls=cls: check(source, cls))
+        for source, cls in downloader_classes.items()
+    })
+
+    for source, result in results.items():
+        if isinstance(result, Exception):
+            logger.info(f"{source} check failed: {result}")
+            results[source] = None
+
+    return results
+
+def prepare(source: str, parser, downloader_class, db_path: str, checked: Optional[dict] = None) -> Optional[str]:
+    """
+        Fetch and split stage of refresh(): the page goes through check()
+        (or is taken from checked, the result of check_all()) and is
+        split into table files only when its hash changed. The table
+        files are then loaded into parser.
+
+        Returns:
+            The hash of the table files when they differ from the ones of
+            the last ingest (or the database is missing), else None
+    """
+    if checked is not None and source in checked:
+        downloader = checked[source]
+    else:
+        downloader = check(source, downloader_class)
+
+    if downloader is not None:
+        downloader.extract_tables()
+        downloader.save_tables_to_files()
+        update(source, source_hash=downloader.source_hash, **validators(downloader))
+        logger.info(f"{source} changed upstream, tables extracted")
+
+    current = entry(source)
+    parser.contents = {name: parser.get_source(name) for name in parser.files}
+    parsed_hash = content_hash(parser.contents[name] for name in parser.files)
+
+    if parsed_hash == current.get("content_hash") and Path(db_path).exists():
+        logger.info(f"{source} tables unchanged, skipping the parse")
+        return None
+    return parsed_hash
+
+def ingest(source: str, parser, db_path: str, parsed_hash: str) -> bool:
+    """
+        Writes the rows of parser to its database and records the ingest,
+        with the rows it inserted, updated and deleted per table.
+
+        Returns:
+            True when the ingest changed at least one row
+    """
+    if not parser.push_to_database():
+        update(source, failed_at=now())
+        return False
+
+    update(
+        source,
+        content_hash=parsed_hash,
+        ingested_at=now(),
+        row_counts=row_counts(db_path),
+        changes=parser.changes
+    )
+    return bool(parser.changes)
+
+def failed(source: str, error: Exception):
+    update(source, failed_at=now())
+    logger.info(f"Refreshing {source} failed, keeping the local tables until the next refresh: {error}")
+
+def refresh(source: str, parser, downloader_class, db_path: str, checked: Optional[dict] = None) -> bool:
+    """
+        Brings one source up to date: prepare(), then, when its table
+        files changed, parse them (see RowParser.parse_all()) and ingest().
+
+        Returns:
+            True when rows of the database changed
+    """
+    return refresh_all([(source, parser, downloader_class, db_path)], checked)[source]
+
+def refresh_all(jobs: list, checked: Optional[dict] = None) -> dict:
+    """
+        refresh() for several sources (source, parser, downloader class,
+        database path tuples). The table files of every changed source
+        are parsed together, so parsing can use every core, while the
+        databases are written one after the other in the given order.
+
+        A source whose fetch, split or ingest fails is logged, marked with
+        failed_at and left as it was; the other sources still refresh.
+
+        Returns:
+            source -> True when rows of its database changed
+    """
+    pending = []
+    rebuilt = {}
+
+    for source, parser, downloader_class, db_path in jobs:
+        rebuilt[source] = False
+        try:
+            parsed_hash = prepare(source, parser, downloader_class, db_path, checked)
+        except Exception as e:
+            failed(source, e)
+            continue
+        if parsed_hash is not None:
+            pending.append((source, parser, db_path, parsed_hash))
+
+    RowParser.parse_all([parser for _, parser, _, _ in pending])
+
+    for source, parser, db_path, parsed_hash in pending:
+        try:
+            rebuilt[source] = ingest(source, parser, db_path, parsed_hash)
+        except Exception as e:
+            failed(source, e)
+
+    return rebuilt
+
+# eof
@@ -1,4 +1,5 @@
 import sqlite3
+from modules import GeoTools, ConnectionPool
 
 class Metadata:
     def __init__(self):
@@ -15,17 +16,14 @@ class Metadata:
         results = {}
         try:
 
-            conn = sqlite3.connect(f"{db_name}.sqlite")
-            cursor = conn.cursor()
-            
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-            tables = [row[0] for row in cursor.fetchall()]
-            
-            for table in tables:
-                cursor.execute(f"SELECT COUNT(*) FROM [{table}];")
-                results[table] = cursor.fetchone()[0]
+            with ConnectionPool.connection(f"../sqlite-database/{db_name}.sqlite") as conn:
+                cursor = conn.cursor()
+                
+                tables = GeoTools.data_tables(cursor)
                 
-            conn.close()
+                for table in tables:
+                    cursor.execute(f"SELECT COUNT(*) FROM [{table}];")
+                    results[table] = cursor.fetchone()[0]
         except sqlite3.Error as e:
             return {"error": f"Could not access {db_name}: {str(e)}"}
             
@@ -2,57 +2,57 @@ import difflib
 from typing import Optional
 
 regions_data = [
-    {"region": "Adygea", "type": "Republic", "map": 1, "link": None},
-    {"region": "Arkhangelsk", "type": "Oblast", "map": None, "link": None},
-    {"region": "Astrachan", "type": "Oblast", "map": None, "link": None},
-    {"region": "Belgorod", "type": "Oblast", "map": None, "link": None},
-    {"region": "Bryansk", "type": "Oblast", "map": None, "link": None},
-    {"region": "Chechnya", "type": "Republic", "map": None, "link": None},
-    {"region": "Chelyabinsk", "type": "Oblast", "map": 1, "link": None},
-    {"region": "Crimea", "type": "Republic", "map": None, "link": "Oblast_40O.htm"},
-    {"region": "Dagestan", "type": "Republic", "map": None, "link": None},
-    {"region": "Ingushetia", "type": "Republic", "map": None, "link": None},
-    {"region": "Ivanovo", "type": "Oblast", "map": 2, "link": None},
-    {"region": "Kabardino-Balkar", "type": "Republic", "map": 7, "link": None},
-    {"region": "Kaliningrad", "type": "Oblast", "map": None, "link": None},
-    {"region": "Kalmyk", "type": "Republic", "map": 8, "link": None},
-    {"region": "Kaluga", "type": "Oblast", "map": 3, "link": None},
-    {"region": "Karachay-Cherkess", "type": "Republic", "map": 9, "link": None},
-    {"region": "Karelia", "type": "Republic", "map": None, "link": None},
-    {"region": "Kemerovo", "type": "Oblast", "map": 5, "link": None},
-    {"region": "Komi", "type": "Republic", "map": None, "link": None},
-    {"region": "Kostroma", "type": "Oblast", "map": 6, "link": None},
-    {"region": "Krasnodar", "type": "Kray", "map": 1, "link": "Oblast_38O.htm"},
-    {"region": "Kursk", "type": "Oblast", "map": None, "link": None},
-    {"region": "Leningrad", "type": "Oblast", "map": None, "link": None},
-    {"region": "Lipetsk", "type": "Oblast", "map": 8, "link": None},
-    {"region": "Mari El", "type": "Republic", "map": 11, "link": None},
-    {"region": "Mordovia", "type": "Republic", "map": 12, "link": None},
-    {"region": "Moscow", "type": "Oblast", "map": 10, "link": None},
-    {"region": "Murmansk", "type": "Oblast", "map": None, "link": None},
-    {"region": "Nizhny Novgorod", "type": "Oblast", "map": 11, "link": None},
-    {"region": "North Ossetia-Alania", "type": "Republic", "map": 13, "link": None},
-    {"region": "Novgorod", "type": "Oblast", "map": 12, "link": None},
-    {"region": "Orel", "type": "Oblast", "map": 14, "link": None},
-    {"region": "Orenburg", "type": "Oblast", "map": None, "link": None},
-    {"region": "Penza", "type": "Oblast", "map": 15, "link": None},
-    {"region": "Perm", "type": "Kray", "map": None, "link": None},
-    {"region": "Pskov", "type": "Oblast", "map": None, "link": None},
-    {"region": "Rostov", "type": "Oblast", "map": None, "link": "Oblast_61O.htm"},
-    {"region": "Ryazan", "type": "Oblast", "map": 16, "link": None},
-    {"region": "Samara", "type": "Oblast", "map": 18, "link": None},
-    {"region": "Saratov", "type": "Oblast", "map": None, "link": None},
-    {"region": "Stavropol", "type": "Kray", "map": 2, "link": None},
-    {"region": "Sverdlovsk", "type": "Oblast", "map": 19, "link": None},
-    {"region": "Tambov", "type": "Oblast", "map": 20, "link": None},
-    {"region": "Tula", "type": "Oblast", "map": 21, "link": None},
-    {"region": "Tver", "type": "Oblast", "map": None, "link": None},
-    {"region": "Ulyanovsk", "type": "Oblast", "map": 23, "link": None},
-    {"region": "Vladimir", "type": "Oblast", "map": 24, "link": None},
-    {"region": "Volgograd", "type": "Oblast", "map": 25, "link": None},
-    {"region": "Vologda", "type": "Oblast", "map": 26, "link": None},
-    {"region": "Voronezh", "type": "Oblast", "map": None, "link": "Oblast_86O.htm"},
-    {"region": "Yaroslavl", "type": "Oblast", "map": 27, "link": None}
+    {"id": 1, "region": "Adygea", "type": "Republic", "map": 1, "link": None},
+    {"id": 2, "region": "Arkhangelsk", "type": "Oblast", "map": None, "link": None},
+    {"id": 3, "region": "Astrachan", "type": "Oblast", "map": None, "link": None},
+    {"id": 4, "region": "Belgorod", "type": "Oblast", "map": None, "link": None},
+    {"id": 5, "region": "Bryansk", "type": "Oblast", "map": None, "link": None},
+    {"id": 6, "region": "Chechnya", "type": "Republic", "map": None, "link": None},
+    {"id": 7, "region": "Chelyabinsk", "type": "Oblast", "map": 1, "link": None},
+    {"id": 8, "region": "Crimea", "type": "Republic", "map": None, "link": "Oblast_40O.htm"},
+    {"id": 9, "region": "Dagestan", "type": "Republic", "map": None, "link": None},
+    {"id": 10, "region": "Ingushetia", "type": "Republic", "map": None, "link": None},
+    {"id": 11, "region": "Ivanovo", "type": "Oblast", "map": 2, "link": None},
+    {"id": 12, "region": "Kabardino-Balkar", "type": "Republic", "map": 7, "link": None},
+    {"id": 13, "region": "Kaliningrad", "type": "Oblast", "map": None, "link": None},
+    {"id": 14, "region": "Kalmyk", "type": "Republic", "map": 8, "link": None},
+    {"id": 15, "region": "Kaluga", "type": "Oblast", "map": 3, "link": None},
+    {"id": 16, "region": "Karachay-Cherkess", "type": "Republic", "map": 9, "link": None},
+    {"id": 17, "region": "Karelia", "type": "Republic", "map": None, "link": None},
+    {"id": 18, "region": "Kemerovo", "type": "Oblast", "map": 5, "link": None},
+    {"id": 19, "region": "Komi", "type": "Republic", "map": None, "link": None},
+    {"id": 20, "region": "Kostroma", "type": "Oblast", "map": 6, "link": None},
+    {"id": 21, "region": "Krasnodar", "type": "Kray", "map": 1, "link": "Oblast_38O.htm"},
+    {"id": 22, "region": "Kursk", "type": "Oblast", "map": None, "link": None},
+    {"id": 23, "region": "Leningrad", "type": "Oblast", "map": None, "link": None},
+    {"id": 24, "region": "Lipetsk", "type": "Oblast", "map": 8, "link": None},
+    {"id": 25, "region": "Mari El", "type": "Republic", "map": 11, "link": None},
+    {"id": 26, "region": "Mordovia", "type": "Republic", "map": 12, "link": None},
+    {"id": 27, "region": "Moscow", "type": "Oblast", "map": 10, "link": None},
+    {"id": 28, "region": "Murmansk", "type": "Oblast", "map": None, "link": None},
+    {"id": 29, "region": "Nizhny Novgorod", "type": "Oblast", "map": 11, "link": None},
+    {"id": 30, "region": "North Ossetia-Alania", "type": "Republic", "map": 13, "link": None},
+    {"id": 31, "region": "Novgorod", "type": "Oblast", "map": 12, "link": None},
+    {"id": 32, "region": "Orel", "type": "Oblast", "map": 14, "link": None},
+    {"id": 33, "region": "Orenburg", "type": "Oblast", "map": None, "link": None},
+    {"id": 34, "region": "Penza", "type": "Oblast", "map": 15, "link": None},
+    {"id": 35, "region": "Perm", "type": "Kray", "map": None, "link": None},
+    {"id": 36, "region": "Pskov", "type": "Oblast", "map": None, "link": None},
+    {"id": 37, "region": "Rostov", "type": "Oblast", "map": None, "link": "Oblast_61O.htm"},
+    {"id": 38, "region": "Ryazan", "type": "Oblast", "map": 16, "link": None},
+    {"id": 39, "region": "Samara", "type": "Oblast", "map": 18, "link": None},
+    {"id": 40, "region": "Saratov", "type": "Oblast", "map": None, "link": None},
+    {"id": 41, "region": "Stavropol", "type": "Kray", "map": 2, "link": None},
+    {"id": 42, "region": "Sverdlovsk", "type": "Oblast", "map": 19, "link": None},
+    {"id": 43, "region": "Tambov", "type": "Oblast", "map": 20, "link": None},
+    {"id": 44, "region": "Tula", "type": "Oblast", "map": 21, "link": None},
+    {"id": 45, "region": "Tver", "type": "Oblast", "map": None, "link": None},
+    {"id": 46, "region": "Ulyanovsk", "type": "Oblast", "map": 23, "link": None},
+    {"id": 47, "region": "Vladimir", "type": "Oblast", "map": 24, "link": None},
+    {"id": 48, "region": "Volgograd", "type": "Oblast", "map": 25, "link": None},
+    {"id": 49, "region": "Vologda", "type": "Oblast", "map": 26, "link": None},
+    {"id": 50, "region": "Voronezh", "type": "Oblast", "map": None, "link": "Oblast_86O.htm"},
+    {"id": 51, "region": "Yaroslavl", "type": "Oblast", "map": 27, "link": None}
 ]
 
 def all_oblasts():
@@ -80,3 +80,29 @@ def get_fuzzy_oblast(user_input: Optional[str], threshold: float = 0.7) -> Optio
 
     return best_match if highest_ratio >= threshold else user_input
 
+def oblast_id(name: Optional[str]) -> Optional[int]:
+    """Returns the id of a canonical region name, or None."""
+    if not name:
+        return None
+
+    name = name.lower().strip()
+    for element in regions_data:
+        if element["region"].lower() == name:
+            return element["id"]
+    return None
+
+def canonical_oblast_id(raw: Optional[str]) -> Optional[int]:
+    """
+        Maps an oblast as written in the source tables ("Stavropol Krai",
+        "Archangelsk", ...) to the id of its canonical region: the longest
+        region name it contains, else the closest fuzzy match.
+    """
+    if not raw or not raw.strip():
+        return None
+
+    text = raw.lower()
+    contained = [e for e in regions_data if e["region"].lower() in text]
+    if contained:
+        return max(contained, key=lambda e: len(e["region"]))["id"]
+
+    return oblast_id(get_fuzzy_oblast(raw))
@@ -0,0 +1,498 @@
+import json
+import sqlite3
+import threading
+from typing import Optional
+import logging
+import os
+import sys
+
+from modules import ConnectionPool, GeoTools, Oblast
+
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+logging.basicConfig(
+    level=logging.INFO,
+    stream=sys.stdout,
+    format="%(asctime)s — %(levelname)s — %(name)s — %(message)s",
+)
+
+logger = logging.getLogger(__name__)
+
+FULLTEXT_PREFIX = "_fts_"
+# the trigram tokenizer only uses its index for substrings of 3+ characters
+FULLTEXT_MIN_LENGTH = 3
+
+def build_fulltext_index(conn: sqlite3.Connection) -> int:
+    """
+        Rebuilds one FTS5 table per asset table ("_fts_<table>") over its
+        text columns, with the trigram tokenizer so that LIKE '%x%'
+        substring filters can be answered from the index. The FTS tables
+        are external-content: they store the trigrams only and read the
+        rows from the asset table.
+
+        Returns:
+            Number of tables indexed
+    """
+    cursor = conn.cursor()
+
+    cursor.execute(
+        "SELECT name FROM sqlite_master WHERE type='table' AND sql LIKE 'CREATE VIRTUAL TABLE%' "
+        "AND name LIKE '\\_fts\\_%' ESCAPE '\\'"
+    )
+    for (name,) in cursor.fetchall():
+        cursor.execute(f'DROP TABLE "{name}"')
+
+    indexed = 0
+    for table in GeoTools.data_tables(cursor):
+        indexed += create_fulltext_index(cursor, table)
+
+    logger.info(f"Full-text index rebuilt for {indexed} tables")
+    return indexed
+
+def fulltext_columns(cursor: sqlite3.Cursor, table: str) -> list:
+    """Text columns of a table that go into its FTS table."""
+    cursor.execute(f"PRAGMA table_info(`{table}`)")
+    return [
+        col[1] for col in cursor.fetchall()
+        if col[2] == "TEXT" and col[1] != "coord_source" and col[1] not in GeoTools.HIDDEN_COLUMNS
+    ]
+
+def create_fulltext_index(cursor: sqlite3.Cursor, table: str) -> bool:
+    """(Re)creates and fills the FTS table of one asset table. Returns False when it has no text columns."""
+    fts = f"{FULLTEXT_PREFIX}{table}"
+    cursor.execute(f'DROP TABLE IF EXISTS "{fts}"')
+
+    columns = fulltext_columns(cursor, table)
+    if not columns:
+        return False
+
+    cursor.execute(
+        f'CREATE VIRTUAL TABLE "{fts}" USING fts5('
+        + ", ".join(f'"{c}"' for c in columns)
+        + f", content='{table}', content_rowid='rowid', tokenize='trigram')"
+    )
+    cursor.execute(f'INSERT INTO "{fts}" ("{fts}") VALUES (\'rebuild\')')
+    return True
+
+def update_fulltext_index(conn: sqlite3.Connection, changes) -> int:
+    """
+        Updates the FTS tables for the rows of an Ingest.ChangeSet only:
+        the old values of updated and deleted rows are removed with the
+        FTS5 'delete' command, then the inserted and updated rows are
+        indexed again. A table that was recreated, or whose FTS table is
+        missing or has other columns, gets its FTS table rebuilt.
+
+        Returns:
+            Number of tables updated
+    """
+    cursor = conn.cursor()
+
+    for table in changes.tables():
+        fts = f"{FULLTEXT_PREFIX}{table}"
+        columns = fulltext_columns(cursor, table)
+        cursor.execute(f'PRAGMA table_info("{fts}")')
+        if table in changes.reloaded or [col[1] for col in cursor.fetchall()] != columns:
+            create_fulltext_index(cursor, table)
+            continue
+
+        if not columns:
+            continue
+
+        names = ", ".join(f'"{c}"' for c in columns)
+        cursor.executemany(
+            f'INSERT INTO "{fts}" ("{fts}", rowid, {names}) VALUES (\'delete\', ?, {", ".join("?" for _ in columns)})',
+            [[rowid] + [row[c] for c in columns] for rowid, row in changes.old_rows.get(table, {}).items()]
+        )
+        cursor.execute(
+            f'INSERT INTO "{fts}" (rowid, {names}) SELECT rowid, {names} FROM `{table}` '
+            f'WHERE rowid IN (SELECT value FROM json_each(?))',
+            (json.dumps(changes.rowids(table, "inserted", "updated")),)
+        )
+
+    logger.info(f"Full-text index updated for {len(changes.tables())} tables")
+    return len(changes.tables())
+
+def build_filter_columns(conn: sqlite3.Connection, changes=None) -> int:
+    """
+        Adds the normalized filter columns to every asset table and
+        indexes them: country_code and service_code (trimmed, upper-case)
+        and oblast_id, the id of the canonical region in Oblast. Filters
+        on them become indexed equality lookups instead of UPPER() or
+        LIKE scans. Only rows whose normalized value changed are written.
+
+        With changes (an Ingest.ChangeSet) only its inserted and updated
+        rows are normalized.
+
+        Returns:
+            Number of indexes created
+    """
+    cursor = conn.cursor()
+    created = 0
+
+    for table in GeoTools.data_tables(cursor) if changes is None else changes.tables():
+        cursor.execute(f"PRAGMA table_info(`{table}`)")
+        columns = [col[1] for col in cursor.fetchall()]
+
+        scope, scope_params = "", {}
+        if changes is not None:
+            scope = " AND rowid IN (SELECT value FROM json_each(:rowids))"
+            scope_params = {"rowids": json.dumps(changes.rowids(table, "inserted", "updated"))}
+
+        for source in ("country", "service"):
+            if source not in columns:
+                continue
+            code = f"{source}_code"
+            if code not in columns:
+                cursor.execute(f"ALTER TABLE `{table}` ADD COLUMN `{code}` TEXT")
+            cursor.execute(
+                f"UPDATE `{table}` SET `{code}` = UPPER(TRIM(`{source}`)) "
+                f"WHERE `{code}` IS NOT UPPER(TRIM(`{source}`)){scope}",
+                scope_params
+            )
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS `_{table}_{code}` ON `{table}` (`{code}`)")
+            created += 1
+
+        if "oblast" in columns:
+            if "oblast_id" not in columns:
+                cursor.execute(f"ALTER TABLE `{table}` ADD COLUMN oblast_id INTEGER")
+            cursor.execute(f"SELECT DISTINCT oblast FROM `{table}` WHERE oblast IS NOT NULL{scope}", scope_params)
+            cursor.executemany(
+                f"UPDATE `{table}` SET oblast_id = :id WHERE oblast = :raw AND oblast_id IS NOT :id{scope}",
+                [{"id": Oblast.canonical_oblast_id(raw), "raw": raw, **scope_params} for (raw,) in cursor.fetchall()]
+            )
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS `_{table}_oblast_id` ON `{table}` (oblast_id)")
+            created += 1
+
+    logger.info(f"Filter columns normalized with {created} indexes")
+    return created
+
+def upper_key(value: str) -> str:
+    return value.strip().upper()
+
+class Filter:
+    """
+        Describes how one query argument filters one column.
+
+        match is one of:
+            "exact"   - column = value
+            "partial" - column LIKE %value% (substring, case-insensitive)
+            "enum"    - value must be one of values, then exact match
+
+        With upper=True the comparison is case-insensitive (both sides
+        upper-cased). message is the ValueError raised for an enum value
+        outside values; it may use {value}.
+
+        key_column names a normalized, indexed column written at ingest
+        and key maps a value to it. When the table has key_column and key
+        returns something other than None, the filter becomes an equality
+        lookup on key_column instead.
+    """
+
+    MATCHES = ("exact", "partial", "enum")
+
+    def __init__(
+        self,
+        name: str,
+        match: str = "partial",
+        column: Optional[str] = None,
+        values: Optional[list] = None,
+        upper: bool = False,
+        message: Optional[str] = None,
+        key_column: Optional[str] = None,
+        key=None
+    ):
+        if match not in self.MATCHES:
+            raise ValueError(f"Unknown match '{match}'. Must be one of: {', '.join(self.MATCHES)}")
+
+        self.name = name
+        self.match = match
+        self.column = column or name
+        self.values = values
+        self.upper = upper
+        self.message = message or f"Invalid {name} '{{value}}'. Must be one of: {', '.join(values or [])}"
+        self.key_column = key_column
+        self.key = key or upper_key
+
+    def validate(self, value: str):
+        if self.match != "enum":
+            return
+        candidate = value.upper() if self.upper else value
+        if candidate not in self.values:
+            raise ValueError(self.message.format(value=value))
+
+    def condition(self) -> str:
+        if self.match == "partial":
+            return f"`{self.column}` LIKE ?"
+        if self.upper:
+            return f"UPPER(`{self.column}`) = ?"
+        return f"`{self.column}` = ?"
+
+    def param(self, value: str) -> str:
+        if self.match == "partial":
+            return f"%{value}%"
+        return value.upper() if self.upper else value
+
+class QueryEngine:
+    """
+        Compiles filter sets into parameterized SELECT statements over the
+        tables of one database, from the Filter descriptors of its
+        explorer. A statement is built once per (table, active filters,
+        limit or not) and reused from then on; values are always bound
+        as parameters, including the limit.
+
+        Filters with a key_column become equality lookups on the indexed,
+        normalized column ingest wrote for them; the columns themselves
+        are never returned.
+
+        Partial filters go through the table's FTS5 trigram index when
+        ingest built one and the value is long enough to use it, and fall
+        back to a LIKE scan otherwise.
+
+        search() runs the same filters over several tables as one UNION
+        ALL statement, tagging every row with its source_table.
+    """
+
+    def __init__(self, db_path: str, tables: list, filters: list):
+        self.db_path = db_path
+        self.tables = list(tables)
+        self.filters = {f.name: f for f in filters}
+
+        self.statements = {}
+        self.schemas = {}
+        self.schema_signature = None
+        self.lock = threading.Lock()
+
+    def schema(self, conn: sqlite3.Connection, table_name: str) -> tuple:
+        """
+            Returns (columns, fulltext columns) of table_name, read once
+            and again whenever the database file changes. columns is empty
+            when the table does not exist.
+        """
+        try:
+            stat = os.stat(self.db_path)
+            signature = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            signature = None
+
+        with self.lock:
+            if signature != self.schema_signature:
+                self.schemas = {}
+                self.schema_signature = signature
+            schema = self.schemas.get(table_name)
+
+        if schema is None:
+            columns = tuple(row[1] for row in conn.execute(f"PRAGMA table_info(`{table_name}`)"))
+            fulltext = {row[1] for row in conn.execute(f'PRAGMA table_info("{FULLTEXT_PREFIX}{table_name}")')}
+            schema = (columns, fulltext)
+            with self.lock:
+                self.schemas[table_name] = schema
+
+        return schema
+
+    def validate(self, params: dict) -> dict:
+        """
+            Drops unset arguments (None or empty) and checks the rest
+            against their descriptors.
+
+            Returns:
+                The active filters, in descriptor order
+        """
+        unknown = [name for name in params if name not in self.filters]
+        if unknown:
+            raise TypeError(f"Unknown filter(s): {', '.join(unknown)}")
+
+        active = {}
+        for name, f in self.filters.items():
+            value = params.get(name)
+            if value is None or value == "":
+                continue
+            f.validate(value)
+            active[name] = value
+        return active
+
+    def plan(self, columns: tuple, fulltext: set, active: dict) -> tuple:
+        """
+            Splits the active filters of one table into (keyed, names,
+            indexed): the ones answered by an equality lookup on their
+            normalized column, the ones the table answers itself and the
+            partial ones its FTS index answers.
+        """
+        keyed, names, indexed = [], [], []
+        for name, value in active.items():
+            f = self.filters[name]
+            if f.key_column in columns and f.key(value) is not None:
+                keyed.append(name)
+            elif f.match == "partial" and f.column in fulltext and len(value) >= FULLTEXT_MIN_LENGTH:
+                indexed.append(name)
+            else:
+                names.append(name)
+        return tuple(keyed), tuple(names), tuple(indexed)
+
+    def values(self, plan: tuple, active: dict) -> list:
+        """Parameters of a plan, in the order of its conditions."""
+        keyed, names, indexed = plan
+        return (
+            [self.filters[name].key(active[name]) for name in keyed]
+            + [self.filters[name].param(active[name]) for name in names + indexed]
+        )
+
+    def where(self, table_name: str, plan: tuple) -> str:
+        keyed, names, indexed = plan
+        conditions = [f"`{self.filters[n].key_column}` = ?" for n in keyed]
+        conditions.extend(self.filters[n].condition() for n in names)
+        if indexed:
+            fts = f"{FULLTEXT_PREFIX}{table_name}"
+            conditions.append(
+                f'rowid IN (SELECT rowid FROM "{fts}" WHERE '
+                + " AND ".join(f'"{self.filters[n].column}" LIKE ?' for n in indexed)
+                + ")"
+            )
+        return " WHERE " + " AND ".join(conditions) if conditions else ""
+
+    def compile(self, table_name: str, columns: tuple, plan: tuple, limited: bool) -> str:
+        """
+            Builds the statement for a filter set on one table, selecting
+            the columns that are returned to the user.
+        """
+        key = (table_name, columns, plan, limited)
+
+        with self.lock:
+            statement = self.statements.get(key)
+            if statement is None:
+                fields = ", ".join(f"`{c}`" for c in columns if c not in GeoTools.HIDDEN_COLUMNS) or "*"
+                statement = f"SELECT {fields} FROM `{table_name}`" + self.where(table_name, plan)
+                if limited:
+                    statement += " LIMIT ?"
+                self.statements[key] = statement
+
+        return statement
+
+    def compile_union(self, arms: tuple, columns: tuple, order: Optional[str], limited: bool) -> str:
+        """
+            Builds one UNION ALL statement over several tables. arms holds
+            (table, columns, plan) for each table; a column a table lacks
+            is selected as NULL.
+        """
+        key = ("UNION", arms, columns, order, limited)
+
+        with self.lock:
+            statement = self.statements.get(key)
+            if statement is None:
+                selects = []
+                for table_name, table_columns, plan in arms:
+                    fields = [f"`{c}`" if c in table_columns else f"NULL AS `{c}`" for c in columns]
+                    fields.append(f"'{table_name}' AS source_table")
+                    selects.append(
+                        f"SELECT {', '.join(fields)} FROM `{table_name}`" + self.where(table_name, plan)
+                    )
+
+                statement = " UNION ALL ".join(selects)
+                if order:
+                    column, descending = order.lstrip("-"), order.startswith("-")
+                    statement += f" ORDER BY `{column}`" + (" DESC" if descending else "")
+                if limited:
+                    statement += " LIMIT ?"
+                self.statements[key] = statement
+
+        return statement
+
+    def execute(self, conn: sqlite3.Connection, statement: str, values: list) -> list:
+        logger.info("Query: " + statement)
+        logger.info("Params: " + ",".join(map(str, values)))
+
+        cursor = conn.execute(statement, values)
+        columns = [description[0] for description in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def query(self, table_name: str, limit: Optional[int] = None, **params) -> list | dict:
+        """
+            Runs a filtered search on one table.
+
+            Returns:
+                List with the rows found, as dictionaries. Raises
+                ValueError on an invalid enum value; database errors are
+                logged and returned as {"error": ...}.
+        """
+        active = self.validate(params)
+
+        if table_name not in self.tables:
+            logger.info(f"Error querying database: unknown table {table_name}")
+            return []
+
+        try:
+            with ConnectionPool.connection(self.db_path) as conn:
+                columns, fulltext = self.schema(conn, table_name)
+                plan = self.plan(columns, fulltext, active)
+
+                statement = self.compile(table_name, columns, plan, limit is not None)
+                values = self.values(plan, active)
+                if limit is not None:
+                    values.append(int(limit))
+
+                return self.execute(conn, statement, values)
+
+        except sqlite3.Error as e:
+            logger.info(f"Error querying database: {e}")
+            return {"error": f"Error querying database: {e}"}
+
+    def search(
+        self,
+        tables: Optional[list] = None,
+        limit: Optional[int] = None,
+        order_by: Optional[str] = None,
+        **params
+    ) -> list | dict:
+        """
+            Runs the same filters over several tables (all of them by
+            default) in one UNION ALL statement. limit caps the total
+            number of rows, order_by sorts them by a column, descending
+            with a "-" prefix. Tables missing from the database are
+            skipped.
+
+            Returns:
+                List with the rows found, each with its source_table, or
+                {"error": ...} on a database error
+        """
+        active = self.validate(params)
+        tables = self.tables if tables is None else tables
+
+        unknown = [t for t in tables if t not in self.tables]
+        if unknown:
+            raise ValueError(f"Unknown table(s): {', '.join(unknown)}")
+
+        try:
+            with ConnectionPool.connection(self.db_path) as conn:
+                arms, columns, values = [], [], []
+
+                for table_name in tables:
+                    table_columns, fulltext = self.schema(conn, table_name)
+                    if not table_columns:
+                        logger.info(f"Skipping {table_name}: not in the database")
+                        continue
+
+                    plan = self.plan(table_columns, fulltext, active)
+                    arms.append((table_name, table_columns, plan))
+                    columns.extend(
+                        c for c in table_columns if c not in columns and c not in GeoTools.HIDDEN_COLUMNS
+                    )
+                    values.extend(self.values(plan, active))
+
+                if not arms:
+                    return []
+
+                if order_by is not None and order_by.lstrip("-") not in columns + ["source_table"]:
+                    raise ValueError(
+                        f"Invalid order_by '{order_by}'. Must be one of: {', '.join(columns + ['source_table'])}"
+                    )
+
+                statement = self.compile_union(tuple(arms), tuple(columns), order_by, limit is not None)
+                if limit is not None:
+                    values.append(int(limit))
+
+                return self.execute(conn, statement, values)
+
+        except sqlite3.Error as e:
+            logger.info(f"Error querying database: {e}")
+            return {"error": f"Error querying database: {e}"}
+
+# eof
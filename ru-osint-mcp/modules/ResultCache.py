@@ -0,0 +1,179 @@
+import json
+import inspect
+import threading
+import functools
+from collections import OrderedDict
+import logging
+import os
+import sys
+
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+logging.basicConfig(
+    level=logging.INFO,
+    stream=sys.stdout,
+    format="%(asctime)s — %(levelname)s — %(name)s — %(message)s",
+)
+
+logger = logging.getLogger(__name__)
+
+def load_settings() -> dict:
+
+    with open("../config/settings.json","r",encoding="utf-8") as settings_file:
+        settings = json.loads(settings_file.read())
+        settings_file.close()
+
+    return settings["result_cache"]
+
+_generation = 0
+_generation_lock = threading.Lock()
+
+def generation() -> int:
+    """Current data generation; every database rewrite bumps it."""
+    return _generation
+
+def bump() -> int:
+    """
+        Starts a new data generation. Every result cached under an older
+        one stops being served from then on.
+    """
+    global _generation
+
+    with _generation_lock:
+        _generation += 1
+        current = _generation
+
+    logger.info(f"Result cache generation bumped to {current}")
+    return current
+
+def result_size(value) -> int:
+    """Approximate memory footprint of a result: the size of its JSON."""
+    try:
+        return len(json.dumps(value, ensure_ascii=False, default=str))
+    except (TypeError, ValueError):
+        return sys.getsizeof(value)
+
+class LRUCache:
+    """
+        Least-recently-used cache of tool results, bounded by the total
+        approximate size of its entries (max_bytes) and by their number
+        (max_entries). Entries carry the data generation they were
+        computed under and are dropped when read in a later one.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, max_entries: int = 4096):
+        self.max_bytes = int(max_bytes)
+        self.max_entries = int(max_entries)
+
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: str, current: int):
+        """Returns (True, value) for a fresh entry, else (False, None)."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                entry_generation, size, value = entry
+                if entry_generation == current:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self.entries[key]
+                self.size -= size
+            self.misses += 1
+        return False, None
+
+    def put(self, key: str, current: int, value):
+        size = result_size(value)
+        if size > self.max_bytes:
+            return
+
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= previous[1]
+
+            self.entries[key] = (current, size, value)
+            self.size += size
+
+            while self.entries and (self.size > self.max_bytes or len(self.entries) > self.max_entries):
+                _, (_, evicted, _) = self.entries.popitem(last=False)
+                self.size -= evicted
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "generation": _generation
+            }
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache() -> LRUCache:
+    """Returns the process-wide cache, creating it on first use."""
+    global _cache
+
+    with _cache_lock:
+        if _cache is None:
+            settings = load_settings()
+            _cache = LRUCache(settings["max_bytes"], settings["max_entries"])
+
+    return _cache
+
+def cache_key(name: str, signature: inspect.Signature, args: tuple, kwargs: dict) -> str:
+    """
+        Normalizes a call into a key: the tool name and every argument
+        bound by name with its defaults applied, so positional, keyword
+        and omitted-default spellings of one call share an entry.
+    """
+    bound = signature.bind(*args, **kwargs)
+    bound.apply_defaults()
+    return json.dumps([name.lower(), bound.arguments], sort_keys=True, ensure_ascii=False, default=str)
+
+def is_error(value) -> bool:
+    return isinstance(value, dict) and "error" in value
+
+def cached(func):
+    """
+        Caches the results of a tool in the shared LRU cache until the
+        next data generation. Returned values are shared between callers
+        and must not be mutated. Error results ({"error": ...}) are not
+        cached, so a transient failure such as the geocoder being down is
+        retried on the next call.
+    """
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        cache = get_cache()
+        current = generation()
+
+        try:
+            key = cache_key(func.__name__, signature, args, kwargs)
+        except TypeError:
+            return func(*args, **kwargs)
+
+        hit, value = cache.get(key, current)
+        if hit:
+            return value
+
+        value = func(*args, **kwargs)
+        if not is_error(value):
+            cache.put(key, current, value)
+        return value
+
+    return wrapper
+
+# eof
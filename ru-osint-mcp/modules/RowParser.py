@@ -0,0 +1,319 @@
+import io
+import re
+import copy
+import json
+import bisect
+import multiprocessing
+from collections import namedtuple
+from collections.abc import Sequence
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator
+import logging
+import os
+import sys
+
+from bs4 import BeautifulSoup
+from lxml import etree
+
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+logging.basicConfig(
+    level=logging.INFO,
+    stream=sys.stdout,
+    format="%(asctime)s — %(levelname)s — %(name)s — %(message)s",
+)
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("bs4", "lxml")
+
+# Elements whose strings BeautifulSoup's get_text() leaves out
+SKIPPED_TEXT = {"script", "style", "template"}
+
+Cell = namedtuple("Cell", ["text", "href", "raw"])
+Cell.__doc__ = """
+    One <td> of a row:
+        text - its strings, each stripped, joined (get_text(strip=True))
+        href - href of its first <a>, None when missing or empty
+        raw  - its strings joined as they are (get_text())
+"""
+
+def load_settings() -> dict:
+
+    with open("../config/settings.json","r",encoding="utf-8") as settings_file:
+        settings = json.loads(settings_file.read())
+        settings_file.close()
+
+    return settings["parsing"]
+
+def backend_for(source: str) -> str:
+    """Backend configured for a source (the keys of config/url.json)."""
+    return load_settings()["backends"].get(source, "lxml")
+
+class SoupCell:
+    """Cell read lazily from a BeautifulSoup <td>, as the parsers used to."""
+
+    __slots__ = ("td",)
+
+    def __init__(self, td):
+        self.td = td
+
+    @property
+    def text(self) -> str:
+        return self.td.get_text(strip=True)
+
+    @property
+    def href(self):
+        anchor = self.td.find('a')
+        return anchor.get('href') if anchor and anchor.get('href') else None
+
+    @property
+    def raw(self) -> str:
+        return self.td.get_text()
+
+def soup_rows(content: str) -> Iterator[list]:
+    """
+        Rows of the whole-tree html.parser backend. Rows left open are
+        nested by html.parser, so a row also lists the cells of the rows
+        nested in it, after its own.
+    """
+    soup = BeautifulSoup(content, 'html.parser')
+    for row in soup.find_all('tr'):
+        yield [SoupCell(td) for td in row.find_all('td')]
+
+def _strings(element) -> Iterator[str]:
+    if not isinstance(element.tag, str) or element.tag in SKIPPED_TEXT:
+        return
+    if element.text:
+        yield element.text
+    for child in element:
+        yield from _strings(child)
+        if child.tail:
+            yield child.tail
+
+def _cell(td) -> Cell:
+    pieces = list(_strings(td))
+    anchor = next(td.iter('a'), None)
+    href = anchor.get('href') if anchor is not None else None
+    return Cell(
+        "".join(piece.strip() for piece in pieces),
+        href or None,
+        "".join(pieces)
+    )
+
+# Tags that open or close rows for html.parser, and cell starts; comments
+# and script/style bodies are matched only so that the tags inside them are
+# ignored.
+ROW_TAGS = re.compile(
+    r'<!--.*?-->|<(script|style)\b.*?</\1\s*>'
+    r'|<(/?)(tr|td|tbody|thead|tfoot|table)\b[^>]*?(/?)>',
+    re.IGNORECASE | re.DOTALL
+)
+
+def row_extents(content: str) -> tuple:
+    """
+        Row structure of content as html.parser sees it.
+
+        html.parser never closes a row implicitly: a row stays open until
+        a </tr> (closing the most recent open row), the end tag of an
+        enclosing tbody/thead/tfoot/table, or the end of the document,
+        and BeautifulSoup lists the cells of every row started meanwhile
+        as its own.
+
+        Returns:
+            (extents, widths): for the i-th <tr>, the index of the last
+            <tr> nested in it, and the number of <td> it holds directly
+    """
+    extents = []
+    widths = []
+    stack = []
+
+    for match in ROW_TAGS.finditer(content):
+        name = match.group(3)
+        if name is None:
+            continue
+        name = name.lower()
+
+        if name == "td":
+            if match.group(2) != "/":
+                row = next((row for open_name, row in reversed(stack) if open_name == "tr"), None)
+                if row is not None:
+                    widths[row] += 1
+            continue
+
+        if match.group(2) != "/":
+            if name == "tr":
+                extents.append(None)
+                widths.append(0)
+                stack.append(("tr", len(extents) - 1))
+            else:
+                stack.append((name, None))
+            if match.group(4) != "/":
+                continue
+
+        if not any(open_name == name for open_name, _ in stack):
+            continue
+        while stack:
+            open_name, row = stack.pop()
+            if row is not None:
+                extents[row] = len(extents) - 1
+            if open_name == name:
+                break
+
+    last = len(extents) - 1
+    return [last if extent is None else extent for extent in extents], widths
+
+class RowView(Sequence):
+    """
+        Cells of rows[first..last] seen as one row, without copying them:
+        the cells html.parser attributes to a row left open.
+    """
+
+    __slots__ = ("rows", "offsets", "first", "last")
+
+    def __init__(self, rows: list, offsets: list, first: int, last: int):
+        self.rows = rows
+        self.offsets = offsets
+        self.first = first
+        self.last = last
+
+    def __len__(self) -> int:
+        return self.offsets[self.last + 1] - self.offsets[self.first]
+
+    def __getitem__(self, index: int):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("row index out of range")
+        position = self.offsets[self.first] + index
+        row = bisect.bisect_right(self.offsets, position, self.first, self.last + 1) - 1
+        return self.rows[row][position - self.offsets[row]]
+
+def lxml_cells(content: str) -> list:
+    """
+        Cells of every <tr>, each row holding its own cells only, in the
+        order the rows start. Rows are read with iterparse as libxml2
+        closes them and cleared right after, so the tree is never built.
+    """
+    cells = []
+    open_rows = []
+
+    for event, element in etree.iterparse(
+        io.BytesIO(content.encode("utf-8")),
+        events=("start", "end"),
+        tag="tr",
+        html=True,
+        encoding="utf-8"
+    ):
+        if event == "start":
+            open_rows.append(len(cells))
+            cells.append(None)
+            continue
+
+        cells[open_rows.pop()] = [_cell(td) for td in element.iter('td') if not _in_nested_row(td, element)]
+        if open_rows:
+            continue
+
+        element.clear(keep_tail=True)
+        parent = element.getparent()
+        while parent is not None and element.getprevious() is not None:
+            del parent[0]
+
+    return cells
+
+def _in_nested_row(td, row) -> bool:
+    parent = td.getparent()
+    while parent is not None and parent is not row:
+        if parent.tag == "tr":
+            return True
+        parent = parent.getparent()
+    return False
+
+def lxml_rows(content: str) -> Iterator[list]:
+    """
+        Rows of the streaming lxml backend, with the same cells as the
+        html.parser backend: a row also gets the cells of the rows
+        html.parser would nest in it (see row_extents). Falls back to
+        html.parser when libxml2 placed the cells differently (stray
+        rows or cells outside a row).
+    """
+    cells = lxml_cells(content)
+    extents, widths = row_extents(content)
+
+    if widths != [len(row) for row in cells]:
+        logger.info("Row structure not recoverable with lxml, using html.parser")
+        yield from soup_rows(content)
+        return
+
+    offsets = [0]
+    for row in cells:
+        offsets.append(offsets[-1] + len(row))
+
+    for first, last in enumerate(extents):
+        yield RowView(cells, offsets, first, last)
+
+def rows(content: str, backend: str = "lxml") -> Iterator[list]:
+    """
+        Yields the <td> cells of every <tr> of an HTML table file as
+        Cell-like objects (text, href, raw), whatever the backend.
+    """
+    if backend == "lxml":
+        return lxml_rows(content)
+    if backend == "bs4":
+        return soup_rows(content)
+    raise ValueError(f"Unknown parser backend '{backend}'. Must be one of: {', '.join(BACKENDS)}")
+
+def process_pool(tasks: int, size: int):
+    """
+        Process pool for a batch of tasks table files holding size
+        characters, or None when the batch should stay in the calling
+        process: one core, or too little input (min_bytes) to pay for
+        starting the workers.
+    """
+    settings = load_settings()
+    workers = min(settings["processes"] or os.cpu_count() or 1, tasks)
+
+    if workers <= 1 or size < settings["min_bytes"]:
+        return None
+
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context(settings["start_method"])
+    )
+
+def _parse_table(parser, table_name: str) -> list:
+    return parser.parse_table(table_name)
+
+def parse_all(parsers: list) -> None:
+    """
+        Parses the table files of several parsers at once, one process
+        per core and one task per file, and leaves the rows in the
+        parsed dict of each parser; its push_to_database() then only
+        writes them. Each task carries a copy of its parser holding just
+        its own file.
+
+        A file whose task failed is left out, and its parser parses it
+        in-process as before.
+    """
+    tasks = [(parser, name) for parser in parsers for name in parser.files]
+    size = sum(len(parser.contents[name]) for parser, name in tasks)
+
+    pool = process_pool(len(tasks), size)
+    if pool is None:
+        return
+
+    with pool:
+        futures = []
+        for parser, name in tasks:
+            job = copy.copy(parser)
+            job.contents = {name: parser.contents[name]}
+            job.parsed = {}
+            futures.append((parser, name, pool.submit(_parse_table, job, name)))
+
+        for parser, name, future in futures:
+            try:
+                parser.parsed[name] = future.result()
+            except Exception as e:
+                logger.info(f"Parsing {name} in a worker failed, parsing it in-process: {e}")
+
+# eof
@@ -0,0 +1,150 @@
+import json
+import random
+import threading
+import traceback
+from datetime import datetime, timedelta
+import logging
+import os
+import sys
+
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+logging.basicConfig(
+    level=logging.INFO,
+    stream=sys.stdout,
+    format="%(asctime)s — %(levelname)s — %(name)s — %(message)s",
+)
+
+logger = logging.getLogger(__name__)
+
+def load_settings() -> dict:
+
+    with open("../config/settings.json","r",encoding="utf-8") as settings_file:
+        settings = json.loads(settings_file.read())
+        settings_file.close()
+
+    return settings["refresh"]
+
+class RefreshScheduler:
+    """
+        Runs a refresh job on a daemon thread while the server keeps
+        serving the SQLite files already on disk.
+
+        The first run starts initial_delay seconds after start(), then
+        every interval seconds, each delay moved by a random offset of up
+        to jitter seconds so that several servers sharing one source do
+        not all fetch at the same moment. Runs never overlap, and a
+        failed run is logged and retried at the next slot.
+    """
+
+    def __init__(
+        self,
+        job,
+        interval: float,
+        jitter: float = 0,
+        initial_delay: float = 0,
+        enabled: bool = True
+    ):
+        self.job = job
+        self.enabled = enabled
+        self.interval = float(interval)
+        self.jitter = float(jitter)
+        self.initial_delay = float(initial_delay)
+
+        self.thread = None
+        self.stopped = threading.Event()
+        self.wakeup = threading.Event()
+        self.running = threading.Lock()
+
+        self.runs = 0
+        self.failures = 0
+        self.next_run = None
+        self.last_started = None
+        self.last_finished = None
+        self.last_duration = None
+        self.last_error = None
+
+    def delay(self, base: float) -> float:
+        return max(0.0, base + random.uniform(-self.jitter, self.jitter))
+
+    def start(self):
+        if not self.enabled:
+            logger.info("Refresh scheduler disabled; serving the existing databases only")
+            return
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.loop, name="rusmil-refresh", daemon=True)
+        self.thread.start()
+        logger.info(f"Refresh scheduler started (every {self.interval:.0f}s ± {self.jitter:.0f}s)")
+
+    def stop(self):
+        self.stopped.set()
+        self.wakeup.set()
+
+    def loop(self):
+        wait = self.delay(self.initial_delay)
+
+        while not self.stopped.is_set():
+            self.next_run = datetime.now() + timedelta(seconds=wait)
+            self.wakeup.wait(wait)
+            self.wakeup.clear()
+            if self.stopped.is_set():
+                break
+
+            self.run_once()
+            wait = self.delay(self.interval)
+
+        self.next_run = None
+
+    def run_once(self) -> bool:
+        """Runs the job now unless a run is already in progress."""
+        if not self.running.acquire(blocking=False):
+            return False
+
+        try:
+            self.last_started = datetime.now()
+            self.job()
+            self.last_error = None
+        except Exception as e:
+            self.failures += 1
+            self.last_error = f"{type(e).__name__}: {e}"
+            logger.info(f"Refresh failed: {self.last_error}\n{traceback.format_exc()}")
+        finally:
+            self.last_finished = datetime.now()
+            self.last_duration = (self.last_finished - self.last_started).total_seconds()
+            self.runs += 1
+            self.running.release()
+
+        return True
+
+    def status(self) -> dict:
+        def stamp(moment):
+            return moment.strftime("%Y-%m-%d %H:%M:%S") if moment else None
+
+        return {
+            "enabled": self.enabled,
+            "running": self.running.locked(),
+            "scheduled": self.thread is not None and self.thread.is_alive(),
+            "interval_seconds": self.interval,
+            "jitter_seconds": self.jitter,
+            "next_run": stamp(self.next_run),
+            "last_started": stamp(self.last_started),
+            "last_finished": stamp(self.last_finished),
+            "last_duration_seconds": self.last_duration,
+            "last_error": self.last_error,
+            "runs": self.runs,
+            "failures": self.failures
+        }
+
+def from_settings(job) -> RefreshScheduler:
+    settings = load_settings()
+    return RefreshScheduler(
+        job,
+        interval=settings["interval_hours"] * 3600,
+        jitter=settings["jitter_minutes"] * 60,
+        initial_delay=settings["initial_delay_seconds"],
+        enabled=settings["enabled"]
+    )
+
+# eof
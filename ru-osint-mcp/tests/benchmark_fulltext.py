@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""Benchmark substring filters: leading-wildcard LIKE scan vs the FTS5 trigram index."""
+
+import os
+import random
+import sqlite3
+import string
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from modules import QueryEngine
+
+ROW_COUNTS = [1_000, 10_000, 50_000, 200_000]
+QUERIES = 50
+FILTERS = [QueryEngine.Filter("location"), QueryEngine.Filter("main_user")]
+
+def word() -> str:
+    return "".join(random.choices(string.ascii_lowercase, k=random.randint(4, 10)))
+
+def build_database(path: str, rows: int):
+    """Create a synthetic asset table with free-text columns and index it."""
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE assets (location TEXT, main_user TEXT)")
+    conn.executemany(
+        "INSERT INTO assets VALUES (?, ?)",
+        ((word().title(), " ".join(word() for _ in range(4))) for _ in range(rows))
+    )
+    QueryEngine.build_fulltext_index(conn)
+    conn.commit()
+    conn.close()
+
+def like_scan(path: str, needle: str) -> int:
+    """The pre-index approach: a LIKE '%x%' scan over every row."""
+    conn = sqlite3.connect(path)
+    try:
+        return len(conn.execute("SELECT * FROM assets WHERE main_user LIKE ?", (f"%{needle}%",)).fetchall())
+    finally:
+        conn.close()
+
+def timed(fn, needles) -> float:
+    start = time.perf_counter()
+    for needle in needles:
+        fn(needle)
+    return (time.perf_counter() - start) / len(needles) * 1000
+
+if __name__ == "__main__":
+
+    random.seed(42)
+    needles = [word()[:5] for _ in range(QUERIES)]
+
+    print(f"{'rows':>10} {'like scan (ms)':>16} {'fts5 (ms)':>11} {'speedup':>9}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in ROW_COUNTS:
+            path = os.path.join(tmp, f"bench-{rows}.sqlite")
+            build_database(path, rows)
+            engine = QueryEngine.QueryEngine(path, ["assets"], FILTERS)
+
+            def fts_query(needle: str) -> int:
+                return len(engine.query("assets", main_user=needle))
+
+            for needle in needles[:3]:
+                assert like_scan(path, needle) == fts_query(needle)
+
+            scan_ms = timed(lambda n: like_scan(path, n), needles)
+            fts_ms = timed(fts_query, needles)
+            print(f"{rows:>10} {scan_ms:>16.2f} {fts_ms:>11.2f} {scan_ms / fts_ms:>8.1f}x")
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""Benchmark near_assets radius searches: full table scan vs R*Tree prefilter."""
+
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from modules import GeoTools
+
+ROW_COUNTS = [1_000, 10_000, 50_000, 200_000]
+QUERIES = 50
+RADIUS_KM = 150
+
+def build_database(path: str, rows: int) -> sqlite3.Connection:
+    """Create a synthetic asset table spread over European Russia and index it."""
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE assets (location TEXT, image TEXT, lat REAL, lon REAL, coord_source TEXT)")
+    conn.executemany(
+        "INSERT INTO assets VALUES (?, ?, ?, ?, 'image')",
+        (
+            (f"site-{i}", None, random.uniform(43.0, 70.0), random.uniform(20.0, 60.0))
+            for i in range(rows)
+        )
+    )
+    GeoTools.build_spatial_index(conn)
+    conn.commit()
+    return conn
+
+def full_scan(conn: sqlite3.Connection, origin: tuple, radius_km: float) -> int:
+    """The pre-index approach: read every row and check its distance in Python."""
+    found = 0
+    for lat, lon in conn.execute("SELECT lat, lon FROM assets"):
+        if GeoTools.distance(origin, (lat, lon)) <= radius_km:
+            found += 1
+    return found
+
+def rtree_scan(conn: sqlite3.Connection, origin: tuple, radius_km: float) -> int:
+    return sum(len(rows) for rows in GeoTools.query_radius(conn, origin, radius_km).values())
+
+def timed(fn, conn, origins) -> float:
+    start = time.perf_counter()
+    for origin in origins:
+        fn(conn, origin, RADIUS_KM)
+    return (time.perf_counter() - start) / len(origins) * 1000
+
+if __name__ == "__main__":
+
+    random.seed(42)
+    origins = [(random.uniform(45.0, 65.0), random.uniform(25.0, 55.0)) for _ in range(QUERIES)]
+
+    print(f"{'rows':>10} {'full scan (ms)':>16} {'r*tree (ms)':>14} {'speedup':>9}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in ROW_COUNTS:
+            conn = build_database(os.path.join(tmp, f"bench-{rows}.sqlite"), rows)
+
+            for origin in origins[:3]:
+                assert full_scan(conn, origin, RADIUS_KM) == rtree_scan(conn, origin, RADIUS_KM)
+
+            scan_ms = timed(full_scan, conn, origins)
+            rtree_ms = timed(rtree_scan, conn, origins)
+            print(f"{rows:>10} {scan_ms:>16.2f} {rtree_ms:>14.2f} {scan_ms / rtree_ms:>8.1f}x")
+
+            conn.close()
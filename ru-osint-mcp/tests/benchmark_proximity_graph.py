@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""Benchmark how long the ingest-time proximity graph takes to build as the databases grow."""
+
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from modules import GeoTools
+
+ROW_COUNTS = [1_000, 10_000, 50_000, 200_000]
+K = 5
+
+def build_database(path: str, rows: int) -> None:
+    """Create a synthetic asset table spread over European Russia and index it."""
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE assets (location TEXT, image TEXT, lat REAL, lon REAL, coord_source TEXT)")
+    conn.executemany(
+        "INSERT INTO assets VALUES (?, ?, ?, ?, 'image')",
+        (
+            (f"site-{i}", None, random.uniform(43.0, 70.0), random.uniform(20.0, 60.0))
+            for i in range(rows)
+        )
+    )
+    GeoTools.build_spatial_index(conn)
+    conn.commit()
+    conn.close()
+
+if __name__ == "__main__":
+
+    random.seed(42)
+
+    print(f"{'rows per db':>12} {'edges':>10} {'build (s)':>11}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in ROW_COUNTS:
+            databases = {}
+            for name in GeoTools.PROXIMITY_TARGETS:
+                databases[name] = os.path.join(tmp, f"{name}-{rows}.sqlite")
+                build_database(databases[name], rows)
+
+            start = time.perf_counter()
+            edges = GeoTools.build_proximity_graph(K, databases)
+            elapsed = time.perf_counter() - start
+
+            assert edges == rows * K * len(GeoTools.PROXIMITY_TARGETS)
+            print(f"{rows:>12} {edges:>10} {elapsed:>11.2f}")
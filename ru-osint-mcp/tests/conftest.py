@@ -0,0 +1,66 @@
+"""Shared fixtures: a scratch copy of the server layout and synthetic asset rows."""
+
+import shutil
+import sqlite3
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from modules import ConnectionPool, GeoTools, Geocoder
+
+def site(n: int, lat: float, lon: float, **fields) -> dict:
+    """A parsed ground forces row with its own Osint source id."""
+    row = {
+        "country": "RUS",
+        "location": f"Site {n}",
+        "oblast": "Moscow Oblast",
+        "main_user": f"{n}th Brigade",
+        "state": "Active",
+        "image": f"https://www.google.com/maps/@{lat},{lon},500m",
+        "kml": f"https://www.osint-rumiloc.com/kml/Osint_{n:04d}.kml",
+        "lat": lat,
+        "lon": lon,
+        "coord_source": "image"
+    }
+    row.update(fields)
+    return row
+
+def write_tables(path: str, tables: dict) -> None:
+    """Writes {table: rows} to a database the way the parsers first create it, then indexes it."""
+    conn = sqlite3.connect(path)
+    for table, rows in tables.items():
+        columns = list(rows[0])
+        conn.execute(f"CREATE TABLE `{table}` ({', '.join(f'`{c}`' for c in columns)})")
+        conn.executemany(
+            f"INSERT INTO `{table}` VALUES ({', '.join('?' for _ in columns)})",
+            [[row[c] for c in columns] for row in rows]
+        )
+    GeoTools.build_spatial_index(conn)
+    conn.commit()
+    conn.close()
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    """
+        Runs the test from the "modules" folder of an empty copy of the
+        server layout, so that the relative database, gazetteer and
+        settings paths of the modules all resolve inside tmp_path.
+    """
+    shutil.copytree(ROOT / "config", tmp_path / "config")
+    for folder in ("modules", "sqlite-database", "logs"):
+        (tmp_path / folder).mkdir()
+
+    monkeypatch.chdir(tmp_path / "modules")
+    monkeypatch.setattr(Geocoder, "_gazetteer", None)
+    monkeypatch.setattr(GeoTools, "_arrays_cache", {})
+
+    yield tmp_path
+
+    for path in GeoTools.DATABASES.values():
+        ConnectionPool.invalidate(path)
+    if Geocoder._gazetteer is not None:
+        Geocoder._gazetteer.conn.close()
@@ -0,0 +1,216 @@
+"""Incremental ingest: row keys, upserts and the derived indexes it updates."""
+
+import json
+import sqlite3
+
+import pytest
+
+from conftest import site, write_tables
+from modules import GeoTools, Geocoder, Ingest, POI, QueryEngine, ResultCache
+
+DB = "../sqlite-database/ru-ground-forces.sqlite"
+
+def ingest(tables: dict, path: str = DB) -> Ingest.ChangeSet:
+    """Applies {table: rows} to a database the way the parsers push them."""
+    conn = sqlite3.connect(path)
+    changes = Ingest.begin(conn)
+    for table, rows in tables.items():
+        Ingest.upsert(conn, table, rows, changes)
+    if changes:
+        moves = GeoTools.update_spatial_index(conn, changes)
+        GeoTools.update_density_grid(conn, moves)
+        GeoTools.update_cluster_index(conn, moves)
+        QueryEngine.build_filter_columns(conn, changes)
+        QueryEngine.update_fulltext_index(conn, changes)
+        changes.record(conn)
+    conn.commit()
+    conn.close()
+    return changes
+
+def rows_of(table: str, path: str = DB) -> list:
+    conn = sqlite3.connect(path)
+    cursor = conn.execute(f"SELECT {', '.join(Ingest.data_columns(conn.cursor(), table))} FROM `{table}` ORDER BY rowid")
+    columns = [col[0] for col in cursor.description]
+    rows = [dict(zip(columns, values)) for values in cursor.fetchall()]
+    conn.close()
+    return rows
+
+def asset_ids(path: str = DB) -> dict:
+    """asset key -> asset id of the spatial index."""
+    conn = sqlite3.connect(path)
+    ids = dict(conn.execute("SELECT asset_key, id FROM _asset_index"))
+    conn.close()
+    return ids
+
+def fetch(query: str, path: str = DB) -> list:
+    conn = sqlite3.connect(path)
+    rows = conn.execute(query).fetchall()
+    conn.close()
+    return sorted(rows)
+
+def sites(*numbers: int) -> list:
+    return [site(n, 50.0 + n * 0.05, 30.0 + n * 0.05) for n in numbers]
+
+def test_row_keys_use_the_source_id_and_rank_duplicates():
+    rows = sites(1, 2) + sites(1)
+    rows.append(dict(site(3, 51.0, 31.0), kml=None))
+    rows.append({"locations": "Plant", "loc_id": "POI-7", "kml": None})
+
+    assert [json.loads(key) for key in GeoTools.row_keys(rows)] == [
+        ["kml", "Osint_0001", 0],
+        ["kml", "Osint_0002", 0],
+        ["kml", "Osint_0001", 1],
+        ["name", "Site 3", "Moscow Oblast", 0],
+        ["loc_id", "POI-7", 0]
+    ]
+
+def test_edited_row_keeps_its_key(workspace):
+    ingest({"barracks": sites(1, 2, 3)})
+    ids = asset_ids()
+
+    moved = sites(1, 2, 3)
+    moved[1].update(lat=52.5, lon=33.5, location="Renamed", main_user="Other Brigade")
+    changes = ingest({"barracks": moved})
+
+    assert changes.summary() == {"barracks": {"inserted": 0, "updated": 1, "deleted": 0}}
+    assert asset_ids() == ids
+    assert rows_of("barracks") == moved
+
+def test_upsert_inserts_updates_and_deletes_in_place(workspace):
+    ingest({"barracks": sites(1, 2, 3, 4)})
+    conn = sqlite3.connect(DB)
+    rowids = dict(conn.execute("SELECT location, rowid FROM barracks"))
+    conn.close()
+
+    rows = sites(1, 2, 4, 5)
+    rows[1]["state"] = "Abandoned"
+    changes = ingest({"barracks": rows})
+
+    assert changes.summary() == {"barracks": {"inserted": 1, "updated": 1, "deleted": 1}}
+    assert sorted(map(tuple, rows_of("barracks")), key=str) == sorted(map(tuple, rows), key=str)
+    conn = sqlite3.connect(DB)
+    assert conn.execute("SELECT rowid FROM barracks WHERE location = 'Site 2'").fetchone()[0] == rowids["Site 2"]
+    assert conn.execute("SELECT COUNT(*) FROM _row_state").fetchone()[0] == 4
+    assert conn.execute("SELECT COUNT(*) FROM _change_log").fetchone()[0] == 4 + 3
+    conn.close()
+
+    assert not ingest({"barracks": rows})
+
+def test_duplicates_keep_distinct_keys(workspace):
+    changes = ingest({"barracks": sites(1, 1, 2)})
+    assert changes.summary()["barracks"]["inserted"] == 3
+    assert len(asset_ids()) == 3
+
+    changes = ingest({"barracks": sites(1, 2)})
+    assert changes.summary() == {"barracks": {"inserted": 0, "updated": 0, "deleted": 1}}
+    assert sorted(asset_ids()) == sorted(GeoTools.row_keys(sites(1, 2)))
+
+def test_new_columns_reload_the_table(workspace):
+    ingest({"barracks": sites(1, 2)})
+    ids = asset_ids()
+
+    rows = [dict(row, rail="https://example.org") for row in sites(1, 2)]
+    changes = ingest({"barracks": rows})
+
+    assert changes.reloaded == {"barracks"}
+    assert changes.summary() == {"barracks": {"inserted": 2, "updated": 0, "deleted": 0}}
+    assert rows_of("barracks") == rows
+    assert asset_ids() == ids
+
+def test_legacy_database_is_rekeyed_without_changes(workspace):
+    write_tables(DB, {"barracks": sites(1, 2, 3)})
+    conn = sqlite3.connect(DB)
+    conn.execute("DROP TABLE _asset_rtree")
+    conn.execute("DROP TABLE _asset_index")
+    conn.execute("CREATE TABLE _asset_index (id INTEGER PRIMARY KEY, table_name TEXT, asset_rowid INTEGER, lat REAL, lon REAL)")
+    conn.execute("INSERT INTO _asset_index SELECT rowid + 40, 'barracks', rowid, lat, lon FROM barracks")
+    conn.commit()
+    conn.close()
+
+    rows = sites(1, 2, 3)
+    rows[2]["state"] = "Abandoned"
+    changes = ingest({"barracks": rows})
+
+    assert changes.summary() == {"barracks": {"inserted": 0, "updated": 1, "deleted": 0}}
+    assert asset_ids() == dict(zip(GeoTools.row_keys(rows), [41, 42, 43]))
+
+def test_fulltext_index_drops_old_values(workspace):
+    ingest({"barracks": sites(1, 2, 3)})
+
+    rows = sites(1, 3, 4)
+    rows[0]["location"] = "Kantemirovka"
+    ingest({"barracks": rows})
+
+    conn = sqlite3.connect(DB)
+    conn.execute("INSERT INTO _fts_barracks (_fts_barracks) VALUES ('integrity-check')")
+    match = "SELECT location FROM barracks WHERE rowid IN (SELECT rowid FROM _fts_barracks WHERE _fts_barracks MATCH ?)"
+    assert conn.execute(match, ('location:"Kantemir"',)).fetchall() == [("Kantemirovka",)]
+    assert conn.execute(match, ('location:"Site 1"',)).fetchall() == []
+    assert conn.execute(match, ('location:"Site 2"',)).fetchall() == []
+    assert conn.execute(match, ('location:"Site 4"',)).fetchall() == [("Site 4",)]
+    conn.close()
+
+def test_incremental_indexes_match_a_full_rebuild(workspace):
+    ingest({"barracks": sites(*range(1, 30)), "depots": sites(*range(100, 110))})
+    ids = asset_ids()
+
+    barracks = sites(*range(1, 25), 40, 41)
+    barracks[3].update(lat=60.0, lon=40.0)
+    barracks[7]["location"] = "Renamed"
+    ingest({"barracks": barracks, "depots": sites(*range(100, 108))})
+
+    kept = asset_ids()
+    assert {key: ids[key] for key in kept if key in ids} == {key: kept[key] for key in kept if key in ids}
+    assert min(kept[key] for key in kept if key not in ids) > max(ids.values())
+    rtree, index = fetch("SELECT id, min_lat, min_lon FROM _asset_rtree"), fetch("SELECT id, lat, lon FROM _asset_index")
+    assert [row[0] for row in rtree] == [row[0] for row in index]
+    assert [value for row in rtree for value in row[1:]] == pytest.approx([value for row in index for value in row[1:]], abs=1e-4)
+
+    density = fetch("SELECT * FROM _asset_density")
+    clusters = fetch("SELECT * FROM _asset_clusters")
+    conn = sqlite3.connect(DB)
+    GeoTools.build_density_grid(conn)
+    GeoTools.build_cluster_index(conn)
+    conn.commit()
+    conn.close()
+
+    assert density == fetch("SELECT * FROM _asset_density")
+    assert [row[:4] + row[6:] for row in clusters] == [row[:4] + row[6:] for row in fetch("SELECT * FROM _asset_clusters")]
+    assert [value for row in clusters for value in row[4:6]] == pytest.approx(
+        [value for row in fetch("SELECT * FROM _asset_clusters") for value in row[4:6]]
+    )
+
+def poi(n: int, **fields) -> dict:
+    row = {
+        "locations": f"Plant {n}", "user": "MIL", "type_of_locations": "Storage", "type_of_change": "Routine works",
+        "loc_id": f"POI-{n}", "start": "2024", "image_s": None, "state": "Active", "image_c": None,
+        "street_link": f"https://www.openstreetmap.org/?mlat={50 + n}&mlon={30 + n}", "kml": None
+    }
+    row.update(fields)
+    row.update(GeoTools.extract_coordinates(row))
+    return row
+
+def test_failed_push_rolls_back(workspace, monkeypatch):
+    (workspace / "tables" / "POI").mkdir(parents=True)
+    (workspace / "tables" / "POI" / "points_of_interest.html").write_text("", encoding="utf-8")
+    path = "../sqlite-database/ru-poi.sqlite"
+
+    parser = POI.POI_Parser()
+    parser.parsed["points_of_interest"] = [poi(1), poi(2)]
+    assert parser.push_to_database()
+    assert parser.changes == {"points_of_interest": {"inserted": 2, "updated": 0, "deleted": 0}}
+
+    before = {table: fetch(f"SELECT * FROM {table}", path) for table in ("points_of_interest", "_row_state", "_asset_index")}
+    places = Geocoder.gazetteer().conn.execute("SELECT * FROM places ORDER BY rowid").fetchall()
+    generation = ResultCache.generation()
+
+    def fail(conn, changes):
+        raise sqlite3.OperationalError("disk I/O error")
+
+    monkeypatch.setattr(QueryEngine, "update_fulltext_index", fail)
+    parser.parsed["points_of_interest"] = [poi(1, state="Abandoned"), poi(3)]
+    assert not parser.push_to_database()
+
+    assert before == {table: fetch(f"SELECT * FROM {table}", path) for table in before}
+    assert places == Geocoder.gazetteer().conn.execute("SELECT * FROM places ORDER BY rowid").fetchall()
+    assert ResultCache.generation() == generation
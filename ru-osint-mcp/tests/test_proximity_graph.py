@@ -0,0 +1,93 @@
+"""The precomputed proximity graph and the related_assets lookup."""
+
+import sqlite3
+
+from conftest import site, write_tables
+from modules import GeoTools
+
+K = 2
+
+def build(workspace) -> dict:
+    """Three small databases: ground sites on a line, an airfield and two depots next to them."""
+    write_tables(GeoTools.DATABASES["ground"], {
+        "barracks": [site(n, 50.0 + n * 0.1, 30.0) for n in range(1, 6)],
+        "other_barracks": [site(n, 50.0 + n * 0.1, 30.5) for n in range(6, 8)]
+    })
+    write_tables(GeoTools.DATABASES["airfield"], {
+        "military_air_bases": [site(20, 50.3, 30.2, location=None, air_base="Airbase 20")]
+    })
+    write_tables(GeoTools.DATABASES["depot"], {
+        "central_depots": [
+            site(30, 50.1, 29.9, location=None, locations="Depot 30"),
+            site(31, 51.0, 31.0, location=None, locations="Depot 31")
+        ]
+    })
+    return {mode: GeoTools.DATABASES[mode] for mode in GeoTools.PROXIMITY_TARGETS}
+
+def asset_id(table: str, location: str) -> int:
+    conn = sqlite3.connect(GeoTools.DATABASES["ground"])
+    found = conn.execute(
+        f"SELECT i.id FROM _asset_index i JOIN `{table}` t ON t.rowid = i.asset_rowid "
+        "WHERE i.table_name = ? AND t.location = ?",
+        (table, location)
+    ).fetchone()[0]
+    conn.close()
+    return found
+
+def test_graph_links_every_ground_site(workspace):
+    databases = build(workspace)
+
+    # 7 ground sites, each with K other ground sites, 1 airfield and K depots
+    assert GeoTools.build_proximity_graph(K, databases) == 7 * (K + 1 + K)
+
+    conn = sqlite3.connect(databases["ground"])
+    assert conn.execute("SELECT COUNT(*) FROM _asset_links WHERE target_database = 'ground' AND asset_id = target_asset_id").fetchone()[0] == 0
+    conn.close()
+
+def test_related_returns_the_nearest_assets(workspace):
+    GeoTools.build_proximity_graph(K, build(workspace))
+
+    result = GeoTools.related(asset_id("barracks", "Site 1"), "ground")
+
+    assert result["asset"]["location"] == "Site 1"
+    assert [row["location"] for row in result["ground"]] == ["Site 2", "Site 3"]
+    assert [row["air_base"] for row in result["airfield"]] == ["Airbase 20"]
+    assert [row["locations"] for row in result["depot"]] == ["Depot 30", "Depot 31"]
+    for rows in (result["ground"], result["depot"]):
+        assert [row["distance_km"] for row in rows] == sorted(row["distance_km"] for row in rows)
+
+def test_related_rejects_ids_of_other_databases(workspace):
+    GeoTools.build_proximity_graph(K, build(workspace))
+
+    assert "error" in GeoTools.related(asset_id("barracks", "Site 1"), "airfield")
+    assert "error" in GeoTools.related(999, "ground")
+
+def test_related_reports_a_row_removed_since_indexing(workspace):
+    GeoTools.build_proximity_graph(K, build(workspace))
+    removed = asset_id("barracks", "Site 1")
+
+    conn = sqlite3.connect(GeoTools.DATABASES["ground"])
+    conn.execute("DELETE FROM barracks WHERE location = 'Site 1'")
+    conn.commit()
+    conn.close()
+
+    assert "error" in GeoTools.related(removed, "ground")
+
+def test_asset_ids_survive_a_rebuild(workspace):
+    build(workspace)
+    ids = {n: asset_id("barracks", f"Site {n}") for n in range(1, 6)}
+
+    conn = sqlite3.connect(GeoTools.DATABASES["ground"])
+    last = conn.execute("SELECT MAX(id) FROM _asset_index").fetchone()[0]
+    conn.execute("DELETE FROM barracks WHERE location = 'Site 2'")
+    conn.execute("UPDATE barracks SET lat = lat + 1, state = 'Abandoned' WHERE location = 'Site 4'")
+    conn.execute(
+        "INSERT INTO barracks (location, oblast, kml, lat, lon) "
+        "VALUES ('Site 9', 'Moscow Oblast', 'https://www.osint-rumiloc.com/kml/Osint_0009.kml', 52.0, 31.0)"
+    )
+    GeoTools.build_spatial_index(conn)
+    conn.commit()
+    conn.close()
+
+    assert {n: asset_id("barracks", f"Site {n}") for n in (1, 3, 4, 5)} == {n: ids[n] for n in (1, 3, 4, 5)}
+    assert asset_id("barracks", "Site 9") > last
@@ -0,0 +1,40 @@
+"""Corridor search along a route with assets_along_route."""
+
+import pytest
+
+from conftest import site, write_tables
+from modules import GeoTools
+
+ROUTE = [(50.0, 30.0), (50.0, 32.0), (51.0, 32.0)]
+
+def build(workspace) -> None:
+    write_tables(GeoTools.DATABASES["ground"], {
+        "barracks": [
+            site(1, 50.05, 31.5),       # beside the first leg, ~5.6 km off
+            site(2, 50.5, 31.0),        # ~55 km off
+            site(3, 50.5, 32.1),        # beside the second leg, ~7 km off
+            site(4, 50.0, 29.95)        # just before the start
+        ]
+    })
+    write_tables(GeoTools.DATABASES["depot"], {
+        "central_depots": [site(5, 49.97, 30.5, location=None, locations="Depot 5")]
+    })
+
+def test_assets_are_ordered_along_the_route(workspace):
+    build(workspace)
+
+    found = GeoTools.along_route(ROUTE, 10, ["ground", "depot"])
+
+    assert [row.get("location") or row.get("locations") for row in found] == ["Site 4", "Depot 5", "Site 1", "Site 3"]
+    assert [row["database"] for row in found] == ["ground", "depot", "ground", "ground"]
+    assert found[0]["route_km"] == 0
+    assert found[1]["route_km"] == pytest.approx(GeoTools.distance((50.0, 30.0), (50.0, 30.5)), abs=1)
+    # legs are great circles, bowing slightly north of the parallel
+    assert found[1]["distance_km"] == pytest.approx(GeoTools.distance((49.97, 30.5), (50.0, 30.5)), abs=0.5)
+    assert all(row["distance_km"] <= 10 for row in found)
+
+def test_buffer_widens_the_corridor(workspace):
+    build(workspace)
+
+    assert len(GeoTools.along_route(ROUTE, 10, ["ground"])) == 3
+    assert len(GeoTools.along_route(ROUTE, 60, ["ground"])) == 4
@@ -0,0 +1,63 @@
+"""Map markers from the precomputed cluster index with map_viewport."""
+
+import sqlite3
+
+from conftest import site, write_tables
+from modules import GeoTools
+
+WORLD = (-85.0, -180.0, 85.0, 180.0)
+
+def build(mode: str, tables: dict) -> None:
+    path = GeoTools.DATABASES[mode]
+    write_tables(path, tables)
+    conn = sqlite3.connect(path)
+    GeoTools.build_cluster_index(conn)
+    conn.commit()
+    conn.close()
+
+def build_all(workspace) -> None:
+    build("ground", {
+        "barracks": [site(n, 55.0 + n * 0.01, 37.0) for n in range(1, 4)],
+        "other_barracks": [site(4, 45.0, 40.0)]
+    })
+    build("airfield", {
+        "military_air_bases": [site(5, 55.02, 37.01, location=None, air_base="Airbase 5")]
+    })
+
+def test_low_zoom_merges_databases_into_one_marker(workspace):
+    build_all(workspace)
+
+    markers = GeoTools.viewport(["ground", "airfield"], 0, WORLD)
+
+    assert len(markers) == 1
+    assert markers[0]["count"] == 5
+    assert markers[0]["dominant_type"] == "barracks"
+    assert markers[0]["type_counts"] == {"barracks": 3, "other_barracks": 1, "military_air_bases": 1}
+    assert "asset_id" not in markers[0]
+
+def test_high_zoom_markers_name_their_asset(workspace):
+    build_all(workspace)
+
+    markers = GeoTools.viewport(["ground", "airfield"], GeoTools.CLUSTER_MAX_ZOOM, WORLD)
+
+    assert sorted(m["count"] for m in markers) == [1] * 5
+    labels = {(m["database"], m["label"]) for m in markers}
+    assert labels == {("ground", f"Site {n}") for n in range(1, 5)} | {("airfield", "Airbase 5")}
+
+def test_bbox_limits_the_markers(workspace):
+    build_all(workspace)
+
+    markers = GeoTools.viewport(["ground"], 8, (44.0, 39.0, 46.0, 41.0))
+
+    assert [(m["count"], m.get("label")) for m in markers] == [(1, "Site 4")]
+
+def test_bbox_across_the_antimeridian(workspace):
+    build("ground", {"barracks": [site(1, 65.0, 179.5), site(2, 65.0, -179.5), site(3, 65.0, 170.0)]})
+
+    markers = GeoTools.viewport(["ground"], GeoTools.CLUSTER_MAX_ZOOM, (64.0, 179.0, 66.0, -179.0))
+
+    assert sorted(m["label"] for m in markers) == ["Site 1", "Site 2"]
+
+def test_map_viewport_validates_the_bbox(workspace):
+    assert "error" in GeoTools.map_viewport([60.0, 30.0, 50.0, 40.0], 5)
+    assert "error" in GeoTools.map_viewport([50.0, 30.0, 60.0], 5)